@@ -2,6 +2,7 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Optional
 from key_manager import KeyManager
+from message_cache import FormatCache
 
 class AIModelInterface(ABC):
     """Abstract base class for AI model implementations"""
@@ -13,7 +14,10 @@ class AIModelInterface(ABC):
         Args:
             service_name: Name of the service ('openai', 'anthropic', 'google', 'x')
         """
+        self.service_name = service_name
         self.api_key = KeyManager.load_key(service_name)
+        # Formatted messages from earlier turns, reused by format_messages
+        self.format_cache = FormatCache()
     
     @abstractmethod
     def generate_response(self, 
@@ -0,0 +1,203 @@
+# audio_capture.py
+import logging
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+import sounddevice as sd
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_OVERFLOWS = metrics.counter("audio_input_overflows_total", "Input blocks the audio device dropped")
+
+
+class AudioCapture:
+    """
+    Always-open microphone capture into a preallocated ring buffer.
+
+    The input stream runs for the lifetime of the app and its callback copies
+    small blocks (20 ms by default) into a fixed NumPy ring. Starting a
+    recording only notes the current position, minus a pre-roll, so the
+    first syllable spoken just before the key press is kept; stopping
+    notes the end position and copies the span out once. Stopping therefore
+    takes at most one block, and nothing grows while a recording runs.
+
+    Recordings longer than the ring keep only their last max_seconds.
+    """
+
+    def __init__(self,
+                 sample_rate: int = 44100,
+                 block_ms: int = 20,
+                 preroll_seconds: Optional[float] = None,
+                 max_seconds: float = 120.0,
+                 device=None):
+        """
+        Args:
+            sample_rate: Capture rate of the input device
+            block_ms: Callback block size; also the worst-case stop delay
+            preroll_seconds: Audio kept from before begin(), defaults to
+                CYBERDECK_PREROLL_MS (300 ms)
+            max_seconds: Ring buffer length
+            device: sounddevice input device, None for the default, "none" for
+                no device (audio then only arrives through feed(), as in simulations)
+        """
+        if preroll_seconds is None:
+            preroll_seconds = int(os.environ.get("CYBERDECK_PREROLL_MS", "300")) / 1000
+        self.sample_rate = sample_rate
+        self.block_size = max(1, sample_rate * block_ms // 1000)
+        self.preroll_frames = int(preroll_seconds * sample_rate)
+        self.capacity = int(max_seconds * sample_rate)
+        self.device = device
+        self._ring = np.zeros(self.capacity, dtype=np.float32)
+        # Frames written since the stream started; only the callback writes it
+        self._written = 0
+        self._start_frame: Optional[int] = None
+        # Where the audio before the last recording (pre-roll included) ends
+        self._idle_end = 0
+        # Where the last recording ended, in the same frame count as position
+        self.end_frame = 0
+        self._stream: Optional[sd.InputStream] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        if self.device == "none":
+            return True
+        return self._stream is not None and self._stream.active
+
+    @property
+    def recording(self) -> bool:
+        return self._start_frame is not None
+
+    @property
+    def position(self) -> int:
+        """Frames captured since the stream started"""
+        return self._written
+
+    @property
+    def start_frame(self) -> Optional[int]:
+        """Position where the current recording starts, including pre-roll"""
+        return self._start_frame
+
+    def start(self) -> None:
+        """Open the input stream; safe to call again after a device error"""
+        with self._lock:
+            if self.running:
+                return
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = sd.InputStream(
+                channels=1,
+                samplerate=self.sample_rate,
+                dtype='float32',
+                blocksize=self.block_size,
+                device=self.device,
+                callback=self._callback
+            )
+            self._stream.start()
+            logger.debug("Audio capture running: %s Hz, %s-frame blocks, %.0f ms pre-roll",
+                         self.sample_rate, self.block_size, self.preroll_frames * 1000 / self.sample_rate)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def _callback(self, indata, frames, time_info, status) -> None:
+        """Runs on the audio thread: copy the block into the ring, nothing else"""
+        if status.input_overflow:
+            _OVERFLOWS.inc()
+        self.feed(indata[:frames, 0])
+
+    def feed(self, samples: np.ndarray) -> None:
+        """Append captured samples to the ring (audio thread, or a simulation in place of a device)"""
+        frames = len(samples)
+        position = self._written % self.capacity
+        first = min(frames, self.capacity - position)
+        self._ring[position:position + first] = samples[:first]
+        if first < frames:
+            self._ring[:frames - first] = samples[first:frames]
+        self._written += frames
+
+    def begin(self, preroll_seconds: Optional[float] = None) -> None:
+        """
+        Start a recording, including the pre-roll already in the ring
+        Args:
+            preroll_seconds: Overrides the configured pre-roll, e.g. to include
+                speech detected before the recording was started
+        """
+        if not self.running:
+            self.start()
+        preroll = self.preroll_frames if preroll_seconds is None else int(preroll_seconds * self.sample_rate)
+        self._start_frame = self._idle_end = max(0, self._written - min(preroll, self.capacity))
+
+    def end(self) -> np.ndarray:
+        """
+        Finish the recording
+        Returns:
+            np.ndarray: Mono float32 samples from begin() (minus pre-roll) to now
+        """
+        start = self._start_frame
+        self._start_frame = None
+        if start is None:
+            return np.zeros(0, dtype=np.float32)
+        end = self.end_frame = self._written
+        if end - start > self.capacity:
+            logger.warning("Recording longer than %.0f s, keeping the end", self.capacity / self.sample_rate)
+            start = end - self.capacity
+        return self._copy(start, end)
+
+    def latest(self, seconds: float) -> np.ndarray:
+        """Copy the newest captured audio, whether or not a recording is running"""
+        end = self._written
+        return self._copy(max(0, end - int(seconds * self.sample_rate), end - self.capacity), end)
+
+    def idle(self, seconds: float = 2.0) -> np.ndarray:
+        """
+        Copy the audio captured just before the last recording and its pre-roll,
+        e.g. to measure the room's noise floor
+        Returns:
+            np.ndarray: Up to seconds of mono float32 samples; empty if none is left in the ring
+        """
+        end = self._idle_end
+        start = max(0, end - int(seconds * self.sample_rate), self._written - self.capacity)
+        if start >= end:
+            return np.zeros(0, dtype=np.float32)
+        return self._copy(start, end)
+
+    def span(self, start: int, end: int) -> np.ndarray:
+        """
+        Copy captured audio between two positions
+        Returns:
+            np.ndarray: Mono float32 samples; only the newest max_seconds are still available
+        """
+        return self._copy(max(start, end - self.capacity), end)
+
+    def tail(self, seconds: float) -> np.ndarray:
+        """
+        Copy the newest audio of the current recording, for live analysis
+        Returns:
+            np.ndarray: Up to seconds of mono float32 samples, empty when not recording
+        """
+        start = self._start_frame
+        if start is None:
+            return np.zeros(0, dtype=np.float32)
+        end = self._written
+        start = max(start, end - int(seconds * self.sample_rate), end - self.capacity)
+        return self._copy(start, end)
+
+    def _copy(self, start: int, end: int) -> np.ndarray:
+        audio = np.empty(end - start, dtype=np.float32)
+        first_position = start % self.capacity
+        first = min(len(audio), self.capacity - first_position)
+        audio[:first] = self._ring[first_position:first_position + first]
+        audio[first:] = self._ring[:len(audio) - first]
+        return audio
+
+    def cancel(self) -> None:
+        """Drop the current recording"""
+        self._start_frame = None
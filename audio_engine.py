@@ -0,0 +1,346 @@
+# audio_engine.py
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import sounddevice as sd
+
+from metrics import metrics
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+_FIRST_AUDIO = metrics.histogram("tts_time_to_first_audio_seconds",
+                                 "From a reply's text to its first audio on the output device",
+                                 buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0))
+_UNDERRUNS = metrics.counter("tts_underruns_total", "Times speech ran out in the middle of an utterance")
+_PREEMPTED = metrics.counter("tts_preempted_total", "Utterances dropped by a flush or an interrupting utterance")
+
+# Lower values are spoken first
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 10
+
+# render(text, voice, emit, cancelled): produce a clip's PCM through emit(bytes),
+# giving up early once cancelled() is true
+Renderer = Callable[[str, str, Callable[[bytes], None], Callable[[], bool]], None]
+
+
+class Utterance:
+    """
+    Text queued for speaking, split into clips (sentences) that are rendered
+    and played in order.
+    """
+
+    def __init__(self, clips: List[str], voice: str, priority: int = PRIORITY_NORMAL,
+                 status_callback: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            clips: Text of each clip, in speaking order
+            voice: Voice the renderer should use
+            priority: Queue position among waiting utterances; lower goes first
+            status_callback: Receives status messages as the utterance progresses
+        """
+        self.clips = clips
+        self.voice = voice
+        self.priority = priority
+        self.status_callback = status_callback
+        self.requested = time.monotonic()
+        self.cancelled = False
+        # Index of the next clip to render
+        self.next_clip = 0
+        # Monotonic time of the first audio written to the device
+        self.started_at: Optional[float] = None
+        # Called once when no more clips will be rendered, finished or cancelled
+        self.on_rendered: Optional[Callable[[], None]] = None
+
+    def _status(self, message: str) -> None:
+        if self.status_callback:
+            self.status_callback(message)
+
+    def _rendered(self) -> None:
+        """Run on_rendered once (engine lock held)"""
+        callback, self.on_rendered = self.on_rendered, None
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Error in rendered callback: %s", e)
+
+
+class _Clip:
+    def __init__(self, utterance: Utterance, index: int):
+        self.utterance = utterance
+        self.index = index
+        # PCM bytes as they are rendered, None at the end
+        self.chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+
+    @property
+    def last(self) -> bool:
+        return self.index == len(self.utterance.clips) - 1
+
+
+class AudioEngine:
+    """
+    Long-lived speech output that owns the output device.
+
+    Utterances wait in a priority queue. A renderer thread synthesizes their
+    clips in speaking order, up to prefetch_clips ahead of the clip being
+    played, and a player thread writes the rendered PCM to one output stream
+    that stays open. The next clip is usually ready before the current one
+    ends, so clips and utterances play back to back. flush() (Esc) and
+    interrupting utterances drop everything queued and cut the current clip
+    within one write. Callers never wait for synthesis or playback.
+    """
+
+    def __init__(self,
+                 render: Renderer,
+                 sample_rate: int,
+                 device=None,
+                 prefetch_clips: int = 3,
+                 write_bytes: int = 2400):
+        """
+        Args:
+            render: Produces the 16-bit mono PCM of one clip
+            sample_rate: Rate of the rendered PCM
+            device: sounddevice output device, None for the default, "none" to discard audio
+            prefetch_clips: Clips rendered ahead of playback
+            write_bytes: Largest write to the device, and so the worst-case stop delay
+        """
+        self.render = render
+        self.sample_rate = sample_rate
+        self.device = device
+        self.prefetch_clips = prefetch_clips
+        self.write_bytes = write_bytes
+        self._condition = threading.Condition()
+        self._order = itertools.count()
+        # (priority, order, utterance) not yet being rendered
+        self._waiting: List = []
+        # The utterance whose clips are being rendered
+        self._rendering: Optional[Utterance] = None
+        self._render_active = False
+        # Clips handed to the player, in speaking order; the first one is playing
+        self._queued: "deque[_Clip]" = deque()
+        self._playing: Optional[_Clip] = None
+        self._stream: Optional[sd.RawOutputStream] = None
+        # Replaces the sound device when set: output(pcm) -> underflowed, e.g. to simulate one
+        self.output: Optional[Callable[[bytes], bool]] = None
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._render_loop, name="speech renderer", daemon=True),
+            threading.Thread(target=self._play_loop, name="speech player", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def playing(self) -> bool:
+        return self._playing is not None
+
+    @property
+    def depth(self) -> int:
+        """Clips waiting to be played, including the one playing"""
+        with self._condition:
+            depth = len(self._queued) + sum(len(u.clips) - u.next_clip for _, _, u in self._waiting)
+            if self._rendering is not None:
+                depth += len(self._rendering.clips) - self._rendering.next_clip
+            return depth
+
+    def speak(self, utterance: Utterance, interrupt: bool = False) -> None:
+        """
+        Queue an utterance
+        Args:
+            interrupt: Drop everything playing or queued first
+        """
+        with self._condition:
+            if not utterance.clips:
+                utterance._rendered()
+                return
+            if interrupt:
+                self._flush_locked()
+            heapq.heappush(self._waiting, (utterance.priority, next(self._order), utterance))
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        """Stop the current utterance and drop all queued ones"""
+        with self._condition:
+            self._flush_locked()
+            self._condition.notify_all()
+
+    def _flush_locked(self) -> None:
+        utterances = {u for _, _, u in self._waiting}
+        utterances.update(clip.utterance for clip in self._queued)
+        if self._rendering is not None:
+            utterances.add(self._rendering)
+        for utterance in utterances:
+            if not utterance.cancelled:
+                utterance.cancelled = True
+                _PREEMPTED.inc()
+            utterance._rendered()
+        for clip in self._queued:
+            # Wakes the player if it waits for this clip's audio
+            clip.chunks.put(None)
+        self._waiting.clear()
+        self._queued.clear()
+        self._rendering = None
+
+    def wait_rendered(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued clip is synthesized (not necessarily played)
+        Returns:
+            bool: False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._waiting and self._next_rendering() is None and not self._render_active,
+                timeout
+            )
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._running = False
+            self._flush_locked()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        if self._stream is not None:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+
+    # Renderer thread
+
+    def _next_rendering(self) -> Optional[Utterance]:
+        utterance = self._rendering
+        if utterance is not None and not utterance.cancelled and utterance.next_clip < len(utterance.clips):
+            return utterance
+        return None
+
+    def _take_clip(self) -> Optional[_Clip]:
+        """The next clip to render, in speaking order (lock held)"""
+        utterance = self._next_rendering()
+        while utterance is None and self._waiting:
+            utterance = heapq.heappop(self._waiting)[2]
+            if utterance.cancelled:
+                utterance = None
+        self._rendering = utterance
+        if utterance is None:
+            return None
+        clip = _Clip(utterance, utterance.next_clip)
+        utterance.next_clip += 1
+        return clip
+
+    def _render_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or (
+                    len(self._queued) < self.prefetch_clips
+                    and (self._next_rendering() is not None or self._waiting)))
+                if not self._running:
+                    return
+                clip = self._take_clip()
+                if clip is None:
+                    continue
+                self._queued.append(clip)
+                self._render_active = True
+                self._condition.notify_all()
+
+            utterance = clip.utterance
+            if clip.index == 0 and not self.playing:
+                utterance._status("Generating speech...")
+            try:
+                self.render(utterance.clips[clip.index], utterance.voice, clip.chunks.put,
+                            lambda: utterance.cancelled or not self._running)
+            except Exception as e:
+                logger.error("Error in text to speech conversion: %s", e)
+                utterance._status(f"Error: {e}")
+            finally:
+                clip.chunks.put(None)
+                with self._condition:
+                    if clip.last:
+                        utterance._rendered()
+                    self._render_active = False
+                    self._condition.notify_all()
+
+    # Player thread
+
+    def _play_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or self._queued)
+                if not self._running:
+                    return
+                clip = self._playing = self._queued[0]
+            try:
+                self._play_clip(clip)
+            except Exception as e:
+                logger.error("Error playing audio: %s", e)
+                clip.utterance._status(f"Error playing audio: {e}")
+            finally:
+                with self._condition:
+                    if self._queued and self._queued[0] is clip:
+                        self._queued.popleft()
+                    self._playing = None
+                    self._condition.notify_all()
+            if clip.utterance.cancelled:
+                self._drop_buffered()
+            elif clip.last and clip.utterance.started_at is not None:
+                clip.utterance._status("")
+
+    def _play_clip(self, clip: _Clip) -> None:
+        utterance = clip.utterance
+        while True:
+            chunk = clip.chunks.get()
+            if chunk is None or utterance.cancelled:
+                return
+            for offset in range(0, len(chunk), self.write_bytes):
+                if utterance.cancelled:
+                    return
+                first = utterance.started_at is None
+                if first:
+                    utterance.started_at = time.monotonic()
+                    _FIRST_AUDIO.observe(utterance.started_at - utterance.requested)
+                    tracer.instant("playback_start")
+                    utterance._status("Playing audio...")
+                # The device idles between utterances, so only later underflows are gaps
+                if self._write(chunk[offset:offset + self.write_bytes]) and not first:
+                    _UNDERRUNS.inc()
+
+    def _write(self, data: bytes) -> bool:
+        """Write PCM to the device, opening it on first use; returns True on underflow"""
+        if self.output is not None:
+            return self.output(data)
+        if self.device == "none":
+            return False
+        if self._stream is None:
+            self._stream = sd.RawOutputStream(
+                samplerate=self.sample_rate,
+                channels=1,
+                dtype='int16',
+                device=self.device,
+                latency='low'
+            )
+            self._stream.start()
+        try:
+            return self._stream.write(data)
+        except sd.PortAudioError as e:
+            # Reopened on the next write, e.g. after the device was unplugged
+            logger.warning("Audio output error: %s", e)
+            self._stream.close()
+            self._stream = None
+            return False
+
+    def _drop_buffered(self) -> None:
+        """Discard audio already handed to the device, so a stop is heard at once"""
+        if self._stream is not None:
+            try:
+                self._stream.abort()
+                self._stream.start()
+            except sd.PortAudioError as e:
+                logger.warning("Audio output error: %s", e)
+                self._stream.close()
+                self._stream = None
@@ -0,0 +1,107 @@
+# audio_upload.py
+import importlib.util
+import io
+import logging
+import time
+import wave
+from typing import Tuple
+
+import numpy as np
+
+from metrics import metrics
+from rate_limiter import RateLimiter
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Whisper works at 16 kHz; anything above is resampled away on the server
+TARGET_RATE = 16000
+# Low-pass taps used before downsampling (Hamming window, about 2.3 kHz transition at 44.1 kHz)
+FILTER_TAPS = 63
+
+_ENCODE_SECONDS = metrics.histogram("audio_encode_seconds", "Time to prepare a transcription upload",
+                                    ("format",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+_UPLOAD_BYTES = metrics.counter("audio_upload_bytes_total", "Audio bytes sent for transcription", ("format",))
+
+# FLAC needs libsndfile through the optional soundfile package; WAV needs nothing
+HAVE_FLAC = importlib.util.find_spec("soundfile") is not None
+
+
+def resample(audio: np.ndarray, source_rate: int, target_rate: int = TARGET_RATE) -> np.ndarray:
+    """
+    Downsample mono float32 audio with a windowed-sinc low-pass and linear interpolation
+    Args:
+        audio: Mono samples in [-1, 1]
+        source_rate: Rate of audio
+        target_rate: Output rate, lower than source_rate
+    """
+    if source_rate == target_rate or not len(audio):
+        return audio.astype(np.float32, copy=False)
+    # Cut off at 90% of the new Nyquist frequency so nothing aliases into speech
+    cutoff = 0.45 * target_rate / source_rate
+    n = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2
+    kernel = (2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FILTER_TAPS)).astype(np.float32)
+    filtered = np.convolve(audio, kernel / kernel.sum(), mode="same")
+    positions = np.arange(0, len(audio) - 1, source_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), filtered).astype(np.float32)
+
+
+def to_int16(audio: np.ndarray) -> np.ndarray:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def encode(samples: np.ndarray, sample_rate: int, audio_format: str = None) -> bytes:
+    """
+    Encode int16 mono samples in memory
+    Args:
+        audio_format: "flac" or "wav"; FLAC when soundfile is installed
+    """
+    audio_format = audio_format or ("flac" if HAVE_FLAC else "wav")
+    buffer = io.BytesIO()
+    if audio_format == "flac":
+        import soundfile
+        soundfile.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    else:
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def prepare_upload(audio: np.ndarray, sample_rate: int) -> Tuple[str, bytes, str]:
+    """
+    Turn captured audio into a transcription upload, without temp files or subprocesses
+    Args:
+        audio: Mono float32 samples
+        sample_rate: Capture rate of audio
+    Returns:
+        Tuple[str, bytes, str]: (file name, data, content type) as the OpenAI client accepts it
+    """
+    audio_format = "flac" if HAVE_FLAC else "wav"
+    start = time.perf_counter()
+    with tracer.span("audio_encode", format=audio_format):
+        data = encode(to_int16(resample(audio, sample_rate)), TARGET_RATE, audio_format)
+    elapsed = time.perf_counter() - start
+    _ENCODE_SECONDS.observe(elapsed, format=audio_format)
+    _UPLOAD_BYTES.inc(len(data), format=audio_format)
+    logger.debug("Encoded %.1f s of audio to %s bytes of %s in %.0f ms",
+                 len(audio) / sample_rate, len(data), audio_format, elapsed * 1000)
+    return f"speech.{audio_format}", data, f"audio/{audio_format}"
+
+
+def transcribe(client, upload: Tuple[str, bytes, str]) -> str:
+    """
+    Transcribe an upload from prepare_upload() with Whisper
+    Args:
+        client: OpenAI client
+        upload: (file name, data, content type)
+    """
+    with tracer.span("transcription"), RateLimiter.for_service("openai-whisper").limit():
+        transcription = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=upload
+        )
+    return transcription.text
+
@@ -0,0 +1,311 @@
+# benchmark.py
+"""
+End-to-end turn benchmark against local mock providers.
+
+Starts a mock server per provider (see mock_servers.py), points the app at
+them and drives ConversationManager.get_response through the text, camera,
+search and voice scenarios. Every turn includes speech synthesis. Results
+(p50/p95/p99 turn latency and throughput per provider and scenario) are
+written to a JSON file that can be compared with an earlier run:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --compare bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from logging_setup import setup_logging
+from mock_servers import CAMERA_TRIGGER, SEARCH_TRIGGER, MockBehavior, MockProviders
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ["ChatGPT", "Claude", "Gemini", "Grok", "Perplexity"]
+
+SCENARIOS = {
+    "text": "Tell me something interesting about the Raspberry Pi.",
+    "camera": "What can you see in camera 1?",
+    "camera_directive": f"Can you check what is in front of me? {CAMERA_TRIGGER}",
+    "search": f"What are the newest camera modules? {SEARCH_TRIGGER}",
+    "voice": None,  # Whisper transcription, then a text turn with the transcript
+}
+
+
+class FakeCamera:
+    """Stands in for Picamera2; returns a fixed frame in the main stream format"""
+
+    def __init__(self):
+        import numpy as np
+        frame = np.zeros((1232, 1640, 4), dtype=np.uint8)
+        frame[:, :, 0] = np.linspace(0, 255, 1640, dtype=np.uint8)
+        frame[:, :, 1] = np.linspace(0, 255, 1232, dtype=np.uint8)[:, None]
+        frame[:, :, 3] = 255
+        self.frame = frame
+
+    def capture_array(self, stream: str = "main"):
+        return self.frame.copy()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        "turns": len(values),
+        "errors": errors,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+        "throughput_per_s": len(values) / wall_time if wall_time > 0 else 0.0,
+    }
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+# Capture rate of DualCameraGPTApp
+RECORDING_RATE = 44100
+
+
+def make_recording(seconds: float = 2.0):
+    """Silent microphone capture, as AudioCapture.end() returns it"""
+    import numpy as np
+    return np.zeros(int(seconds * RECORDING_RATE), dtype=np.float32)
+
+
+def start_mock_environment(behaviors: Dict[str, MockBehavior]) -> MockProviders:
+    """Start the mock providers and point the app (imported afterwards) at them"""
+    mocks = MockProviders(behaviors)
+    os.environ.update(mocks.start())
+    # No audio device, metrics endpoint or trace files during the run
+    os.environ.setdefault("CYBERDECK_AUDIO_OUTPUT", "none")
+    os.environ["CYBERDECK_METRICS_PORT"] = "0"
+    os.environ["CYBERDECK_METRICS_SNAPSHOT"] = ""
+    # Synthesize every reply so speech latency is measured, not the speech cache
+    os.environ["CYBERDECK_TTS_CACHE_MB"] = "0"
+    # Never record benchmark traffic as a session
+    os.environ.pop("CYBERDECK_RECORD", None)
+    return mocks
+
+
+class TurnBenchmark:
+    """Drives ConversationManager turns against the mock providers"""
+
+    def __init__(self, work_dir: Path, verbose: bool = False):
+        # Imported here, after the environment points the app at the mocks
+        from audio_upload import prepare_upload, transcribe
+        from conversation_manager import ConversationManager
+        from key_manager import KeyManager
+        from rate_limiter import RateLimiter
+
+        self.work_dir = work_dir
+        self.verbose = verbose
+        self.prepare_upload = prepare_upload
+        self.transcribe = transcribe
+
+        # Mock servers accept any key; the app only needs the key files to exist
+        for key_file in KeyManager.DEFAULT_KEYS.values():
+            (work_dir / key_file).write_text("mock-key\n")
+
+        # Measure the pipeline, not the client-side budgets
+        for service in RateLimiter.DEFAULT_LIMITS:
+            RateLimiter.configure(service, requests_per_minute=1000000, tokens_per_minute=None)
+
+        with self._quiet():
+            self.manager = ConversationManager()
+            camera = FakeCamera()
+            self.manager.set_cameras(camera, camera)
+
+        self.recording = make_recording()
+
+    def _quiet(self):
+        if self.verbose:
+            return contextlib.nullcontext()
+        return contextlib.redirect_stdout(io.StringIO())
+
+    def _transcribe(self) -> str:
+        """Same Whisper call as DualCameraGPTApp.save_and_transcribe_audio"""
+        upload = self.prepare_upload(self.recording, RECORDING_RATE)
+        return self.transcribe(self.manager.client, upload)
+
+    def run_turn(self, scenario: str) -> bool:
+        """Run one turn; returns False if the turn ended in an error"""
+        with self._quiet():
+            prompt = SCENARIOS[scenario]
+            if prompt is None:
+                prompt = self._transcribe()
+            self.manager.get_response(prompt)
+            # Speech is synthesized in the background; a turn includes it, as before
+            self.manager.tts_manager.wait_synthesized()
+            self.manager.tts_manager.stop_playback()
+        return self.manager.last_outcome == "ok"
+
+    def run(self, providers: List[str], scenarios: List[str], iterations: int, warmup: int) -> Dict:
+        results: Dict[str, Dict] = {}
+        for provider in providers:
+            with self._quiet():
+                self.manager.set_ai_model(provider)
+            results[provider] = {}
+            for scenario in scenarios:
+                self.manager.clear_history()
+                for _ in range(warmup):
+                    self.run_turn(scenario)
+                self.manager.clear_history()
+
+                latencies = []
+                errors = 0
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    turn_start = time.perf_counter()
+                    try:
+                        ok = self.run_turn(scenario)
+                    except Exception as e:
+                        logger.warning("%s/%s turn raised: %s", provider, scenario, e)
+                        ok = False
+                    latencies.append(time.perf_counter() - turn_start)
+                    if not ok:
+                        errors += 1
+                wall_time = time.perf_counter() - started
+
+                summary = summarize(latencies, errors, wall_time)
+                results[provider][scenario] = summary
+                print(f"{provider:<11} {scenario:<17} p50 {summary['p50_ms']:8.1f} ms  "
+                      f"p95 {summary['p95_ms']:8.1f} ms  p99 {summary['p99_ms']:8.1f} ms  "
+                      f"{summary['throughput_per_s']:6.2f} turns/s  errors {errors}")
+        return results
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> int:
+    """
+    Print the change in latency against a baseline run
+    Returns:
+        int: Number of provider/scenario pairs whose p50 or p95 regressed by more than threshold
+    """
+    regressions = 0
+    print(f"\nCompared with {baseline.get('version', 'unknown')} ({baseline.get('created', '')}):")
+    for provider, scenarios in current["results"].items():
+        for scenario, summary in scenarios.items():
+            previous = baseline.get("results", {}).get(provider, {}).get(scenario)
+            if not previous:
+                continue
+            changes = []
+            regressed = False
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if previous[key] > 0:
+                    change = (summary[key] - previous[key]) / previous[key]
+                    changes.append(f"{key[:3]} {change:+7.1%}")
+                    if key != "p99_ms" and change > threshold:
+                        regressed = True
+            regressions += regressed
+            marker = "  REGRESSION" if regressed else ""
+            print(f"{provider:<11} {scenario:<17} {'  '.join(changes)}{marker}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the turn pipeline against local mock providers")
+    parser.add_argument("--providers", nargs="+", default=PROVIDERS, choices=PROVIDERS)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=20, help="Measured turns per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured turns per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock time to first token (s)")
+    parser.add_argument("--rate", type=float, default=200.0, help="Mock streaming rate (tokens/s)")
+    parser.add_argument("--reply-words", type=int, default=60, help="Length of mock replies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of failed requests")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p50/p95 slowdown reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's debug output")
+    args = parser.parse_args(argv)
+    setup_logging("DEBUG" if args.verbose else "WARNING")
+
+    behavior_settings = {
+        "first_token_latency": args.latency,
+        "tokens_per_second": args.rate,
+        "reply_words": args.reply_words,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+    }
+    behaviors = {
+        service: MockBehavior(seed=args.seed + index, **behavior_settings)
+        for index, service in enumerate(MockProviders.BASE_PATHS)
+    }
+    mocks = start_mock_environment(behaviors)
+
+    output_path = Path(args.output).resolve()
+    baseline_path = Path(args.compare).resolve() if args.compare else None
+    repo_dir = Path(__file__).resolve().parent
+    sys.path.insert(0, str(repo_dir))
+    original_dir = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="cyberdeck-bench-") as work_dir:
+        # Key files, sessions.db and captured images all live in the scratch directory
+        os.chdir(work_dir)
+        try:
+            bench = TurnBenchmark(Path(work_dir), verbose=args.verbose)
+            started = time.time()
+            results = bench.run(args.providers, args.scenarios, args.iterations, args.warmup)
+            elapsed = time.time() - started
+            mock_stats = mocks.stats()
+            bench.manager.session_store.close()
+        finally:
+            os.chdir(original_dir)
+            mocks.stop()
+
+    report = {
+        "version": git_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "settings": dict(behavior_settings, iterations=args.iterations, warmup=args.warmup),
+        "elapsed_s": elapsed,
+        "results": results,
+        "mock_requests": mock_stats,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("Warning: baseline was recorded with different settings")
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
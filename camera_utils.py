@@ -1,9 +1,15 @@
 # camera_utils.py
+import logging
 from picamera2 import Picamera2
 from PIL import Image
 import datetime
 import os
 from pathlib import Path
+from tracing import tracer
+from image_policy import DEFAULT_BUDGET, ImageBudget, encode_jpeg, resize_for_budget
+from session_recorder import recorder
+
+logger = logging.getLogger(__name__)
 
 class CameraManager:
     @staticmethod
@@ -20,22 +26,22 @@ class CameraManager:
                 cam = Picamera2(0)
                 cam.close()
                 available_cameras.append(0)
-                print("[DEBUG] Camera 1 detected")
+                logger.debug("Camera 1 detected")
             except Exception as e:
-                print(f"[DEBUG] Camera 1 not available: {e}")
+                logger.warning("Camera 1 not available: %s", e)
 
             # Try to detect Camera 2
             try:
                 cam = Picamera2(1)
                 cam.close()
                 available_cameras.append(1)
-                print("[DEBUG] Camera 2 detected")
+                logger.debug("Camera 2 detected")
             except Exception as e:
-                print(f"[DEBUG] Camera 2 not available: {e}")
+                logger.warning("Camera 2 not available: %s", e)
 
             return available_cameras
         except Exception as e:
-            print(f"[DEBUG] Error detecting cameras: {e}")
+            logger.warning("Error detecting cameras: %s", e)
             return []
 
     @staticmethod
@@ -107,7 +113,7 @@ class CameraManager:
             return filepath
             
         except Exception as e:
-            print(f"Error in high-res capture: {e}")
+            logger.error("Error in high-res capture: %s", e)
             # Ensure camera is reconfigured even if there's an error
             try:
                 camera.stop()
@@ -118,40 +124,37 @@ class CameraManager:
                 camera.configure(preview_config)
                 camera.start()
             except Exception as config_error:
-                print(f"Error reconfiguring camera: {config_error}")
+                logger.error("Error reconfiguring camera: %s", config_error)
             return None
 
     @staticmethod
-    def capture_and_convert(camera: Picamera2, camera_num: int) -> str:
-        """Capture image and convert to 512x512 for GPT usage"""
+    def capture_and_convert(camera: Picamera2, camera_num: int, budget: ImageBudget = DEFAULT_BUDGET) -> str:
+        """
+        Capture image and convert it for AI analysis
+        Args:
+            camera: Camera to capture from
+            camera_num: Camera number, used in the file name
+            budget: Size, crop and JPEG quality (see image_policy.py)
+        """
         final_path = f"camera{camera_num}.jpg"
         
         try:
             # Use main stream for capture (1640x1232)
-            image_array = camera.capture_array()
-            img = Image.fromarray(image_array, 'RGBA').convert('RGB')
-            
-            # Calculate aspect ratio preserving resize dimensions
-            aspect_ratio = img.width / img.height
-            if aspect_ratio > 1:
-                resize_width = int(512 * aspect_ratio)
-                resize_height = 512
-            else:
-                resize_width = 512
-                resize_height = int(512 / aspect_ratio)
-            
-            # Resize maintaining aspect ratio
-            img = img.resize((resize_width, resize_height), Image.Resampling.LANCZOS)
-            
-            # Crop to center 512x512
-            left = (resize_width - 512) // 2
-            top = (resize_height - 512) // 2
-            img = img.crop((left, top, left + 512, top + 512))
-            
-            img.save(final_path, "JPEG", quality=90)
+            with tracer.span("capture", camera=camera_num):
+                image_array = camera.capture_array()
+
+            with tracer.span("jpeg_encode", camera=camera_num, max_edge=budget.max_edge):
+                img = Image.fromarray(image_array, 'RGBA').convert('RGB')
+                img = resize_for_budget(img, budget)
+                data, quality = encode_jpeg(img, budget)
+                with open(final_path, "wb") as f:
+                    f.write(data)
+            logger.debug("Camera %s image: %sx%s, quality %s, %s bytes",
+                         camera_num, img.width, img.height, quality, len(data))
+            recorder.record_frame(camera_num, final_path, (image_array.shape[1], image_array.shape[0]))
             return final_path
             
         except Exception as e:
-            print(f"Error in image processing: {e}")
+            logger.error("Error in image processing: %s", e)
             return None
 
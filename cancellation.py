@@ -0,0 +1,110 @@
+# cancellation.py
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TurnCancelled(Exception):
+    """Raised inside a turn when the user cancels it"""
+
+
+class CancelToken:
+    """
+    Cancellation signal shared by all work belonging to one turn.
+
+    Long-running calls register a callback (usually closing their HTTP
+    stream) so cancel() can interrupt them immediately instead of waiting
+    for the next check.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.cancelled_at: Optional[float] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Error in cancel callback: %s", e)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise TurnCancelled("Turn cancelled")
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep for timeout seconds or until cancelled; returns True if cancelled"""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Run callback on cancel (immediately if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @contextmanager
+    def closing(self, resource):
+        """
+        Close resource (a streaming response) if the turn is cancelled while
+        it is in use, and turn the resulting read error into TurnCancelled.
+        """
+        # Closes the resource at once if the turn was cancelled before it got here
+        self.on_cancel(resource.close)
+        try:
+            self.raise_if_cancelled()
+            yield resource
+        except Exception as e:
+            if self.cancelled:
+                raise TurnCancelled("Turn cancelled") from e
+            raise
+        finally:
+            self.remove_callback(resource.close)
+        self.raise_if_cancelled()
+
+
+# Token used when no turn is active; never cancelled
+_NEVER_CANCELLED = CancelToken()
+_local = threading.local()
+
+
+def current_token() -> CancelToken:
+    """Return the cancel token of the turn running on this thread"""
+    return getattr(_local, "token", _NEVER_CANCELLED)
+
+
+@contextmanager
+def use_token(token: CancelToken):
+    """Make token the current token for this thread"""
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        if previous is None:
+            del _local.token
+        else:
+            _local.token = previous
@@ -1,14 +1,16 @@
 # chatgpt.py
 from ai_interface import AIModelInterface
-from openai import OpenAI
 import base64
 from typing import List, Dict, Optional
+from key_manager import KeyManager
+from rate_limiter import RateLimiter, estimate_tokens
+from openai_compat import openai_client, stream_chat_completion
 
 class ChatGPTModel(AIModelInterface):
     def __init__(self, service_name: str = "openai"):
         """Initialize ChatGPT with API key"""
         super().__init__(service_name)
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = openai_client(self.api_key, KeyManager.get_base_url(service_name))
         
     def get_model_name(self) -> str:
         return "ChatGPT"
@@ -22,26 +24,17 @@ class ChatGPTModel(AIModelInterface):
                        conversation_history: List[Dict],
                        image_path: Optional[str] = None) -> List[Dict]:
         """Format messages for ChatGPT API"""
-        formatted_messages = []
-        
-        for message in conversation_history:
-            if isinstance(message['content'], str):
-                formatted_messages.append({
-                    "role": message["role"],
-                    "content": message["content"]
-                })
-            else:  # Handle messages with images
-                formatted_messages.append({
-                    "role": message["role"],
-                    "content": message["content"]
-                })
+        # Internal messages already use the OpenAI layout (images as image_url parts)
+        formatted_messages = self.format_cache.format_list(conversation_history, self._format_message)
         
         # Add image to the last message if provided
-        if image_path:
+        if image_path and isinstance(formatted_messages[-1]['content'], str):
             image_base64 = self.encode_image_to_base64(image_path)
             last_message = formatted_messages[-1]
-            if isinstance(last_message['content'], str):
-                last_message['content'] = [
+            # Cached messages are shared, so replace rather than modify
+            formatted_messages[-1] = {
+                "role": last_message["role"],
+                "content": [
                     {"type": "text", "text": last_message['content']},
                     {
                         "type": "image_url",
@@ -50,8 +43,13 @@ class ChatGPTModel(AIModelInterface):
                         }
                     }
                 ]
+            }
         
         return formatted_messages
+
+    @staticmethod
+    def _format_message(message: Dict, variant: None) -> Dict:
+        return {"role": message["role"], "content": message["content"]}
     
     def generate_response(self,
                          messages: List[Dict],
@@ -59,13 +57,18 @@ class ChatGPTModel(AIModelInterface):
                          image_path: Optional[str] = None) -> str:
         """Generate response using ChatGPT"""
         formatted_messages = self.format_messages(messages, image_path)
+        if model is None:
+            model = "gpt-4o-mini" if image_path else "gpt-4o"
         
-        response = self.client.chat.completions.create(
-            model=model,  # "gpt-4o-mini" or "gpt-4o"
-            messages=formatted_messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        return response.choices[0].message.content
+        limiter = RateLimiter.for_service(self.service_name)
+        with limiter.limit(estimate_tokens(messages, 1000)) as permit:
+            return stream_chat_completion(
+                self.client,
+                permit,
+                model=model,  # "gpt-4o-mini" or "gpt-4o"
+                messages=formatted_messages,
+                temperature=0.7,
+                max_tokens=1000,
+                stream_options={"include_usage": True}
+            )
 
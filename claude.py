@@ -1,15 +1,24 @@
 # claude.py
 from ai_interface import AIModelInterface
 from anthropic import Anthropic
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 import base64
 from pathlib import Path
+from key_manager import KeyManager
+from rate_limiter import RateLimitExceeded, RateLimiter, estimate_tokens
+from cancellation import TurnCancelled, current_token
+
+# Prompt cache breakpoint; Anthropic keeps the prefix up to it for five minutes
+CACHE_CONTROL = {"type": "ephemeral"}
 
 class ClaudeModel(AIModelInterface):
     def __init__(self, service_name: str = "anthropic"):
         """Initialize Claude with API key"""
         super().__init__(service_name)
-        self.client = Anthropic(api_key=self.api_key)
+        self.client = Anthropic(
+            api_key=self.api_key,
+            base_url=KeyManager.get_base_url(service_name)
+        )
         self.model_name = "claude-3-5-sonnet-20241022"
         
     def get_model_name(self) -> str:
@@ -28,78 +37,127 @@ class ClaudeModel(AIModelInterface):
         if conversation_history and conversation_history[0]["role"] == "system":
             system_message = conversation_history[0]["content"]
 
-        # Format conversation messages
-        formatted_messages = []
-        for message in conversation_history[1:]:  # Skip system message
-            if message["role"] in ["user", "assistant"]:
-                if isinstance(message['content'], str):
-                    formatted_messages.append({
-                        "role": message["role"],
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": message["content"]
-                            }
-                        ]
-                    })
-                else:  # Handle list type content (for messages with images)
-                    # For image messages, we need special handling
-                    if message["role"] == "user" and image_path and message == conversation_history[-1]:
-                        # This is the latest message with an image
-                        try:
-                            with open(image_path, "rb") as img_file:
-                                image_data = base64.b64encode(img_file.read()).decode('utf-8')
-                                formatted_messages.append({
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "image",
-                                            "source": {
-                                                "type": "base64",
-                                                "media_type": "image/jpeg",
-                                                "data": image_data
-                                            }
-                                        },
-                                        {
-                                            "type": "text",
-                                            "text": message["content"][0]["text"]
-                                        }
-                                    ]
-                                })
-                        except Exception as e:
-                            raise Exception(f"Error processing image: {e}")
-                    else:
-                        # Regular message with non-string content
-                        formatted_messages.append({
-                            "role": message["role"],
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": message["content"][0]["text"]
-                                }
-                            ]
-                        })
+        # Format conversation messages (skipping the system message); earlier turns come from the cache
+        messages = conversation_history[1:]
+        # Only the latest message carries its image; earlier ones are sent as text
+        with_image = None
+        if (image_path and messages and messages[-1]["role"] == "user"
+                and not isinstance(messages[-1]["content"], str)):
+            with_image = image_path
+        formatted_messages = self.format_cache.format_list(messages, self._format_message, with_image)
 
         return system_message, formatted_messages
+
+    @staticmethod
+    def _format_message(message: Dict, image_path: Optional[str]) -> Dict:
+        if isinstance(message['content'], str):
+            return {
+                "role": message["role"],
+                "content": [
+                    {
+                        "type": "text",
+                        "text": message["content"]
+                    }
+                ]
+            }
+        if image_path:
+            # This is the latest message with an image
+            try:
+                with open(image_path, "rb") as img_file:
+                    image_data = base64.b64encode(img_file.read()).decode('utf-8')
+            except Exception as e:
+                raise Exception(f"Error processing image: {e}")
+            return {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": "image/jpeg",
+                            "data": image_data
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": message["content"][0]["text"]
+                    }
+                ]
+            }
+        # Regular message with non-string content
+        return {
+            "role": message["role"],
+            "content": [
+                {
+                    "type": "text",
+                    "text": message["content"][0]["text"]
+                }
+            ]
+        }
+
+    @staticmethod
+    def add_cache_breakpoints(system_message: str,
+                              formatted_messages: List[Dict]) -> Tuple[Union[str, List[Dict]], List[Dict]]:
+        """
+        Mark the stable prompt prefix for Anthropic prompt caching
+        Breakpoints go on the system prompt, the last assistant reply (the
+        settled history) and the newest message, so the next turn reads
+        everything up to this one from the cache. Marked messages are copied.
+        Returns:
+            Tuple[Union[str, List[Dict]], List[Dict]]: (system, messages)
+        """
+        system = system_message
+        if system_message:
+            system = [{"type": "text", "text": system_message, "cache_control": CACHE_CONTROL}]
+
+        messages = list(formatted_messages)
+        marked = set()
+        if messages:
+            marked.add(len(messages) - 1)
+        for index in range(len(messages) - 2, -1, -1):
+            if messages[index]["role"] == "assistant":
+                marked.add(index)
+                break
+        for index in marked:
+            content = list(messages[index]["content"])
+            content[-1] = dict(content[-1], cache_control=CACHE_CONTROL)
+            messages[index] = dict(messages[index], content=content)
+        return system, messages
     
     def generate_response(self,
                          messages: List[Dict],
-                         model: str,  # This parameter is ignored for Claude
+                         model: Optional[str],
                          image_path: Optional[str] = None) -> str:
-        """Generate response using Claude"""
+        """
+        Generate response using Claude
+        Args:
+            model: Claude model to use for this turn, defaults to self.model_name
+        """
         try:
             system_message, formatted_messages = self.format_messages(messages, image_path)
+            system, formatted_messages = self.add_cache_breakpoints(system_message, formatted_messages)
             
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=1000,
-                temperature=0.7,
-                system=system_message,
-                messages=formatted_messages
-            )
+            limiter = RateLimiter.for_service(self.service_name)
+            with limiter.limit(estimate_tokens(messages, 1000)) as permit:
+                # Streamed so a cancelled turn can close the connection mid-generation
+                with self.client.messages.stream(
+                    model=model or self.model_name,
+                    max_tokens=1000,
+                    temperature=0.7,
+                    system=system,
+                    messages=formatted_messages
+                ) as stream, current_token().closing(stream):
+                    response = stream.get_final_message()
+                usage = response.usage
+                # SDKs from before prompt caching went GA lack the cache counters
+                permit.record_usage(usage.input_tokens, usage.output_tokens,
+                                    getattr(usage, "cache_read_input_tokens", 0),
+                                    getattr(usage, "cache_creation_input_tokens", 0))
             
             return response.content[0].text
             
+        except (TurnCancelled, RateLimitExceeded):
+            raise
         except Exception as e:
             raise Exception(f"Error generating response from Claude: {e}")
 
@@ -1,5 +1,6 @@
 # conversation_manager.py
-from openai import OpenAI
+import logging
+from openai_compat import openai_client
 import opencc
 from typing import List, Dict, Callable
 import base64
@@ -7,31 +8,78 @@ from tts_manager import TTSManager
 import re
 from typing import Tuple, Optional
 from camera_utils import CameraManager
+from image_policy import ImagePolicy
+from message_cache import next_message_id
 import datetime
 import os
+import time
 from pathlib import Path
 from key_manager import KeyManager
 from chatgpt import ChatGPTModel
 from typing import Union
 from system_prompts import SystemPrompts
+from ai_interface import AIModelInterface
+from resilience import ResilientModel
+from rate_limiter import RateLimiter
+from http_transport import prewarm
+from session_store import SessionStore
+from cancellation import TurnCancelled, current_token
+from tracing import tracer
+from metrics import metrics
+from session_recorder import recorder
+
+logger = logging.getLogger(__name__)
+
+_TURNS = metrics.counter("turns_total", "Conversation turns per provider", ("provider", "outcome"))
+_TURN_SECONDS = metrics.histogram("turn_seconds", "End-to-end turn latency", ("provider",))
+
+# Reply when a text-only model asks for a camera image
+NO_CAMERA_REPLY = "{model} can't look through the cameras. Switch to ChatGPT, Claude or Gemini to ask about what the cameras see."
+
 
 class ConversationManager:
     def __init__(self, api_key_path: str = "openai_key.txt"):
         self.converter = opencc.OpenCC('s2t')
         # Initialize OpenAI client for speech services
-        self.client = OpenAI(api_key=KeyManager.load_key("openai"))
+        self.client = openai_client(KeyManager.load_key("openai"), KeyManager.get_base_url("openai"))
         self.tts_manager = TTSManager(KeyManager.get_key_path("openai"))
 
+        # Secondary provider used when a provider's circuit is open or it keeps failing
+        self.fallback_models = {
+            "ChatGPT": "Claude",
+            "Claude": "ChatGPT",
+            "Gemini": "ChatGPT",
+            "Grok": "ChatGPT",
+            "Perplexity": "ChatGPT"
+        }
+
         # Initialize current AI model (default to ChatGPT)
-        self.current_model = ChatGPTModel()
+        self.current_model = self._create_resilient_model("ChatGPT")
 
         # Initialize Perplexity model for searches
         from perplexity import PerplexityModel
-        self.search_model = PerplexityModel()
+        self.search_model = ResilientModel(PerplexityModel())
+
+        # Open connections to every provider in the background before the first turn
+        prewarm()
+
+        # Persistent, append-only record of every session
+        self.session_store = SessionStore()
+        self.session_id = None
+        self._turn_messages = []
+        # Store keys of the last turn's input and of the reply it showed, if stored
+        self._input_key: Optional[Tuple[int, int]] = None
+        self._reply_key: Optional[Tuple[int, int]] = None
+        # "ok", "error" or "cancelled" for the last turn get_response ran
+        self.last_outcome: Optional[str] = None
+        # Image parts of resumed messages, encoded from the store when the history is first sent
+        self._pending_images: List[Tuple[List, Dict, str]] = []
 
         # Initialize camera references
         self.camera1 = None
         self.camera2 = None
+        # Picks image size, crop and quality per provider and question
+        self.image_policy = ImagePolicy()
 
         self.camera_images = {
             "camera1": "camera1.jpg",
@@ -41,6 +89,7 @@ class ConversationManager:
         # Initialize conversation history with system prompt
         self.conversation_history = [
             {
+                "id": next_message_id(),
                 "role": "system",
                 "content": SystemPrompts.get_prompt("ChatGPT")  # Default to ChatGPT prompt
             }
@@ -90,49 +139,62 @@ class ConversationManager:
             ]
         }
 
+    def _create_model(self, model_name: str) -> AIModelInterface:
+        """Instantiate the provider for a model name"""
+        if model_name == "ChatGPT":
+            return ChatGPTModel()
+        elif model_name == "Claude":
+            from claude import ClaudeModel
+            return ClaudeModel()
+        elif model_name == "Gemini":
+            from gemini import GeminiModel
+            return GeminiModel()
+        elif model_name == "Grok":
+            from grok import GrokModel
+            return GrokModel()
+        elif model_name == "Perplexity":
+            from perplexity import PerplexityModel
+            return PerplexityModel()
+        raise ValueError(f"Unsupported model: {model_name}")
+
+    def _create_resilient_model(self, model_name: str) -> ResilientModel:
+        """Wrap a provider with retries, a circuit breaker and its configured fallback"""
+        fallback_name = self.fallback_models.get(model_name)
+        fallback_factory = None
+        if fallback_name:
+            fallback_factory = lambda: self._create_model(fallback_name)
+        return ResilientModel(self._create_model(model_name), fallback_factory=fallback_factory)
+
     def set_ai_model(self, model_name: str) -> None:
         """Change the current AI model"""
         try:
-            print(f"[DEBUG] Attempting to switch to {model_name}")
+            logger.debug("Attempting to switch to %s", model_name)
             
             # Update system prompt for new model
             if self.conversation_history:
                 self.conversation_history[0]["content"] = SystemPrompts.get_prompt(model_name)
  
-
-            if model_name == "ChatGPT":
-                self.current_model = ChatGPTModel()
-                print(f"[DEBUG] Created new ChatGPT model instance: {type(self.current_model)}")
-            elif model_name == "Claude":
-                from claude import ClaudeModel
-                self.current_model = ClaudeModel()
-                self.clear_history()
-                print(f"[DEBUG] Created new Claude model instance: {type(self.current_model)}")
-            elif model_name == "Gemini":
-                from gemini import GeminiModel
-                self.current_model = GeminiModel()
-                self.clear_history()
-                print(f"[DEBUG] Created new Gemini model instance: {type(self.current_model)}")
-            elif model_name == "Grok":
-                from grok import GrokModel
-                self.current_model = GrokModel()
-                self.clear_history()
-                print(f"[DEBUG] Created new Grok model instance: {type(self.current_model)}")
-            elif model_name == "Perplexity":
-                from perplexity import PerplexityModel
-                self.current_model = PerplexityModel()
+            self.current_model = self._create_resilient_model(model_name)
+            logger.debug("Created new %s model instance: %s", model_name, type(self.current_model.model))
+            prewarm()
+            if model_name != "ChatGPT":
                 self.clear_history()
-                print(f"[DEBUG] Created new Perplexity model instance: {type(self.current_model)}")
-            else:
-                raise ValueError(f"Unsupported model: {model_name}")
             
             #self.clear_history()
-            print(f"[DEBUG] Current model after switch: {self.current_model.get_model_name()}")
+            logger.debug("Current model after switch: %s", self.current_model.get_model_name())
         except Exception as e:
-            print(f"[DEBUG] Error during model switch: {str(e)}")
+            logger.warning("Error during model switch: %s", e)
             raise Exception(f"Error switching to {model_name}: {e}")
 
 
+    def get_resilience_metrics(self) -> Dict[str, Dict]:
+        """Return circuit breaker state and retry counts per provider"""
+        return ResilientModel.get_metrics()
+
+    def get_rate_limit_stats(self) -> Dict[str, Dict]:
+        """Return queue wait, network time and shed counts per provider endpoint"""
+        return RateLimiter.get_stats()
+
     def set_cameras(self, camera1: 'Picamera2', camera2: 'Picamera2'):
         """Set camera references from the main app"""
         self.camera1 = camera1
@@ -167,15 +229,23 @@ class ConversationManager:
         return 'normal', None
 
     def encode_image_to_base64(self, image_path: str) -> str:
+        return base64.b64encode(self.read_image(image_path)).decode('utf-8')
+
+    def read_image(self, image_path: str) -> bytes:
         try:
             with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+                return image_file.read()
         except FileNotFoundError:
             raise Exception(f"Image file not found: {image_path}")
 
-    def add_message(self, role: str, content: Union[str, List], image_path: str = None) -> None:
-        if image_path:
-            image_base64 = self.encode_image_to_base64(image_path)
+    def _build_message(self, role: str, content: Union[str, List], image_base64: str = None,
+                       detail: Optional[str] = None) -> Dict:
+        """
+        Args:
+            image_base64: JPEG data; an empty string leaves the image part for
+                _load_pending_images() to fill in
+        """
+        if image_base64 is not None:
             content_with_image = {
                 "type": "text",
                 "text": content
@@ -186,15 +256,124 @@ class ConversationManager:
                     "url": f"data:image/jpeg;base64,{image_base64}"
                 }
             }
-            self.conversation_history.append({
-                "role": role,
-                "content": [content_with_image, image_content]
-            })
+            if detail:
+                image_content["image_url"]["detail"] = detail
+            return {"id": next_message_id(), "role": role, "content": [content_with_image, image_content]}
+        # Providers cache formatted messages by this id (see message_cache.py)
+        return {"id": next_message_id(), "role": role, "content": content}
+
+    def add_message(self, role: str, content: Union[str, List], image_path: str = None,
+                    detail: Optional[str] = None, internal: bool = False) -> None:
+        """
+        Args:
+            internal: The message is for the model only and was never shown in the chat
+        """
+        image_hash = None
+        if image_path:
+            image_bytes = self.read_image(image_path)
+            image_hash = self._store_blob(image_bytes)
+            self.conversation_history.append(
+                self._build_message(role, content, base64.b64encode(image_bytes).decode('utf-8'), detail)
+            )
         else:
-            self.conversation_history.append({"role": role, "content": content})
+            self.conversation_history.append(self._build_message(role, content))
+        self._persist_message(role, content, image_hash, internal)
+
+    def _store_blob(self, image_bytes: bytes) -> Optional[str]:
+        try:
+            return self.session_store.put_blob(image_bytes)
+        except Exception as e:
+            logger.warning("Error storing image blob: %s", e)
+            return None
+
+    def _persist_message(self, role: str, content: Union[str, List], image_hash: Optional[str],
+                         internal: bool = False) -> None:
+        """Append a message to the session store; persistence never fails a turn"""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        try:
+            if self.session_id is None:
+                self.session_id = self.session_store.create_session()
+            model = self.current_model.get_model_name() if role == "assistant" else None
+            seq = self.session_store.append_message(self.session_id, role, content, image_hash, model, internal)
+            key = (self.session_id, seq)
+            self._turn_messages.append(key)
+            if not internal:
+                if role == "user" and self._input_key is None:
+                    self._input_key = key
+                elif role == "assistant":
+                    self._reply_key = key
+        except Exception as e:
+            logger.warning("Error persisting message: %s", e)
+
+    def resume_session(self, session_id: Optional[int] = None, limit: int = 50) -> int:
+        """
+        Restore conversation history from the session store
+        Args:
+            session_id: Session to resume, defaults to the most recent one
+            limit: Number of most recent messages to load into context
+        Returns:
+            int: Number of messages restored
+        """
+        if session_id is None:
+            session_id = self.session_store.latest_session_id()
+        if session_id is None:
+            return 0
+
+        rows = self.session_store.load_messages(session_id, limit=limit)
+        # Providers such as Claude require the conversation to open with a user message
+        first_user = next((index for index, row in enumerate(rows) if row["role"] == "user"), len(rows))
+        rows = rows[first_user:]
+        history = [self.conversation_history[0]]
+        pending = []
+        for row in rows:
+            if row["image_hash"]:
+                # Nothing is read or encoded until the history is sent
+                message = self._build_message(row["role"], row["text"], "")
+                image_part = message["content"][1]
+                pending.append((message["content"], image_part, row["image_hash"]))
+            else:
+                message = self._build_message(row["role"], row["text"])
+            history.append(message)
+
+        self.conversation_history = history
+        self._pending_images = pending
+        self.session_id = session_id
+        logger.debug("Resumed session %s with %s messages", session_id, len(rows))
+        return len(rows)
+
+    def stored_turn_keys(self) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+        (session id, seq) of the messages the last turn stored for the transcript
+        Returns:
+            Tuple: Key of the user's input and key of the assistant reply; None for
+                either if it was not stored (e.g. the turn failed before replying)
+        """
+        return self._input_key, self._reply_key
+
+    def search_history(self, query: str, limit: int = 20) -> List[Dict]:
+        """Full-text search over all stored sessions"""
+        return self.session_store.search(query, limit)
+
+    def _load_pending_images(self) -> None:
+        """Encode the images of resumed messages, the first time they are needed"""
+        pending, self._pending_images = self._pending_images, []
+        for content, image_part, image_hash in pending:
+            try:
+                image_bytes = self.session_store.get_blob(image_hash)
+            except Exception as e:
+                logger.warning("Error loading stored image %s: %s", image_hash, e)
+                image_bytes = None
+            if image_bytes:
+                image_part["image_url"]["url"] = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+            else:
+                content.remove(image_part)
 
     def clear_history(self) -> None:
         self.conversation_history = [self.conversation_history[0]]
+        self._pending_images = []
+        # Earlier messages stay in the store; the next message starts a new session
+        self.session_id = None
     
     def detect_language(self, text: str) -> str:
         """
@@ -213,18 +392,70 @@ class ConversationManager:
 
     def get_response(self, user_input: str, status_callback: Callable[[str], None] = None) -> str:
         """
-        Generate a response incorporating camera analysis, online searches, and TTS
+        Run one turn, leaving the history untouched if the turn is cancelled
         Args:
             user_input: The user's input text
             status_callback: Optional callback function to update UI status
         Returns:
             str: The generated response
+        Raises:
+            TurnCancelled: If the turn's cancel token was triggered
         """
+        history_length = len(self.conversation_history)
+        self._turn_messages = []
+        self._input_key = self._reply_key = None
+        provider = self.current_model.get_model_name()
+        start = time.monotonic()
+        recorder.begin_turn(user_input, provider)
         try:
-            print(f"[DEBUG] Processing input: {user_input}")
-            command_type, camera_num = self.parse_command(user_input)
-            print(f"[DEBUG] Parsed command: type={command_type}, camera={camera_num}")
+            with tracer.span("turn", model=provider):
+                response, outcome = self._run_turn(user_input, status_callback)
+        except TurnCancelled:
+            logger.debug("Turn cancelled, rolling back history")
+            _TURNS.inc(provider=provider, outcome="cancelled")
+            self.last_outcome = "cancelled"
+            recorder.end_turn("", "cancelled")
+            self._rollback_turn(history_length)
+            if status_callback:
+                status_callback("Cancelled")
+            raise
+        self.last_outcome = outcome
+        _TURNS.inc(provider=provider, outcome=outcome)
+        _TURN_SECONDS.observe(time.monotonic() - start, provider=provider)
+        # Speech timings still to come are added by the recorder as they arrive
+        recorder.end_turn(response, outcome)
+        return response
+
+    def _rollback_turn(self, history_length: int) -> None:
+        """Drop the messages a cancelled turn added, in memory and in the store"""
+        del self.conversation_history[history_length:]
+        if self._turn_messages:
+            session_id, first_seq = self._turn_messages[0]
+            try:
+                self.session_store.delete_messages(session_id, first_seq)
+            except Exception as e:
+                logger.warning("Error rolling back stored messages: %s", e)
+        self._turn_messages = []
+        self._input_key = self._reply_key = None
+
+    def _run_turn(self, user_input: str, status_callback: Callable[[str], None] = None) -> Tuple[str, str]:
+        """
+        Generate a response incorporating camera analysis, online searches, and TTS
+        Args:
+            user_input: The user's input text
+            status_callback: Optional callback function to update UI status
+        Returns:
+            Tuple[str, str]: The generated response and the turn's outcome, "ok" or "error"
+        """
+        try:
+            logger.debug("Processing input: %s", user_input)
+            with tracer.span("intent_parsing"):
+                command_type, camera_num = self.parse_command(user_input)
+            logger.debug("Parsed command: type=%s, camera=%s", command_type, camera_num)
             image_path = None
+            # None when the current provider cannot use images; nothing is captured then
+            image_budget = self.image_policy.choose(self.current_model.get_model_name(), user_input)
+            logger.debug("Image budget: %s", image_budget)
 
             # Handle user's direct camera commands first
             if command_type == 'take_photo':
@@ -233,36 +464,40 @@ class ConversationManager:
                 elif camera_num == '2' and self.camera2:
                     filepath = CameraManager.capture_high_res(self.camera2, 2)
                 else:
-                    return "Error: Camera not initialized"
+                    return "Error: Camera not initialized", "error"
 
                 if filepath:
-                    return f"Photo saved to: {filepath}"
-                return "Error taking photo"
+                    return f"Photo saved to: {filepath}", "ok"
+                return "Error taking photo", "error"
 
             elif command_type == 'analyze':
-                if camera_num == '1' and self.camera1:
-                    image_path = CameraManager.capture_and_convert(self.camera1, 1)
+                if image_budget is None:
+                    logger.debug("%s cannot use images, skipping capture", self.current_model.get_model_name())
+                elif camera_num == '1' and self.camera1:
+                    image_path = CameraManager.capture_and_convert(self.camera1, 1, image_budget)
                 elif camera_num == '2' and self.camera2:
-                    image_path = CameraManager.capture_and_convert(self.camera2, 2)
+                    image_path = CameraManager.capture_and_convert(self.camera2, 2, image_budget)
                 else:
-                    return "Error: Camera not initialized"
+                    return "Error: Camera not initialized", "error"
 
             # Add initial user message to conversation history
             if image_path:
-                self.add_message("user", user_input, image_path)
+                self.add_message("user", user_input, image_path, image_budget.detail)
             else:
                 self.add_message("user", user_input)
 
             # Determine model
-            if isinstance(self.current_model, ChatGPTModel):
+            if self.current_model.get_model_name() == "ChatGPT":
                 model = "gpt-4o-mini" if image_path else "gpt-4o"
-                print(f"[DEBUG] Using ChatGPT model: {model}")
+                logger.debug("Using ChatGPT model: %s", model)
             else:
                 model = None
-                print(f"[DEBUG] Using {self.current_model.get_model_name()} with its own model naming")
+                logger.debug("Using %s with its own model naming", self.current_model.get_model_name())
+
+            self._load_pending_images()
 
             # Get initial response from current AI model
-            print(f"[DEBUG] Generating initial response using {self.current_model.get_model_name()}")
+            logger.debug("Generating initial response using %s", self.current_model.get_model_name())
             initial_response = self.current_model.generate_response(
                 self.conversation_history,
                 model,
@@ -273,28 +508,34 @@ class ConversationManager:
             camera_pattern = r'{"camera": ?"(\d)"}'
             camera_match = re.search(camera_pattern, initial_response)
             
-            if camera_match:
+            if camera_match and image_budget is None:
+                # The shared prompt still offers the cameras; never store or speak the raw directive
+                logger.debug("Ignoring camera command, %s cannot use images", self.current_model.get_model_name())
+                initial_response = NO_CAMERA_REPLY.format(model=self.current_model.get_model_name())
+            elif camera_match:
+                current_token().raise_if_cancelled()
                 camera_num = camera_match.group(1)
-                print(f"[DEBUG] Found camera command: camera {camera_num}")
+                logger.debug("Found camera command: camera %s", camera_num)
                 
                 if status_callback:
                     status_callback(f"Capturing image from camera {camera_num}...")
 
                 # Handle AI's camera command
                 if camera_num == "1" and self.camera1:
-                    image_path = CameraManager.capture_and_convert(self.camera1, 1)
+                    image_path = CameraManager.capture_and_convert(self.camera1, 1, image_budget)
                 elif camera_num == "2" and self.camera2:
-                    image_path = CameraManager.capture_and_convert(self.camera2, 2)
+                    image_path = CameraManager.capture_and_convert(self.camera2, 2, image_budget)
                 else:
-                    return "Error: Requested camera not initialized"
+                    return "Error: Requested camera not initialized", "error"
 
                 if image_path:
                     # Add AI's intermediate response and image to conversation
-                    self.add_message("assistant", "Let me analyze that image.", None)
-                    self.add_message("user", "Please analyze this image.", image_path)
+                    self.add_message("assistant", "Let me analyze that image.", None, internal=True)
+                    self.add_message("user", "Please analyze this image.", image_path, image_budget.detail,
+                                     internal=True)
 
                     # Get new response with image analysis
-                    print("[DEBUG] Generating response with image analysis")
+                    logger.debug("Generating response with image analysis")
                     final_response = self.current_model.generate_response(
                         self.conversation_history,
                         model,
@@ -316,8 +557,8 @@ class ConversationManager:
                     if status_callback:
                         status_callback("")
 
-                    return final_response
-                return "Error capturing image"
+                    return final_response, "ok"
+                return "Error capturing image", "error"
 
             # Check for search requests in the response
             search_pattern = r'{"Online search": "([^"]+)"}'
@@ -325,7 +566,7 @@ class ConversationManager:
             
             if search_match:
                 search_query = search_match.group(1)
-                print(f"[DEBUG] Found search request: {search_query}")
+                logger.debug("Found search request: %s", search_query)
                 
                 if status_callback:
                     status_callback(f"Searching for: {search_query}")
@@ -343,12 +584,13 @@ class ConversationManager:
                         }
                     ]
 
-                    search_result = self.search_model.generate_response(
-                        search_messages,
-                        "llama-3.1-sonar-large-128k-online",
-                        None
-                    )
-                    print(f"[DEBUG] Search result from Perplexity: {search_result}")
+                    with tracer.span("tool.search"):
+                        search_result = self.search_model.generate_response(
+                            search_messages,
+                            "llama-3.1-sonar-large-128k-online",
+                            None
+                        )
+                    logger.debug("Search result from Perplexity: %s", search_result)
 
                     # Create a new user message with search results
                     combined_input = f"""Original query: {user_input}
@@ -359,10 +601,10 @@ Search results for "{search_query}":
 Please provide a complete response incorporating this information."""
 
                     # Add search results to conversation
-                    self.add_message("user", combined_input)
+                    self.add_message("user", combined_input, internal=True)
 
                     # Get final response incorporating search results
-                    print("[DEBUG] Generating final response with search results")
+                    logger.debug("Generating final response with search results")
                     final_response = self.current_model.generate_response(
                         self.conversation_history,
                         model,
@@ -384,17 +626,19 @@ Please provide a complete response incorporating this information."""
                     if status_callback:
                         status_callback("")
 
-                    return final_response
+                    return final_response, "ok"
 
+                except TurnCancelled:
+                    raise
                 except Exception as e:
-                    print(f"[DEBUG] Search error: {e}")
+                    logger.warning("Search error: %s", e)
                     error_msg = f"I encountered an error while searching: {str(e)}"
                     if status_callback:
                         status_callback(error_msg)
-                    return error_msg
+                    return error_msg, "error"
 
             # No special commands, handle normal response
-            print("[DEBUG] No special commands found, processing normal response")
+            logger.debug("No special commands found, processing normal response")
             self.add_message("assistant", initial_response)
             
             # Handle TTS
@@ -409,12 +653,14 @@ Please provide a complete response incorporating this information."""
             if status_callback:
                 status_callback("")
 
-            return initial_response
+            return initial_response, "ok"
 
+        except TurnCancelled:
+            raise
         except Exception as e:
-            print(f"[DEBUG] Error in get_response: {str(e)}")
+            logger.warning("Error in get_response: %s", e)
             error_msg = f"Error: {str(e)}"
             if status_callback:
                 status_callback(error_msg)
-            return error_msg
+            return error_msg, "error"
 
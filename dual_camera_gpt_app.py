@@ -1,20 +1,47 @@
 # dual_camera_gpt_app.py
+import logging
+import os
 import tkinter as tk
 from tkinter import ttk, scrolledtext, font
 from PIL import Image, ImageTk
 import threading
 import queue
 from collections import deque
+from typing import Optional
 import datetime
-import os
-import sounddevice as sd
 import numpy as np
-from pydub import AudioSegment
 from conversation_manager import ConversationManager
 from camera_utils import CameraManager
 import time
-from pathlib import Path
 import opencc
+from turn_pipeline import TurnPipeline
+from cancellation import TurnCancelled, current_token
+from tracing import tracer
+from metrics import metrics
+from http_transport import prewarm
+from audio_capture import AudioCapture
+from audio_upload import prepare_upload, transcribe
+from vad import EndpointDetector, VoiceActivityDetector
+from streaming_transcription import StreamingTranscriber
+from session_recorder import recorder
+from duplex import DuplexMonitor
+from transcript_view import TranscriptView
+
+logger = logging.getLogger(__name__)
+
+_PREVIEW_FRAMES = metrics.counter("preview_frames_total", "Preview frames shown", ("camera",))
+_PREVIEW_DROPPED = metrics.counter("preview_frames_dropped_total",
+                                   "Preview frames replaced before the UI showed them", ("camera",))
+_PREVIEW_FPS = metrics.gauge("preview_fps", "Preview frames shown per second", ("camera",))
+
+# How often hands-free mode checks for the end of the utterance
+ENDPOINT_POLL_MS = 100
+# How often streaming transcription looks for a pause to cut at
+TRANSCRIPTION_POLL_MS = 250
+# How often conversation mode listens for the user starting to talk
+DUPLEX_POLL_MS = 50
+# Font size changes are applied once the slider rests this long
+FONT_DEBOUNCE_MS = 150
 
 class DualCameraGPTApp:
     def __init__(self, master):
@@ -29,9 +56,19 @@ class DualCameraGPTApp:
 
         # Initialize recording state
         self.is_recording = False
-        self.recording_thread = None
-        self.audio_data = []
+        self.recording_started = 0.0
         self.sample_rate = 44100
+        # The microphone stays open so recording starts instantly, with pre-roll
+        self.audio_capture = AudioCapture(self.sample_rate)
+        try:
+            self.audio_capture.start()
+        except Exception as e:
+            # Retried when recording starts
+            logger.warning("Audio input not available: %s", e)
+        # Silence is trimmed before upload; in hands-free mode a pause ends the recording
+        self.vad = VoiceActivityDetector()
+        self.endpoint_detector = EndpointDetector(self.vad)
+        self.hands_free = os.environ.get("CYBERDECK_HANDS_FREE") == "1"
 
         # Initialize command history
         self.command_history = deque(maxlen=10)
@@ -40,6 +77,7 @@ class DualCameraGPTApp:
         # Set default font size for chat areas
         self.current_font_size = 12
         self.chat_font = font.Font(size=self.current_font_size)
+        self.font_update_timer = None
         
         # Define color schemes for different participants
         self.chat_colors = {
@@ -59,9 +97,24 @@ class DualCameraGPTApp:
         ## Initialize cameras
         #self.setup_cameras()
         
+        # Worker thread for turns; results come back through a queue drained by Tk
+        self.pipeline = TurnPipeline(master)
+
+        # Aggregated metrics on a local HTTP endpoint plus a periodic snapshot file
+        metrics.start_from_env()
+
         # Initialize the GPT conversation manager
         self.conversation_manager = ConversationManager()
 
+        # Optionally transcribe long recordings in segments while they are recorded
+        self.streaming_transcription = os.environ.get("CYBERDECK_STREAMING_TRANSCRIPTION") == "1"
+        self.transcriber = StreamingTranscriber(self.audio_capture, self.vad, self.conversation_manager.client)
+
+        # Conversation mode: the microphone stays live during replies and speaking interrupts them
+        self.conversation_mode = os.environ.get("CYBERDECK_CONVERSATION") == "1"
+        self.duplex = DuplexMonitor(self.audio_capture, self.vad, self.conversation_manager.tts_manager)
+        self.listen_timer = None
+
         # Initialize cameras
         self.setup_cameras()
         
@@ -70,23 +123,27 @@ class DualCameraGPTApp:
 
         # Bind Escape key
         self.master.bind('<Escape>', self.stop_audio)
+        self.master.bind('<F2>', lambda e: self.toggle_conversation_mode())
         
         # Create main UI
         self.create_ui()
         
-        # Now we can setup text tags after chat_display is created
-        self.setup_text_tags()
-        
         # Start the preview loops in separate threads
         self.start_preview_threads()
         
         # Display welcome message
         self.display_welcome_message()
 
+        # Restore context from the previous run
+        self.restore_previous_session()
+
+        if self.conversation_mode:
+            self.listen_timer = self.master.after(DUPLEX_POLL_MS, self.listen_for_speech)
+
     def setup_cameras(self):
         """Setup available cameras and adjust UI accordingly"""
         self.available_cameras = CameraManager.detect_cameras()
-        print(f"[DEBUG] Available cameras: {self.available_cameras}")
+        logger.debug("Available cameras: %s", self.available_cameras)
         
         self.picam1 = None
         self.picam2 = None
@@ -94,18 +151,18 @@ class DualCameraGPTApp:
         try:
             if 0 in self.available_cameras:
                 self.picam1 = CameraManager.setup_camera(0)
-                print("[DEBUG] Camera 1 initialized")
+                logger.debug("Camera 1 initialized")
             elif 1 in self.available_cameras:
                 # If only camera 2 is available, treat it as camera 1
                 self.picam1 = CameraManager.setup_camera(1)
-                print("[DEBUG] Only Camera 2 found, using as Camera 1")
+                logger.debug("Only Camera 2 found, using as Camera 1")
                 
             if 1 in self.available_cameras and 0 in self.available_cameras:
                 self.picam2 = CameraManager.setup_camera(1)
-                print("[DEBUG] Camera 2 initialized")
+                logger.debug("Camera 2 initialized")
                 
         except Exception as e:
-            print(f"[DEBUG] Error setting up cameras: {e}")
+            logger.warning("Error setting up cameras: %s", e)
 
     #def setup_cameras(self):
     #    try:
@@ -184,9 +241,22 @@ class DualCameraGPTApp:
         )
         self.exit_button.pack(fill=tk.X, padx=5, pady=5, ipady=10)
 
+        # Search box for past conversations
+        self.search_frame = ttk.LabelFrame(self.control_panel, text="Search History")
+        self.search_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.search_input = ttk.Entry(self.search_frame)
+        self.search_input.pack(fill=tk.X, padx=5, pady=5)
+        self.search_input.bind("<Return>", lambda e: self.search_history())
+
         # Create font size control frame
         self.create_font_control()
 
+        # Optional latency HUD (CYBERDECK_TRACE_HUD=1)
+        if tracer.hud:
+            self.hud_label = ttk.Label(self.main_container, text="", font=('Courier', 9))
+            self.hud_label.pack(fill=tk.X, padx=5)
+            self.master.after(500, self.update_latency_hud)
+
         # Create camera frames based on availability
         if self.picam1 or self.picam2:
             self.camera_frame = ttk.Frame(self.main_container)
@@ -241,6 +311,13 @@ class DualCameraGPTApp:
             height=10  # Shows approximately 10 lines
         )
         self.chat_display.grid(row=0, column=0, sticky='nsew', padx=5, pady=5)
+        # Keeps a bounded window of messages; older ones are paged in from the session store
+        self.transcript = TranscriptView(
+            self.chat_display,
+            self.chat_font,
+            self.chat_colors,
+            load_page=self.conversation_manager.session_store.load_messages
+        )
 
         # Input frame
         self.input_frame = ttk.Frame(chat_container)
@@ -268,13 +345,16 @@ class DualCameraGPTApp:
         # Keyboard shortcuts
         for widget in (self.master, self.chat_input):
             widget.bind('`', lambda e: self.toggle_recording())
+            widget.bind('<Control-grave>', lambda e: self.toggle_hands_free())
             widget.bind('<Control-q>', lambda e: self.exit_program())
 
     def on_input_focus(self, event=None):
         """Handle input focus event"""
         self.is_input_focused = True
         self.start_focus_timer()
-        print("[DEBUG] Input focused")
+        # A question is probably coming; reopen provider connections that went idle
+        prewarm()
+        logger.debug("Input focused")
 
     def on_input_unfocus(self, event=None):
         """Handle input unfocus event"""
@@ -282,7 +362,7 @@ class DualCameraGPTApp:
         if self.input_focus_timer:
             self.master.after_cancel(self.input_focus_timer)
             self.input_focus_timer = None
-        print("[DEBUG] Input unfocused")
+        logger.debug("Input unfocused")
 
     def reset_focus_timer(self, event=None):
         """Reset the focus timer when user types or clicks buttons"""
@@ -294,14 +374,14 @@ class DualCameraGPTApp:
         if self.input_focus_timer:
             self.master.after_cancel(self.input_focus_timer)
         self.input_focus_timer = self.master.after(3000, self.auto_unfocus)
-        print("[DEBUG] Focus timer started/reset")
+        logger.debug("Focus timer started/reset")
 
     def auto_unfocus(self):
         """Automatically unfocus the input after timer expires"""
         self.is_input_focused = False
         self.input_focus_timer = None
         self.master.focus_set()  # Move focus to main window
-        print("[DEBUG] Auto unfocused due to timer")
+        logger.debug("Auto unfocused due to timer")
 
     def handle_backtick(self, event):
         """Handle backtick key press"""
@@ -324,18 +404,66 @@ class DualCameraGPTApp:
 
 
 
+    def search_history(self):
+        """Search past sessions and list the matches in a separate window"""
+        query = self.search_input.get().strip()
+        if not query:
+            return
+        try:
+            start = time.perf_counter()
+            results = self.conversation_manager.search_history(query)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            logger.warning("Error searching history: %s", e)
+            self.update_status(f"Error searching history: {e}")
+            return
+
+        window = tk.Toplevel(self.master)
+        window.title(f"Search: {query}")
+        results_display = scrolledtext.ScrolledText(window, wrap=tk.WORD, font=self.chat_font, width=80, height=20)
+        results_display.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        results_display.insert(tk.END, f"{len(results)} matches in {elapsed_ms:.1f} ms\n")
+        for result in results:
+            timestamp = datetime.datetime.fromtimestamp(result["created_at"]).strftime("%Y-%m-%d %H:%M")
+            speaker = "You" if result["role"] == "user" else (result["model"] or "Assistant")
+            results_display.insert(tk.END, f"\n[{timestamp}] {speaker}: {result['snippet']}\n")
+        results_display.configure(state=tk.DISABLED)
+
     def on_model_change(self):
         """Handle AI model selection change"""
         selected_model = self.model_var.get()
-        print(f"[DEBUG] Model selection changed in UI to: {selected_model}")
-        try:
-            self.conversation_manager.set_ai_model(selected_model)
+        logger.debug("Model selection changed in UI to: %s", selected_model)
+
+        def on_done(_):
+            # An earlier switch may have been rejected meanwhile; show the model in use
+            self.show_current_model()
             self.update_status(f"Switched to {selected_model}")
-            print(f"[DEBUG] Successfully switched conversation manager to {selected_model}")
-        except Exception as e:
-            print(f"[DEBUG] Error switching model in UI: {str(e)}")
+
+        def on_error(e):
+            self.show_current_model()
             self.update_status(f"Error switching to {selected_model}: {str(e)}")
 
+        try:
+            # Switch on the worker so it never races with a running turn
+            submitted = self.pipeline.submit(
+                lambda: self.conversation_manager.set_ai_model(selected_model),
+                on_done=on_done,
+                on_error=on_error,
+                name="model_switch",
+                cancellable=False
+            )
+            if not submitted:
+                self.show_current_model()
+                self.update_status("Still working on earlier requests, please wait...")
+            logger.debug("Queued switch of conversation manager to %s", selected_model)
+        except Exception as e:
+            logger.warning("Error switching model in UI: %s", e)
+            on_error(e)
+
+    def show_current_model(self):
+        """Set the model selector back to the model the conversation manager is using"""
+        self.model_var.set(self.conversation_manager.current_model.get_model_name())
+
     def create_font_control(self):
         # Create frame for font size control
         font_control_frame = ttk.Frame(self.main_container)
@@ -368,18 +496,22 @@ class DualCameraGPTApp:
         self.font_size_label.pack(side=tk.LEFT, padx=5)
 
     def update_font_size(self, *args):
+        """Follow the slider; the fonts change once it stops moving"""
+        self.font_size_label.configure(text=str(self.font_size_var.get()))
+        if self.font_update_timer:
+            self.master.after_cancel(self.font_update_timer)
+        self.font_update_timer = self.master.after(FONT_DEBOUNCE_MS, self.apply_font_size)
+
+    def apply_font_size(self):
+        self.font_update_timer = None
         new_size = self.font_size_var.get()
+        if new_size == self.current_font_size:
+            return
         self.current_font_size = new_size
-        self.chat_font.configure(size=new_size)
-        self.font_size_label.configure(text=str(new_size))
-        
-        # Update text tags with new font size
-        self.setup_text_tags()
-        
-        # Update font for both chat display and input area
-        self.chat_display.configure(font=self.chat_font)
-        self.chat_input.configure(font=self.chat_font)
-        
+
+        # The chat display, its tags and the input area share the named fonts,
+        # so this updates all of them
+        self.transcript.set_font_size(new_size)
         
         # Adjust chat display height - maintain about 10 lines of text
         # As font gets bigger, reduce number of lines to maintain reasonable height
@@ -401,9 +533,6 @@ class DualCameraGPTApp:
         #self.chat_display.configure(height=adjusted_height)
         self.chat_display.configure(height=display_height)
 
-        # Force update of the display
-        self.master.update_idletasks()
-
 
     def handle_up_key(self, event):
         if len(self.command_history) > 0:
@@ -441,14 +570,29 @@ Esc - Stop GPT's talking
 
 How can I help you today?
 """
-        self.chat_display.insert(tk.END, welcome_message)
-        self.chat_display.see(tk.END)
+        self.transcript.append_text(welcome_message)
 
 
+    def restore_previous_session(self):
+        """Reload the most recent session so context survives a restart"""
+        try:
+            restored = self.conversation_manager.resume_session()
+            if restored:
+                # The latest messages are shown above the welcome text; scrolling up loads more
+                self.transcript.load_older(self.conversation_manager.session_id)
+                self.insert_colored_message("system", f"Restored {restored} messages from the previous session.")
+        except Exception as e:
+            logger.warning("Error restoring previous session: %s", e)
+
     def start_preview_threads(self):
         """Start preview threads for available cameras"""
+        # Hold at most one pending frame per camera; a newer frame replaces it
+        self.preview_frame_counts = {}
+        self.preview_fps_started = time.monotonic()
+        depth = metrics.gauge("preview_queue_depth", "Frames waiting to be shown", ("camera",))
         if self.picam1:
-            self.preview_queue1 = queue.Queue()
+            self.preview_queue1 = queue.Queue(maxsize=1)
+            depth.set_function(self.preview_queue1.qsize, camera="1")
             threading.Thread(
                 target=self.capture_preview_loop,
                 args=(self.picam1, self.preview_queue1, 1),
@@ -456,7 +600,8 @@ How can I help you today?
             ).start()
             
         if self.picam2:
-            self.preview_queue2 = queue.Queue()
+            self.preview_queue2 = queue.Queue(maxsize=1)
+            depth.set_function(self.preview_queue2.qsize, camera="2")
             threading.Thread(
                 target=self.capture_preview_loop,
                 args=(self.picam2, self.preview_queue2, 2),
@@ -473,10 +618,19 @@ How can I help you today?
                 # Convert directly to PIL Image with correct color format
                 image = Image.fromarray(frame, 'RGBA').convert('RGB')
                 photo = ImageTk.PhotoImage(image)
-                preview_queue.put(photo)
+                try:
+                    preview_queue.put_nowait(photo)
+                except queue.Full:
+                    # The UI has not shown the previous frame yet; show the newer one instead
+                    try:
+                        preview_queue.get_nowait()
+                        _PREVIEW_DROPPED.inc(camera=camera_num)
+                    except queue.Empty:
+                        pass
+                    preview_queue.put_nowait(photo)
             except Exception as e:
-                print(f"Error capturing preview from camera {camera_num}: {e}")
-            self.master.after(10)
+                logger.error("Error capturing preview from camera %s: %s", camera_num, e)
+            time.sleep(0.01)
 
     
     def update_preview_canvases(self):
@@ -486,22 +640,44 @@ How can I help you today?
                 photo1 = self.preview_queue1.get_nowait()
                 self.preview1_canvas.create_image(0, 0, anchor=tk.NW, image=photo1)
                 self.preview1_canvas.image = photo1
+                self.count_preview_frame(1)
             
             if hasattr(self, 'preview_queue2') and not self.preview_queue2.empty():
                 photo2 = self.preview_queue2.get_nowait()
                 self.preview2_canvas.create_image(0, 0, anchor=tk.NW, image=photo2)
                 self.preview2_canvas.image = photo2
+                self.count_preview_frame(2)
                 
         except Exception as e:
-            print(f"Error updating preview canvases: {e}")
+            logger.error("Error updating preview canvases: %s", e)
         
         if self.running:
             self.master.after(10, self.update_preview_canvases)
 
 
+    def count_preview_frame(self, camera_num: int):
+        """Count a shown preview frame and refresh the FPS gauges about once a second"""
+        _PREVIEW_FRAMES.inc(camera=camera_num)
+        self.preview_frame_counts[camera_num] = self.preview_frame_counts.get(camera_num, 0) + 1
+        elapsed = time.monotonic() - self.preview_fps_started
+        if elapsed >= 1.0:
+            for camera, count in self.preview_frame_counts.items():
+                _PREVIEW_FPS.set(count / elapsed, camera=camera)
+            self.preview_frame_counts = {}
+            self.preview_fps_started = time.monotonic()
+
+    def update_latency_hud(self):
+        """Show the most recent span timings"""
+        self.hud_label.config(text=tracer.hud_text())
+        if self.running:
+            self.master.after(500, self.update_latency_hud)
+
     def update_status(self, message):
+        """Show a status message; safe to call from worker threads"""
+        if not self.pipeline.in_main_thread():
+            self.pipeline.post(self.update_status, message)
+            return
         self.status_label.config(text=message)
-        self.master.update_idletasks()
 
     def handle_input(self):
         user_input = self.chat_input.get().strip()
@@ -519,17 +695,13 @@ How can I help you today?
         #self.chat_display.insert(tk.END, f"\nYou: {user_input}\n")
         #self.chat_display.see(tk.END)
         # Display user input with color
-        self.insert_colored_message("human", user_input)
+        user_message = self.insert_colored_message("human", user_input)
 
         # Check for exit commands
         if user_input.lower() in ['quit', 'exit', 'bye']:
             self.exit_program()
             return
     
-        # Get current model name
-        current_model = self.conversation_manager.current_model.get_model_name()
-        
-
         # Check if we need to capture from either camera
         #image_path = None
         #if "camera 1" in user_input.lower() or "front camera" in user_input.lower():
@@ -539,15 +711,9 @@ How can I help you today?
         #    self.update_status("Processing image from Camera 2... Please wait.")
         #    image_path = CameraManager.capture_and_convert(self.picam2, 2)
         
-        # Check if we need to capture from either camera
-        image_path = None
-        if ("camera 1" in user_input.lower() or "front camera" in user_input.lower()) and self.picam1:
-            self.update_status("Processing image from Camera 1... Please wait.")
-            image_path = CameraManager.capture_and_convert(self.picam1, 1)
-        elif ("camera 2" in user_input.lower() or "rear camera" in user_input.lower()) and self.picam2:
-            self.update_status("Processing image from Camera 2... Please wait.")
-            image_path = CameraManager.capture_and_convert(self.picam2, 2)
-        elif ("camera" in user_input.lower() or "camera 1" in user_input.lower() or 
+        # The conversation manager captures the image itself; only check
+        # here that the requested camera exists
+        if ("camera" in user_input.lower() or "camera 1" in user_input.lower() or 
               "camera 2" in user_input.lower() or "front camera" in user_input.lower() or 
               "rear camera" in user_input.lower()):
             if not (self.picam1 or self.picam2):
@@ -555,33 +721,57 @@ How can I help you today?
                 return
             elif not self.picam2 and ("camera 2" in user_input.lower() or "rear camera" in user_input.lower()):
                 self.insert_colored_message("system", "Only one camera available. Using Camera 1.")
-                self.update_status("Processing image from Camera 1... Please wait.")
-                image_path = CameraManager.capture_and_convert(self.picam1, 1)
- 
-
-        # Get response from GPT
-        response = self.conversation_manager.get_response(
-            user_input,
-            status_callback=self.update_status
+
+        # Get response from GPT on the worker thread; the model name is read there
+        # too, so a model switch queued ahead of this turn is already applied
+        submitted = self.pipeline.submit(
+            lambda: (
+                self.conversation_manager.current_model.get_model_name(),
+                self.conversation_manager.get_response(
+                    user_input,
+                    status_callback=self.update_status
+                ),
+                self.conversation_manager.stored_turn_keys()
+            ),
+            on_done=lambda result: self.display_response(*result, user_message=user_message),
+            on_error=self.on_turn_error,
+            name="turn"
         )
-        
-        # Display assistant response with model-specific prefix
-        #self.chat_display.insert(tk.END, f"\n{current_model}: {response}\n")
-        #self.chat_display.see(tk.END)
+        if not submitted:
+            self.update_status("Still working on earlier requests, please wait...")
 
-        # Display assistant response before TTS starts
-        #self.chat_display.insert(tk.END, f"\nAssistant: {response}\n")
-        #self.chat_display.see(tk.END)
-        
-        # Display AI response with appropriate color
-        self.insert_colored_message(current_model, response)
+    def on_turn_error(self, error: Exception):
+        """Report a turn that did not finish (runs on the Tk thread)"""
+        if isinstance(error, TurnCancelled):
+            self.insert_colored_message("system", "(cancelled)")
+            self.update_status("")
+        else:
+            self.update_status(f"Error: {error}")
 
-        
-        # Clear status
-        self.update_status("")
+    def display_response(self, current_model: str, response: str, stored=(None, None), user_message=None):
+        """
+        Show a finished turn (runs on the Tk thread)
+        Args:
+            stored: Store keys of the turn's input and reply (None if not stored),
+                so the transcript can page them back in
+            user_message: The transcript entry of the user's input
+        """
+        input_key, reply_key = stored
+        if input_key is not None and user_message is not None:
+            self.transcript.set_key(user_message, input_key)
+
+        # Display AI response with appropriate color; an error text has no stored message
+        self.insert_colored_message(current_model, response, reply_key)
+
+        # Clear status unless more turns are waiting
+        if not self.pipeline.busy:
+            self.update_status("")
 
     def cleanup(self):
         self.running = False
+        self.transcriber.shutdown()
+        self.conversation_manager.tts_manager.close()
+        self.audio_capture.close()
         if hasattr(self, 'picam1'):
             self.picam1.stop()
             self.picam1.close()
@@ -590,141 +780,240 @@ How can I help you today?
             self.picam2.close()
 
     def exit_program(self):
+        logger.debug("UI frame latency: %s", self.pipeline.get_ui_latency_stats())
+        logger.debug("Cancel latency: %s", self.pipeline.get_cancel_latency_stats())
+        logger.debug("Speech cache: %s", self.conversation_manager.tts_manager.cache.stats())
+        self.pipeline.shutdown()
         self.cleanup()
         self.master.quit()
         self.master.destroy()
     
 
-    def toggle_recording(self):
+    def toggle_recording(self, preroll_seconds: Optional[float] = None):
+        """
+        Start or stop recording
+        Args:
+            preroll_seconds: Audio from before now to include in a new recording,
+                defaults to the configured pre-roll
+        """
         if not self.is_recording:
             # Start recording
+            try:
+                self.audio_capture.begin(preroll_seconds)
+            except Exception as e:
+                logger.error("Error recording audio: %s", e)
+                self.update_status(f"Error recording audio: {e}")
+                return
             self.is_recording = True
             self.record_button.configure(bg='red', activebackground='dark red')
-            self.update_status("Recording audio...")
-            self.audio_data = []
-            self.recording_thread = threading.Thread(target=self.record_audio)
-            self.recording_thread.start()
+            self.recording_started = time.perf_counter()
+            if self.hands_free or self.conversation_mode:
+                self.update_status("Listening... (stops when you pause)")
+                self.endpoint_detector.reset()
+                self.master.after(ENDPOINT_POLL_MS, self.check_endpoint)
+            else:
+                self.update_status("Recording audio...")
+            if self.streaming_transcription:
+                self.transcriber.begin()
+                self.master.after(TRANSCRIPTION_POLL_MS, self.poll_transcription)
+            prewarm()
         else:
             # Stop recording
             self.is_recording = False
             self.record_button.configure(bg='light gray', activebackground='gray')
             self.update_status("Processing audio...")
-            if self.recording_thread:
-                self.recording_thread.join()
-            self.save_and_transcribe_audio()
+            with tracer.span("recording_stop"):
+                # Measured on the audio before the recording, which is not all speech
+                noise_floor = self.vad.estimate_noise_floor(self.audio_capture.idle(), self.sample_rate)
+                if self.streaming_transcription:
+                    audio, segments = self.transcriber.stop()
+                    work = lambda: self.finish_streaming_transcription(audio, segments, noise_floor)
+                else:
+                    audio = self.audio_capture.end()
+                    work = lambda: self.save_and_transcribe_audio(audio, noise_floor)
+            tracer.record("recording", self.recording_started, time.perf_counter() - self.recording_started)
+            if not self.pipeline.submit(
+                    work,
+                    on_done=self.on_transcription_done,
+                    on_error=self.on_turn_error,
+                    name="transcription"):
+                self.update_status("Still working on earlier requests, please wait...")
+
+    def toggle_hands_free(self):
+        """Switch between press-to-stop and stop-on-silence recording"""
+        self.hands_free = not self.hands_free
+        self.update_status("Hands-free recording " + ("on" if self.hands_free else "off"))
+
+    def check_endpoint(self):
+        """Stop a hands-free recording once the user stops talking (runs on the Tk thread)"""
+        if not self.is_recording or not (self.hands_free or self.conversation_mode):
+            return
+        recent = self.audio_capture.tail(self.endpoint_detector.window_seconds())
+        elapsed = time.perf_counter() - self.recording_started
+        if self.endpoint_detector.update(recent, self.sample_rate, elapsed):
+            logger.debug("End of utterance detected after %.1f s", elapsed)
+            if self.endpoint_detector.heard_speech:
+                # The reply is timed from the end of the speech, not from the end of the pause
+                self.duplex.user_finished(time.monotonic() - self.endpoint_detector.silence_seconds)
+            self.toggle_recording()
+        else:
+            self.master.after(ENDPOINT_POLL_MS, self.check_endpoint)
+
+    def toggle_conversation_mode(self):
+        """Switch listening during replies (and interrupting them by speaking) on or off"""
+        self.conversation_mode = not self.conversation_mode
+        self.update_status("Conversation mode " + ("on" if self.conversation_mode else "off"))
+        # Only one listening loop may ever be scheduled: each poll raises the noise floor
+        if self.listen_timer:
+            self.master.after_cancel(self.listen_timer)
+            self.listen_timer = None
+        if self.conversation_mode:
+            self.listen_timer = self.master.after(DUPLEX_POLL_MS, self.listen_for_speech)
+
+    def listen_for_speech(self):
+        """
+        Start recording when the user starts talking, interrupting the reply
+        being spoken or prepared (runs on the Tk thread)
+        """
+        self.listen_timer = None
+        if not self.running or not self.conversation_mode:
+            return
+        if not self.is_recording:
+            onset = self.duplex.poll()
+            if onset is not None:
+                if self.duplex.barge_in(onset):
+                    logger.debug("Reply interrupted by the user")
+                cancelled = self.pipeline.cancel_all()
+                if cancelled:
+                    logger.debug("Cancelled %s turns for the user's new input", cancelled)
+                # Include the detected speech, plus the usual pre-roll before it
+                self.toggle_recording(time.monotonic() - onset + self.audio_capture.preroll_frames / self.sample_rate)
+        self.listen_timer = self.master.after(DUPLEX_POLL_MS, self.listen_for_speech)
+
+    def poll_transcription(self):
+        """Send finished parts of the recording for transcription (runs on the Tk thread)"""
+        if not self.is_recording:
+            return
+        try:
+            self.transcriber.poll()
+        except Exception as e:
+            logger.warning("Streaming transcription failed, transcribing at the end: %s", e)
+            return
+        self.master.after(TRANSCRIPTION_POLL_MS, self.poll_transcription)
 
-    def record_audio(self):
-        """Record audio in chunks while is_recording is True."""
+    def finish_streaming_transcription(self, combined_audio: np.ndarray, segments,
+                                       noise_floor: Optional[float] = None) -> str:
+        """
+        Join the segment transcripts of a streamed recording (runs on the worker thread).
+        Falls back to transcribing the whole recording if a segment failed.
+        Args:
+            combined_audio: The whole recording
+            segments: Segment futures from StreamingTranscriber.stop()
+            noise_floor: Room noise in dBFS from before the recording, for the fallback
+        """
         try:
-            with sd.InputStream(channels=1, samplerate=self.sample_rate, dtype='float32') as stream:
-                while self.is_recording:
-                    audio_chunk, _ = stream.read(self.sample_rate)
-                    self.audio_data.append(audio_chunk)
+            transcription_start = time.monotonic()
+            with tracer.span("transcription_wait", segments=len(segments)):
+                transcribed = self.transcriber.collect(segments)
         except Exception as e:
-            print(f"Error recording audio: {e}")
-            self.update_status(f"Error recording audio: {e}")
-            self.is_recording = False
-            self.master.after(0, lambda: self.record_button.configure(
-                bg='light gray', 
-                activebackground='gray'
-            ))
+            logger.warning("Segment transcription failed, sending the whole recording: %s", e)
+            return self.save_and_transcribe_audio(combined_audio, noise_floor)
+        current_token().raise_if_cancelled()
+        if not transcribed:
+            self.update_status("No speech detected")
+            return ""
+
+        text = self.converter.convert(transcribed)
+        recorder.record_transcription(
+            text,
+            len(combined_audio) / self.sample_rate,
+            time.monotonic() - transcription_start
+        )
+        return text
 
-    def save_and_transcribe_audio(self):
-        """Save recorded audio to MP3 and transcribe it."""
+    def save_and_transcribe_audio(self, combined_audio: np.ndarray, noise_floor: Optional[float] = None) -> str:
+        """
+        Encode recorded audio and transcribe it (runs on the worker thread).
+        Args:
+            combined_audio: Mono float32 samples from AudioCapture.end()
+            noise_floor: Room noise in dBFS from before the recording, for trimming silence
+        """
         try:
-            if not self.audio_data:
+            if not len(combined_audio):
                 self.update_status("No audio recorded")
-                return
+                return ""
 
-            # Combine all audio chunks
-            combined_audio = np.concatenate(self.audio_data)
-            
-            # Convert to AudioSegment
-            audio_segment = AudioSegment(
-                (combined_audio * 32767).astype(np.int16).tobytes(),
-                frame_rate=self.sample_rate,
-                sample_width=2,
-                channels=1
-            )
-            
-            # Save as MP3
-            output_path = Path("/tmp") / f"recording_{int(time.time())}.mp3"
-            audio_segment.export(str(output_path), format="mp3")
-            
-            # Transcribe audio
-            self.update_status("Transcribing audio...")
-            with open(output_path, "rb") as audio_file:
-                transcription = self.conversation_manager.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
-            
-            # Convert to traditional Chinese if needed and display
-            transcribed_text = self.converter.convert(transcription.text)
-            self.chat_input.insert(0, transcribed_text)
-            self.update_status("")
-            
-            # Clean up
-            if output_path.exists():
-                os.remove(output_path)
+            # Only the speech is uploaded; Whisper tends to invent text for pure silence
+            speech = self.vad.trim(combined_audio, self.sample_rate, noise_floor=noise_floor)
+            if not len(speech):
+                self.update_status("No speech detected")
+                return ""
 
-            # Automatically trigger send after a short delay (to ensure UI is updated)
-            self.master.after(100, self.handle_input) #delay 100ms to trigger the Send button
+            # 16 kHz FLAC/WAV encoded in memory, no temp file or ffmpeg
+            upload = prepare_upload(speech, self.sample_rate)
 
+            # Transcribe audio
+            self.update_status("Transcribing audio...")
+            transcription_start = time.monotonic()
+            transcribed = transcribe(self.conversation_manager.client, upload)
+
+            # Don't send the text if the user pressed Esc meanwhile
+            current_token().raise_if_cancelled()
+
+            # Convert to traditional Chinese if needed
+            text = self.converter.convert(transcribed)
+            recorder.record_transcription(
+                text,
+                len(speech) / self.sample_rate,
+                time.monotonic() - transcription_start
+            )
+            return text
             
+        except TurnCancelled:
+            raise
         except Exception as e:
-            print(f"Error processing audio: {e}")
+            logger.error("Error processing audio: %s", e)
             self.update_status(f"Error processing audio: {e}")
+            return ""
+
+    def on_transcription_done(self, transcribed_text: str):
+        """Put the transcription in the input box and send it (runs on the Tk thread)"""
+        if not transcribed_text:
+            return
+        self.chat_input.insert(0, transcribed_text)
+        self.update_status("")
+
+        # Automatically trigger send after a short delay (to ensure UI is updated)
+        self.master.after(100, self.handle_input) #delay 100ms to trigger the Send button
 
 
     def stop_audio(self, event=None):
         """
-        Stop audio playback when Escape is pressed.
+        Cancel the in-flight turn and stop audio playback when Escape is pressed.
+        A recording in progress is dropped, along with its pending segment uploads.
         """
         try:
+            if self.is_recording:
+                self.is_recording = False
+                self.record_button.configure(bg='light gray', activebackground='gray')
+                if self.streaming_transcription:
+                    self.transcriber.cancel()
+                else:
+                    self.audio_capture.cancel()
+            cancelled = self.pipeline.cancel_all()
             self.conversation_manager.tts_manager.stop_playback()
-            self.update_status("")
+            self.update_status("Cancelling..." if cancelled else "")
         except Exception as e:
-            print(f"Error stopping audio: {e}")
+            logger.error("Error stopping audio: %s", e)
             self.update_status("Error stopping audio")
-    
-        # Ensure the UI remains responsive
-        self.master.update()
-
-    def setup_text_tags(self):
-        """Configure text tags for color coding messages"""
-        for participant, color in self.chat_colors.items():
-            self.chat_display.tag_configure(
-                participant,
-                foreground=color,
-                font=(self.chat_font.actual('family'),
-                      self.chat_font.actual('size'),
-                      'bold')  # Make speaker names bold
-            )
-            # Add a tag for the message text itself (not bold)
-            self.chat_display.tag_configure(
-                f"{participant}_text",
-                foreground=color,
-                font=(self.chat_font.actual('family'),
-                      self.chat_font.actual('size'))
-            )
-
-    def insert_colored_message(self, speaker: str, message: str):
-        """Insert a color-coded message into the chat display"""
-        # Get the appropriate color tag
-        tag = speaker if speaker in self.chat_colors else 'human'
 
-        # Insert speaker label with bold colored font
-        if speaker == "human":
-            speaker_text = "You: "
-        else:
-            speaker_text = f"{speaker}: "
-
-        self.chat_display.insert(tk.END, f"\n{speaker_text}", tag)
-
-        # Insert message with colored but not bold font
-        self.chat_display.insert(tk.END, f"{message}\n", f"{tag}_text")
-
-        # Ensure the latest message is visible
-        self.chat_display.see(tk.END)
+    def insert_colored_message(self, speaker: str, message: str, stored=None):
+        """
+        Insert a color-coded message into the chat display and scroll to it
+        Args:
+            stored: (session id, seq) of the message in the session store, if it is stored
+        Returns:
+            The transcript entry, for TranscriptView.set_key()
+        """
+        return self.transcript.append(speaker, message, stored)
 
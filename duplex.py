@@ -0,0 +1,134 @@
+# duplex.py
+import logging
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from audio_capture import AudioCapture
+from metrics import metrics
+from vad import VoiceActivityDetector
+
+logger = logging.getLogger(__name__)
+
+_TURN_SECONDS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+_RESPONSE_LATENCY = metrics.histogram("voice_response_seconds",
+                                      "From the end of the user's speech to the first audio of the reply",
+                                      buckets=_TURN_SECONDS)
+_BARGE_IN_LATENCY = metrics.histogram("voice_barge_in_seconds",
+                                      "From the start of the user's speech to speech output stopping",
+                                      buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0))
+_BARGE_INS = metrics.counter("voice_barge_ins_total", "Replies interrupted by the user speaking")
+
+# How much of the live microphone each poll analyzes
+WINDOW_SECONDS = 0.6
+# Speech output keeps echoing around the room for a moment after it stops
+ECHO_TAIL_SECONDS = 0.3
+# How fast the noise floor may rise per poll, so it follows a room that gets louder
+FLOOR_RISE_DB = 0.1
+
+
+class DuplexMonitor:
+    """
+    Listens to the live microphone in conversation mode, between and during replies.
+
+    Polled while no recording runs, it reports when the user starts
+    talking: a run of at least min_speech_seconds of speech that is still
+    going on. While speech output plays, and for a moment after, the
+    speaker's own sound reaches the microphone, so the thresholds are
+    raised by echo_margin_db over the noise floor; the floor itself is
+    only learned while the output is quiet. The caller then stops the
+    output, cancels the turn in flight and starts recording.
+
+    It also measures turn-taking in both directions: from the end of the
+    user's speech to the first audio of the reply, and from the start of a
+    barge-in to the output stopping.
+    """
+
+    def __init__(self,
+                 capture: AudioCapture,
+                 vad: VoiceActivityDetector,
+                 tts_manager,
+                 echo_margin_db: Optional[float] = None,
+                 min_speech_seconds: float = 0.25):
+        """
+        Args:
+            capture: The always-open microphone
+            vad: Voice activity detector
+            tts_manager: Speech output; is_playing, last_utterance and stop_playback() are used
+            echo_margin_db: Extra margin while speech output is audible, defaults to
+                CYBERDECK_BARGE_IN_DB (15 dB)
+            min_speech_seconds: Speech needed before it counts as the user talking
+        """
+        if echo_margin_db is None:
+            echo_margin_db = float(os.environ.get("CYBERDECK_BARGE_IN_DB", "15"))
+        self.capture = capture
+        self.vad = vad
+        self.tts_manager = tts_manager
+        self.echo_margin_db = echo_margin_db
+        self.min_frames = max(1, int(min_speech_seconds * 1000 / vad.frame_ms))
+        self.noise_floor: Optional[float] = None
+        self._output_heard_at = 0.0
+        # End of the user's last utterance, until the reply starts playing
+        self._awaiting_reply_since: Optional[float] = None
+
+    def poll(self) -> Optional[float]:
+        """
+        Check the newest audio for the user starting to talk
+        Returns:
+            Optional[float]: Monotonic time the speech started, or None
+        """
+        now = time.monotonic()
+        self._check_reply()
+        if self.tts_manager.is_playing:
+            self._output_heard_at = now
+        echo = now - self._output_heard_at < ECHO_TAIL_SECONDS
+
+        rate = self.capture.sample_rate
+        window = self.capture.latest(WINDOW_SECONDS)
+        if not echo:
+            estimate = self.vad.estimate_noise_floor(window, rate)
+            if estimate is not None:
+                self.noise_floor = estimate if self.noise_floor is None else min(
+                    estimate, self.noise_floor + FLOOR_RISE_DB)
+        if self.noise_floor is None:
+            return None
+
+        floor = self.noise_floor + (self.echo_margin_db if echo else 0.0)
+        speech = self.vad.speech_frames(window, rate, floor)
+        # Length of the speech run reaching the newest frame
+        quiet = np.flatnonzero(~speech)
+        run = len(speech) - (quiet[-1] + 1 if len(quiet) else 0)
+        if run < self.min_frames:
+            return None
+        onset = now - run * self.vad.frame_ms / 1000
+        logger.debug("User speech detected (%.0f ms%s)", run * self.vad.frame_ms, ", over echo" if echo else "")
+        return onset
+
+    def barge_in(self, onset: float) -> bool:
+        """
+        Stop speech output for the user, who started talking at onset
+        Returns:
+            bool: True if a reply was playing
+        """
+        if not self.tts_manager.is_playing:
+            return False
+        self.tts_manager.stop_playback()
+        _BARGE_INS.inc()
+        _BARGE_IN_LATENCY.observe(time.monotonic() - onset)
+        self._awaiting_reply_since = None
+        return True
+
+    def user_finished(self, at: float) -> None:
+        """The user stopped talking at monotonic time at; the reply is timed from here"""
+        self._awaiting_reply_since = at
+
+    def _check_reply(self) -> None:
+        since = self._awaiting_reply_since
+        utterance = self.tts_manager.last_utterance
+        if since is None or utterance is None or utterance.requested < since or utterance.started_at is None:
+            return
+        _RESPONSE_LATENCY.observe(utterance.started_at - since)
+        logger.debug("Reply started %.0f ms after the user finished", (utterance.started_at - since) * 1000)
+        self._awaiting_reply_since = None
@@ -0,0 +1,325 @@
+# duplex_simulation.py
+"""
+Simulated conversation-mode session against local mock providers.
+
+A simulated user talks to the app through a simulated microphone: turns
+alternate between waiting for the reply to finish and talking over it.
+Speech output is not played but looped back into the microphone,
+attenuated by --echo-db, as a speaker next to the microphone would be. The
+app side runs the same DuplexMonitor, endpointing and turn code as
+conversation mode in the UI, so the run reports how long replies take to
+start after the user stops talking, how long speech output takes to stop
+after the user starts talking over it, and how often echo alone was taken
+for the user (false barge-ins) or the user was not heard (missed ones):
+
+    python duplex_simulation.py --turns 10 --output duplex.json
+    python duplex_simulation.py --echo-db -10
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmark import TurnBenchmark, git_version, percentile, start_mock_environment
+from logging_setup import setup_logging
+from mock_servers import MockBehavior, MockProviders
+
+logger = logging.getLogger(__name__)
+
+# Simulated microphone
+MIC_RATE = 16000
+MIC_BLOCK_SECONDS = 0.02
+NOISE_LEVEL = 0.002
+# Same polling intervals as DualCameraGPTApp
+DUPLEX_POLL_SECONDS = 0.05
+ENDPOINT_POLL_SECONDS = 0.1
+# A barge-in not noticed within this long counts as missed
+BARGE_IN_DEADLINE = 1.5
+
+
+def user_speech(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    """Synthetic utterance: voiced syllables at about four per second, louder than the echo"""
+    t = np.arange(int(seconds * MIC_RATE)) / MIC_RATE
+    pitch = 180 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / MIC_RATE
+    voiced = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi))
+    return (0.15 * envelope * voiced).astype(np.float32)
+
+
+class SimulatedRoom:
+    """
+    Microphone and speaker sharing a room.
+
+    The speaker replaces the AudioEngine's output device: writes block for
+    as long as the audio would take to play and the sound reaches the
+    microphone attenuated by echo_db. A microphone thread feeds background
+    noise, the echo and the simulated user's speech into the AudioCapture.
+    """
+
+    def __init__(self, capture, echo_db: float, seed: int):
+        self.capture = capture
+        self.echo_gain = 10 ** (echo_db / 20)
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._echo = np.zeros(0, dtype=np.float32)
+        self._speech = np.zeros(0, dtype=np.float32)
+        # Monotonic times the user's current utterance started and ended
+        self.speech_started: Optional[float] = None
+        self.speech_ended: Optional[float] = None
+        self._running = True
+        self._thread = threading.Thread(target=self._microphone, name="simulated microphone", daemon=True)
+        self._thread.start()
+
+    @property
+    def user_speaking(self) -> bool:
+        with self._lock:
+            return len(self._speech) > 0
+
+    def say(self, audio: np.ndarray) -> None:
+        """Start speaking audio into the microphone"""
+        with self._lock:
+            self._speech = audio
+            self.speech_started = None
+            self.speech_ended = None
+
+    def speaker(self, pcm: bytes) -> bool:
+        """AudioEngine output: 24 kHz 16-bit PCM, played in real time"""
+        samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+        duration = len(samples) / 24000
+        positions = np.arange(int(duration * MIC_RATE)) * 24000 / MIC_RATE
+        heard = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32) * self.echo_gain
+        with self._lock:
+            self._echo = np.concatenate((self._echo, heard))
+        time.sleep(duration)
+        return False
+
+    def _microphone(self) -> None:
+        frames = int(MIC_BLOCK_SECONDS * MIC_RATE)
+        next_block = time.monotonic()
+        while self._running:
+            block = (self.rng.standard_normal(frames) * NOISE_LEVEL).astype(np.float32)
+            with self._lock:
+                echo, self._echo = self._echo[:frames], self._echo[frames:]
+                block[:len(echo)] += echo
+                if len(self._speech):
+                    if self.speech_started is None:
+                        self.speech_started = time.monotonic()
+                    speech, self._speech = self._speech[:frames], self._speech[frames:]
+                    block[:len(speech)] += speech
+                    if not len(self._speech):
+                        self.speech_ended = time.monotonic()
+            self.capture.feed(block)
+            next_block += MIC_BLOCK_SECONDS
+            time.sleep(max(0.0, next_block - time.monotonic()))
+
+    def close(self) -> None:
+        self._running = False
+        self._thread.join(timeout=1.0)
+
+
+class DuplexSimulation(TurnBenchmark):
+    """Conversation mode of DualCameraGPTApp, driven by a simulated user"""
+
+    def __init__(self, work_dir: Path, echo_db: float, seed: int, verbose: bool = False):
+        super().__init__(work_dir, verbose)
+        # Imported here, after the environment points the app at the mocks
+        from audio_capture import AudioCapture
+        from duplex import DuplexMonitor
+        from vad import EndpointDetector, VoiceActivityDetector
+
+        self.capture = AudioCapture(MIC_RATE, device="none")
+        self.vad = VoiceActivityDetector()
+        self.endpoint_detector = EndpointDetector(self.vad)
+        self.tts = self.manager.tts_manager
+        self.monitor = DuplexMonitor(self.capture, self.vad, self.tts)
+        self.room = SimulatedRoom(self.capture, echo_db, seed)
+        self.tts.engine.output = self.room.speaker
+        self.is_recording = False
+        self.recording_started = 0.0
+        self._turn: Optional[threading.Thread] = None
+        self._running = True
+        self.detections: List[Dict] = []
+        self.barge_ins: List[float] = []
+        self._app = threading.Thread(target=self._app_loop, name="conversation mode", daemon=True)
+
+    # App side: the same steps as DualCameraGPTApp.listen_for_speech and check_endpoint
+
+    def _app_loop(self) -> None:
+        next_endpoint_check = 0.0
+        while self._running:
+            now = time.monotonic()
+            if not self.is_recording:
+                onset = self.monitor.poll()
+                if onset is not None:
+                    self.detections.append({"at": onset, "user_speaking": self.room.user_speaking})
+                    if self.monitor.barge_in(onset):
+                        self.barge_ins.append(time.monotonic())
+                    self.capture.begin(now - onset + self.capture.preroll_frames / MIC_RATE)
+                    self.endpoint_detector.reset()
+                    self.is_recording = True
+                    self.recording_started = now
+            elif now >= next_endpoint_check:
+                next_endpoint_check = now + ENDPOINT_POLL_SECONDS
+                recent = self.capture.tail(self.endpoint_detector.window_seconds())
+                if self.endpoint_detector.update(recent, MIC_RATE, now - self.recording_started):
+                    if self.endpoint_detector.heard_speech:
+                        self.monitor.user_finished(now - self.endpoint_detector.silence_seconds)
+                    self.is_recording = False
+                    audio = self.capture.end()
+                    self._turn = threading.Thread(target=self._respond, args=(audio,), daemon=True)
+                    self._turn.start()
+            time.sleep(DUPLEX_POLL_SECONDS)
+
+    def _respond(self, audio: np.ndarray) -> None:
+        speech = self.vad.trim(audio, MIC_RATE)
+        if not len(speech):
+            return
+        with self._quiet():
+            prompt = self.transcribe(self.manager.client, self.prepare_upload(speech, MIC_RATE))
+            self.manager.get_response(prompt)
+
+    # User side
+
+    def _idle(self) -> bool:
+        return (not self.is_recording and not self.tts.is_playing and self.tts.engine.depth == 0
+                and (self._turn is None or not self._turn.is_alive()))
+
+    def _wait(self, condition, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _speak(self, seconds: float) -> None:
+        self.room.say(user_speech(seconds, self.room.rng))
+        self._wait(lambda: self.room.speech_ended is not None, seconds + 1.0)
+
+    def run(self, turns: int, utterance_seconds: float, pause_seconds: float) -> Dict:
+        self._app.start()
+        # Let the noise floor settle
+        time.sleep(1.0)
+        responses: List[float] = []
+        barge_ins: List[float] = []
+        missed = 0
+        no_reply = 0
+        for turn in range(turns):
+            if not self._wait(self._idle, 30.0):
+                logger.warning("Turn %s: the previous reply did not finish", turn)
+            time.sleep(pause_seconds)
+            self._speak(utterance_seconds)
+            user_end = self.room.speech_ended
+
+            # Wait for the reply to start playing
+            if not self._wait(lambda: (self.tts.last_utterance is not None
+                                       and self.tts.last_utterance.requested > user_end
+                                       and self.tts.last_utterance.started_at is not None), 30.0):
+                no_reply += 1
+                continue
+            responses.append(self.tts.last_utterance.started_at - user_end)
+
+            if turn % 2:
+                # Talk over the reply once it has been playing for a moment
+                time.sleep(0.5)
+                if not self.tts.is_playing:
+                    continue
+                interrupted = len(self.barge_ins)
+                self.room.say(user_speech(utterance_seconds, self.room.rng))
+                if self._wait(lambda: len(self.barge_ins) > interrupted, BARGE_IN_DEADLINE):
+                    barge_ins.append(self.barge_ins[-1] - self.room.speech_started)
+                else:
+                    missed += 1
+                self._wait(lambda: self.room.speech_ended is not None, utterance_seconds + 1.0)
+
+        self._wait(self._idle, 30.0)
+        self._running = False
+        self._app.join(timeout=1.0)
+        self.room.close()
+        false_barge_ins = sum(1 for d in self.detections if not d["user_speaking"])
+        return {
+            "turns": turns,
+            "response": latency_summary(responses),
+            "barge_in": latency_summary(barge_ins),
+            "missed_barge_ins": missed,
+            "false_detections": false_barge_ins,
+            "turns_without_reply": no_reply,
+        }
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate conversation mode against local mock providers")
+    parser.add_argument("--turns", type=int, default=10, help="User turns; every second one talks over the reply")
+    parser.add_argument("--utterance", type=float, default=1.5, help="Length of each user utterance (s)")
+    parser.add_argument("--pause", type=float, default=0.5, help="Quiet time before each user turn (s)")
+    parser.add_argument("--echo-db", type=float, default=-20.0, help="Level of the speaker in the microphone")
+    parser.add_argument("--speech-seconds", type=float, default=2.0, help="Length of each mock speech clip")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock time to first token (s)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="duplex_results.json")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's debug output")
+    args = parser.parse_args(argv)
+    setup_logging("DEBUG" if args.verbose else "WARNING")
+
+    behavior_settings = {
+        "first_token_latency": args.latency,
+        "speech_seconds": args.speech_seconds,
+        "reply_words": 20,
+    }
+    mocks = start_mock_environment({
+        service: MockBehavior(seed=args.seed + index, **behavior_settings)
+        for index, service in enumerate(MockProviders.BASE_PATHS)
+    })
+
+    output_path = Path(args.output).resolve()
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="cyberdeck-duplex-") as work_dir:
+        os.chdir(work_dir)
+        try:
+            simulation = DuplexSimulation(Path(work_dir), args.echo_db, args.seed, args.verbose)
+            outcome = simulation.run(args.turns, args.utterance, args.pause)
+            simulation.manager.tts_manager.close()
+            simulation.manager.session_store.close()
+        finally:
+            os.chdir(original_dir)
+            mocks.stop()
+
+    report = dict(outcome, **{
+        "version": git_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": dict(behavior_settings, echo_db=args.echo_db, utterance=args.utterance, pause=args.pause),
+    })
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for name in ("response", "barge_in"):
+        summary = report[name]
+        print(f"{name:<9} {summary['count']:3d}  p50 {summary['p50_ms']:7.1f} ms  "
+              f"p95 {summary['p95_ms']:7.1f} ms  max {summary['max_ms']:7.1f} ms")
+    print(f"Missed barge-ins {report['missed_barge_ins']}, false detections {report['false_detections']}, "
+          f"turns without a reply {report['turns_without_reply']}")
+    print(f"Results written to {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
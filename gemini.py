@@ -1,17 +1,57 @@
 # gemini.py
+import base64
+import logging
+import os
+import time
 from ai_interface import AIModelInterface
 import google.generativeai as genai
-from typing import List, Dict, Optional, Union
-import PIL.Image
+from typing import List, Dict, Optional, Tuple
+from key_manager import KeyManager
+from rate_limiter import RateLimitExceeded, RateLimiter, estimate_tokens
+from cancellation import TurnCancelled, current_token
+
+logger = logging.getLogger(__name__)
+
+# Context caching needs a pinned model version and at least this many prompt tokens
+CACHE_MODEL = "models/gemini-1.5-flash-002"
+CACHE_MIN_TOKENS = 32768
+CACHE_TTL_SECONDS = 600
+
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 1000,
+    "candidate_count": 1
+}
+
+class _StreamCloser:
+    """Gives a streamed Gemini response the close() that CancelToken.closing() expects"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def close(self) -> None:
+        # The SDK keeps the transport stream (REST or gRPC) on _iterator; both can be cancelled
+        stream = getattr(self.response, "_iterator", None)
+        if stream is not None and hasattr(stream, "cancel"):
+            stream.cancel()
+
 
 class GeminiModel(AIModelInterface):
     def __init__(self, service_name: str = "google"):
         """Initialize Gemini with API key"""
         super().__init__(service_name)
-        print("[DEBUG] Initializing Gemini model")
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
-        self.chat = None
+        logger.debug("Initializing Gemini model")
+        base_url = KeyManager.get_base_url(service_name)
+        if base_url:
+            # Custom endpoints (e.g. a local fake server) are only reachable over REST
+            genai.configure(
+                api_key=self.api_key,
+                transport="rest",
+                client_options={"api_endpoint": base_url}
+            )
+        else:
+            genai.configure(api_key=self.api_key)
+        self.model_name = "gemini-1.5-flash"
         self.system_context = """You are a knowledgeable female assistant with expertise in Japanese, 
                 English, Chinese, Christianity, and Biblical studies. There are two cameras in the system:
                 Camera 1 (front camera) and Camera 2 (rear camera). When asked about 'camera 1' or 'front camera', 
@@ -19,97 +59,195 @@ class GeminiModel(AIModelInterface):
                 the rear view image. Please provide helpful and accurate responses for daily life questions and 
                 image analysis. Maintain conversation context and provide responses in the same language as the 
                 user's query."""
-        print("[DEBUG] Gemini model initialized successfully")
+        # Model bound to the current system instruction, rebuilt when the prompt changes
+        self.model = None
+        self._system_instruction = None
+        # Converted history: (original message, Gemini content) for each message sent so far
+        self._converted: List[Tuple[Dict, Dict]] = []
+        # Context caching of the stable history prefix (CYBERDECK_GEMINI_CACHE=1)
+        self.cache_enabled = os.environ.get("CYBERDECK_GEMINI_CACHE", "") in ("1", "true") and not base_url
+        self._cache = None
+        self._cached_messages: List[Dict] = []
+        self._cache_expires = 0.0
+        logger.debug("Gemini model initialized successfully")
         
     def get_model_name(self) -> str:
         return "Gemini"
-    
+
+    def _get_model(self, system_instruction: str) -> genai.GenerativeModel:
+        if self.model is None or system_instruction != self._system_instruction:
+            self.model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+            self._system_instruction = system_instruction
+            self._drop_cache()
+        return self.model
+
+    def _convert_message(self, message: Dict, image_path: Optional[str] = None) -> Dict:
+        """Convert one history message to a Gemini content with text and inline image parts"""
+        role = "model" if message["role"] == "assistant" else "user"
+        if isinstance(message["content"], str):
+            return {"role": role, "parts": [{"text": message["content"]}]}
+
+        parts = []
+        for part in message["content"]:
+            if part.get("type") == "text":
+                parts.append({"text": part["text"]})
+            elif part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                header, _, data = url.partition(",")
+                mime_type = header[len("data:"):].split(";")[0] or "image/jpeg"
+                parts.append({"inline_data": {"mime_type": mime_type, "data": base64.b64decode(data)}})
+        if image_path:
+            # Tell the model which camera the new image came from
+            camera_context = "front camera (Camera 1)" if "camera1" in image_path else "rear camera (Camera 2)"
+            parts.insert(0, {"text": f"Analyzing image from {camera_context}."})
+        return {"role": role, "parts": parts}
+
     def format_messages(self, 
                        conversation_history: List[Dict],
-                       image_path: Optional[str] = None) -> Union[List[str], List[Union[str, PIL.Image.Image]]]:
+                       image_path: Optional[str] = None) -> Tuple[str, List[Dict]]:
         """
         Format messages for Gemini API
+        Messages already converted on an earlier turn are reused, so images are
+        decoded once and each turn only converts what was added since.
+        Returns:
+            Tuple[str, List[Dict]]: (system_instruction, contents)
         """
-        print(f"[DEBUG] Gemini format_messages: Image path = {image_path}")
-        
-        # Extract the last message
-        last_message = conversation_history[-1]
-        print(f"[DEBUG] Gemini last message: {last_message}")
-        
-        # Extract the text content
-        if isinstance(last_message["content"], list):
-            text_content = last_message["content"][0]["text"]
-        else:
-            text_content = last_message["content"]
-            
-        print(f"[DEBUG] Gemini text content: {text_content}")
-        
-        # If there's an image, handle it with context
-        if image_path:
+        system_instruction = self.system_context
+        messages = conversation_history
+        if messages and messages[0]["role"] == "system":
+            system_instruction = messages[0]["content"]
+            messages = messages[1:]
+        messages = [m for m in messages if m["role"] in ("user", "assistant")]
+
+        self._sync(messages, image_path)
+        return system_instruction, self._merge(self._converted)
+
+    def _sync(self, messages: List[Dict], image_path: Optional[str]) -> None:
+        """Bring the converted history in line with the conversation history"""
+        # Keep the conversions of the unchanged prefix (history can be rolled back or replaced)
+        reused = 0
+        while (reused < len(self._converted) and reused < len(messages)
+               and self._converted[reused][0] is messages[reused]):
+            reused += 1
+        del self._converted[reused:]
+        for index in range(reused, len(messages)):
+            new_image = image_path if index == len(messages) - 1 else None
+            self._converted.append((messages[index], self._convert_message(messages[index], new_image)))
+        logger.debug("Gemini history: %s messages, %s already converted", len(messages), reused)
+
+    @staticmethod
+    def _merge(converted: List[Tuple[Dict, Dict]]) -> List[Dict]:
+        """Gemini expects alternating roles; merge consecutive messages of one role"""
+        contents = []
+        for _, content in converted:
+            if contents and contents[-1]["role"] == content["role"]:
+                contents[-1] = {"role": content["role"], "parts": contents[-1]["parts"] + content["parts"]}
+            else:
+                contents.append(content)
+        return contents
+
+    def _drop_cache(self) -> None:
+        if self._cache is not None:
             try:
-                print(f"[DEBUG] Gemini opening image: {image_path}")
-                image = PIL.Image.open(image_path)
-                print(f"[DEBUG] Gemini image loaded successfully: size={image.size}, mode={image.mode}")
-                
-                # Determine which camera is being used
-                camera_context = "front camera (Camera 1)" if "camera1" in image_path else "rear camera (Camera 2)"
-                
-                # Create a contextual prompt
-                prompt = f"{self.system_context}\n\nAnalyzing image from {camera_context}. {text_content}"
-                return [prompt, image]
-                
+                self._cache.delete()
             except Exception as e:
-                print(f"[DEBUG] Gemini image loading error: {e}")
-                raise Exception(f"Error loading image in Gemini: {e}")
-        else:
-            # For text-only messages, include system context
-            return [f"{self.system_context}\n\n{text_content}"]
-    
+                logger.warning("Error deleting Gemini context cache: %s", e)
+        self._cache = None
+        self._cached_messages = []
+
+    def _cached_model(self, system_instruction: str, messages: List[Dict]) -> Tuple[Optional[genai.GenerativeModel], int]:
+        """
+        Return a model bound to a context cache of the conversation prefix
+        and the number of history messages the cache covers
+        """
+        if not self.cache_enabled:
+            return None, 0
+        count = len(self._cached_messages)
+        prefix_valid = (
+            self._cache is not None
+            and time.monotonic() < self._cache_expires
+            and count <= len(messages)
+            and all(a is b for a, b in zip(self._cached_messages, messages))
+        )
+        if not prefix_valid:
+            self._drop_cache()
+            count = 0
+
+        # Re-cache once the uncached tail alone is worth caching, ending on a model turn
+        end = len(messages) - 1
+        while end > count and messages[end - 1]["role"] != "assistant":
+            end -= 1
+        if end > count and estimate_tokens(messages[count:end]) >= CACHE_MIN_TOKENS:
+            try:
+                cache = genai.caching.CachedContent.create(
+                    model=CACHE_MODEL,
+                    system_instruction=system_instruction,
+                    contents=self._merge(self._converted[:end]),
+                    ttl=CACHE_TTL_SECONDS
+                )
+            except Exception as e:
+                logger.warning("Gemini context caching failed: %s", e)
+            else:
+                self._drop_cache()
+                self._cache = cache
+                self._cached_messages = list(messages[:end])
+                self._cache_expires = time.monotonic() + CACHE_TTL_SECONDS - 30
+                count = end
+                logger.debug("Gemini cached %s messages of context", end)
+
+        if self._cache is None:
+            return None, 0
+        return genai.GenerativeModel.from_cached_content(self._cache), count
+
+    def _collect_stream(self, response, permit) -> str:
+        """Read a streamed response, stopping between chunks if the turn is cancelled"""
+        token = current_token()
+        parts = []
+        with token.closing(_StreamCloser(response)):
+            for chunk in response:
+                token.raise_if_cancelled()
+                # chunk.text raises on chunks without text, such as the final
+                # usage-only chunk or a safety-blocked candidate
+                candidates = chunk.candidates
+                if candidates and candidates[0].content.parts:
+                    parts.extend(part.text for part in candidates[0].content.parts if part.text)
+                if chunk.usage_metadata:
+                    # Gemini counts context-cached tokens as part of the prompt
+                    usage = chunk.usage_metadata
+                    cached = getattr(usage, "cached_content_token_count", 0) or 0
+                    permit.record_usage(usage.prompt_token_count - cached, usage.candidates_token_count, cached)
+        return "".join(parts)
+
     def generate_response(self,
                          messages: List[Dict],
                          model: str,  # This parameter is ignored for Gemini
                          image_path: Optional[str] = None) -> str:
         """Generate response using Gemini"""
         try:
-            print(f"[DEBUG] Gemini generate_response starting: image_path={image_path}")
-            formatted_content = self.format_messages(messages, image_path)
-            print(f"[DEBUG] Gemini formatted_content length: {len(formatted_content)}")
-            
-            if image_path:
-                print("[DEBUG] Gemini generating response with image")
-                try:
-                    response = self.model.generate_content(
-                        formatted_content,
-                        generation_config={
-                            "temperature": 0.7,
-                            "max_output_tokens": 1000,
-                            "candidate_count": 1
-                        }
-                    )
-                    print("[DEBUG] Gemini image response generated successfully")
-                    return response.text
-                except Exception as e:
-                    print(f"[DEBUG] Gemini image generation error: {e}")
-                    raise Exception(f"Error generating image response in Gemini: {e}")
-            else:
-                print("[DEBUG] Gemini generating text-only response")
-                if self.chat is None:
-                    # Initialize chat with system context
-                    self.chat = self.model.start_chat(history=[
-                        {"role": "user", "parts": self.system_context},
-                        {"role": "model", "parts": "I understand I'm an assistant with access to two cameras and will help analyze images and answer questions accordingly."}
-                    ])
-                response = self.chat.send_message(
-                    formatted_content[0],
-                    generation_config={
-                        "temperature": 0.7,
-                        "max_output_tokens": 1000,
-                        "candidate_count": 1
-                    }
+            logger.debug("Gemini generate_response starting: image_path=%s", image_path)
+            system_instruction, contents = self.format_messages(messages, image_path)
+            gemini_model = self._get_model(system_instruction)
+
+            history = [message for message, _ in self._converted]
+            cached_model, cached_count = self._cached_model(system_instruction, history)
+            if cached_model is not None:
+                # Only the messages after the cached prefix are sent
+                contents = self._merge(self._converted[cached_count:])
+                gemini_model = cached_model
+
+            limiter = RateLimiter.for_service(self.service_name)
+            with limiter.limit(estimate_tokens(history[cached_count:], 1000)) as permit:
+                response = gemini_model.generate_content(
+                    contents,
+                    generation_config=GENERATION_CONFIG,
+                    stream=True
                 )
-                return response.text
+                text = self._collect_stream(response, permit)
+            logger.debug("Gemini response generated successfully")
+            return text
             
+        except (TurnCancelled, RateLimitExceeded):
+            raise
         except Exception as e:
-            print(f"[DEBUG] Gemini generate_response error: {e}")
+            logger.warning("Gemini generate_response error: %s", e)
             raise Exception(f"Error in Gemini generate_response: {e}")
-
@@ -1,18 +1,21 @@
 # grok.py
+import logging
 from ai_interface import AIModelInterface
-from openai import OpenAI
 from typing import List, Dict, Optional, Union
 import base64
+from key_manager import KeyManager
+from rate_limiter import RateLimitExceeded, RateLimiter, estimate_tokens
+from openai_compat import openai_client, stream_chat_completion
+from cancellation import TurnCancelled
+
+logger = logging.getLogger(__name__)
 
 class GrokModel(AIModelInterface):
     def __init__(self, service_name: str = "x"):
         """Initialize Grok with API key"""
         super().__init__(service_name)
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://api.x.ai/v1"
-        )
-        print("[DEBUG] Initialized Grok AI model")
+        self.client = openai_client(self.api_key, KeyManager.get_base_url(service_name))
+        logger.debug("Initialized Grok AI model")
         
     def get_model_name(self) -> str:
         return "Grok"
@@ -30,7 +33,8 @@ class GrokModel(AIModelInterface):
                        image_path: Optional[str] = None) -> List[Dict]:
         """
         Format messages for Grok API
-        Note: Current implementation handles text only. Image support coming soon.
+        Grok accepts text only (ImagePolicy never sends it images), so
+        image messages from earlier turns are sent as their text.
         """
         formatted_messages = []
         
@@ -41,30 +45,25 @@ class GrokModel(AIModelInterface):
                 "content": conversation_history[0]["content"]
             })
         
-        # Process conversation messages
-        for message in conversation_history[1:]:  # Skip system message if present
-            if isinstance(message['content'], str):
-                formatted_messages.append({
-                    "role": message["role"],
-                    "content": message["content"]
-                })
-            else:  # Handle messages with images (placeholder for future implementation)
-                if image_path and message == conversation_history[-1]:
-                    # This is a temporary placeholder - update when X releases image support
-                    text_content = message["content"][0]["text"]
-                    formatted_messages.append({
-                        "role": message["role"],
-                        "content": f"{text_content} [Note: Image analysis coming soon in next release]"
-                    })
-                else:
-                    # For non-image messages or previous messages
-                    formatted_messages.append({
-                        "role": message["role"],
-                        "content": message["content"][0]["text"]
-                    })
+        # Process conversation messages (skipping the system message); earlier turns come from the cache
+        formatted_messages += self.format_cache.format_list(
+            conversation_history[1:], self._format_message
+        )
         
         return formatted_messages
     
+    @staticmethod
+    def _format_message(message: Dict, variant: None) -> Dict:
+        if isinstance(message['content'], str):
+            return {
+                "role": message["role"],
+                "content": message["content"]
+            }
+        return {
+            "role": message["role"],
+            "content": message["content"][0]["text"]
+        }
+    
     def generate_response(self,
                          messages: List[Dict],
                          model: str,  # This parameter is ignored for Grok
@@ -73,21 +72,21 @@ class GrokModel(AIModelInterface):
         try:
             formatted_messages = self.format_messages(messages, image_path)
             
-            # If there's an image but image support isn't ready
-            if image_path:
-                print("[DEBUG] Image analysis with Grok will be supported in the next release")
-            
-            response = self.client.chat.completions.create(
-                model="grok-beta",
-                messages=formatted_messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            return response.choices[0].message.content
+            limiter = RateLimiter.for_service(self.service_name)
+            with limiter.limit(estimate_tokens(messages, 1000)) as permit:
+                return stream_chat_completion(
+                    self.client,
+                    permit,
+                    model="grok-beta",
+                    messages=formatted_messages,
+                    temperature=0.7,
+                    max_tokens=1000
+                )
             
+        except (TurnCancelled, RateLimitExceeded):
+            raise
         except Exception as e:
             error_msg = f"Error generating response from Grok: {str(e)}"
-            print(f"[DEBUG] {error_msg}")
+            logger.debug("%s", error_msg)
             raise Exception(error_msg)
 
@@ -0,0 +1,96 @@
+# http_transport.py
+import importlib.util
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connections idle longer than this may have been closed by the provider's edge
+PREWARM_AFTER_IDLE_SECONDS = 30.0
+# Seconds an idle connection is kept in the pool
+KEEPALIVE_EXPIRY_SECONDS = 120.0
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+# Origin (scheme://host:port) -> monotonic time of the last request sent to it
+_last_used: Dict[str, float] = {}
+_warming = set()
+_origins_lock = threading.Lock()
+
+
+def _origin(url) -> str:
+    parts = urlsplit(str(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _record_request(request: httpx.Request) -> None:
+    with _origins_lock:
+        _last_used[_origin(request.url)] = time.monotonic()
+
+
+def shared_http_client() -> httpx.Client:
+    """
+    Process-wide HTTP client shared by every OpenAI-compatible client
+    One bounded connection pool with long keep-alive, HTTP/2 when the h2
+    package is installed, so each provider host needs a single TLS handshake
+    per process instead of one per client object.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            http2 = importlib.util.find_spec("h2") is not None
+            _client = httpx.Client(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=20,
+                    max_keepalive_connections=10,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+                ),
+                # Same defaults as the OpenAI SDK: long reads for generation, quick connects
+                timeout=httpx.Timeout(600.0, connect=5.0),
+                follow_redirects=True,
+                event_hooks={"request": [_record_request]}
+            )
+            logger.debug("Shared HTTP transport created (HTTP/2 %s)", "on" if http2 else "off")
+        return _client
+
+
+def register_origin(base_url) -> None:
+    """Remember a provider endpoint so prewarm() keeps a connection to it open"""
+    with _origins_lock:
+        _last_used.setdefault(_origin(base_url), 0.0)
+
+
+def _warm(origin: str) -> None:
+    start = time.monotonic()
+    try:
+        # Any response leaves an open, pooled connection behind; the status does not matter
+        shared_http_client().head(origin, timeout=httpx.Timeout(10.0))
+        logger.debug("Pre-warmed %s in %.0f ms", origin, (time.monotonic() - start) * 1000)
+    except httpx.HTTPError as e:
+        logger.debug("Pre-warming %s failed: %s", origin, e)
+    finally:
+        with _origins_lock:
+            _warming.discard(origin)
+
+
+def prewarm(max_idle: float = PREWARM_AFTER_IDLE_SECONDS) -> None:
+    """
+    Open connections ahead of the next request, in the background
+    Call at startup and whenever a turn is likely to start soon (the input
+    gets focus, recording starts). Only endpoints idle for more than
+    max_idle seconds are contacted.
+    """
+    now = time.monotonic()
+    with _origins_lock:
+        origins = [origin for origin, last in _last_used.items()
+                   if now - last > max_idle and origin not in _warming]
+        _warming.update(origins)
+    for origin in origins:
+        threading.Thread(target=_warm, args=(origin,), name=f"prewarm {origin}", daemon=True).start()
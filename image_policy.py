@@ -0,0 +1,153 @@
+# image_policy.py
+import io
+import re
+from typing import Dict, Optional, Tuple
+from PIL import Image
+
+
+class ImageBudget:
+    """How a camera frame is prepared for one provider upload"""
+
+    def __init__(self,
+                 max_edge: int,
+                 crop_square: bool,
+                 max_bytes: Optional[int] = None,
+                 detail: Optional[str] = None,
+                 min_quality: int = 40,
+                 max_quality: int = 90):
+        """
+        Args:
+            max_edge: Longest side of the uploaded image (the side of the square when cropping)
+            crop_square: Center-crop to a square instead of keeping the whole frame
+            max_bytes: Target JPEG size; quality is lowered until the image fits
+            detail: OpenAI image detail level ("low", "high"), None for the provider default
+            min_quality: Lowest JPEG quality the size search may use
+            max_quality: JPEG quality used when the image already fits
+        """
+        self.max_edge = max_edge
+        self.crop_square = crop_square
+        self.max_bytes = max_bytes
+        self.detail = detail
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def __repr__(self) -> str:
+        return (f"ImageBudget(max_edge={self.max_edge}, crop_square={self.crop_square}, "
+                f"max_bytes={self.max_bytes}, detail={self.detail})")
+
+
+# What capture_and_convert did before the policy existed: 512x512 at quality 90
+DEFAULT_BUDGET = ImageBudget(max_edge=512, crop_square=True)
+
+
+class ImagePolicy:
+    """
+    Chooses the image budget for a turn from the provider and the question.
+
+    Scene questions ("what is in front of me") get a small center crop at
+    low detail; reading questions (signs, labels, menus, documents) keep the
+    whole frame at a higher resolution, where small text survives. Providers
+    without image input get None, so the frame is never captured or encoded.
+    """
+
+    # Intent names
+    SCENE = "scene"
+    READ_TEXT = "read_text"
+
+    READ_TEXT_PATTERN = re.compile(
+        r"\b(read|reading|text|says?|written|label|sign|menu|document|page|receipt|screen|"
+        r"translate|translation|ingredients?|price)\b"
+        r"|読|文字|書いて|看板|翻訳|字|写着|寫著|翻译|翻譯",
+        re.IGNORECASE
+    )
+
+    BUDGETS: Dict[str, ImageBudget] = {
+        SCENE: ImageBudget(max_edge=512, crop_square=True, max_bytes=60_000, detail="low"),
+        READ_TEXT: ImageBudget(max_edge=1024, crop_square=False, max_bytes=250_000, detail="high",
+                               min_quality=60),
+    }
+
+    # Per-provider capabilities and overrides of the budgets above
+    PROVIDERS: Dict[str, Dict] = {
+        "ChatGPT": {"images": True},
+        # Claude downsizes anything over 1568 px; tokens grow with pixel count
+        "Claude": {"images": True},
+        # Gemini charges a fixed token count per image, so scenes keep the full frame
+        "Gemini": {"images": True, SCENE: ImageBudget(max_edge=768, crop_square=False, max_bytes=100_000)},
+        # The Grok and Perplexity models in use accept text only
+        "Grok": {"images": False},
+        "Perplexity": {"images": False},
+    }
+
+    def classify_intent(self, text: str) -> str:
+        """Return READ_TEXT when the question is about text in the image, else SCENE"""
+        if text and self.READ_TEXT_PATTERN.search(text):
+            return self.READ_TEXT
+        return self.SCENE
+
+    def supports_images(self, provider: str) -> bool:
+        return self.PROVIDERS.get(provider, {"images": True})["images"]
+
+    def choose(self, provider: str, text: str) -> Optional[ImageBudget]:
+        """
+        Pick the image budget for a turn
+        Args:
+            provider: Model name as returned by get_model_name()
+            text: The user's question
+        Returns:
+            Optional[ImageBudget]: None if the provider cannot use images
+        """
+        if not self.supports_images(provider):
+            return None
+        intent = self.classify_intent(text)
+        return self.PROVIDERS.get(provider, {}).get(intent, self.BUDGETS[intent])
+
+
+def resize_for_budget(img: Image.Image, budget: ImageBudget) -> Image.Image:
+    """Scale (and center-crop, if the budget asks for it) a frame to the budget's size"""
+    if budget.crop_square:
+        side = budget.max_edge
+        scale = side / min(img.width, img.height)
+        resize_width = max(side, round(img.width * scale))
+        resize_height = max(side, round(img.height * scale))
+        img = img.resize((resize_width, resize_height), Image.Resampling.LANCZOS)
+        left = (resize_width - side) // 2
+        top = (resize_height - side) // 2
+        return img.crop((left, top, left + side, top + side))
+
+    scale = budget.max_edge / max(img.width, img.height)
+    if scale >= 1:
+        return img
+    return img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.LANCZOS)
+
+
+def encode_jpeg(img: Image.Image, budget: ImageBudget) -> Tuple[bytes, int]:
+    """
+    Encode at the highest quality that fits budget.max_bytes
+    Returns:
+        Tuple[bytes, int]: (JPEG data, quality used)
+    """
+    def encode(quality: int) -> bytes:
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    data = encode(budget.max_quality)
+    if budget.max_bytes is None or len(data) <= budget.max_bytes:
+        return data, budget.max_quality
+
+    # Binary search in steps of 5 quality points; at most four more encodes
+    best_data, best_quality = None, None
+    low, high = budget.min_quality // 5, budget.max_quality // 5 - 1
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = encode(middle * 5)
+        if len(candidate) <= budget.max_bytes:
+            best_data, best_quality = candidate, middle * 5
+            low = middle + 1
+        else:
+            high = middle - 1
+    if best_data is None:
+        # Even the lowest quality is over budget; send the smallest we have
+        return encode(budget.min_quality), budget.min_quality
+    return best_data, best_quality
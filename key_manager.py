@@ -1,6 +1,7 @@
 # key_manager.py
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
+import os
 
 class KeyManager:
     """Manages API keys for different services"""
@@ -12,6 +13,15 @@ class KeyManager:
         "x": "x_key.txt",
         "perplexity": "perplexity_key.txt"
     }
+
+    # Default API endpoints (None means the SDK default)
+    DEFAULT_BASE_URLS = {
+        "openai": None,
+        "anthropic": None,
+        "google": None,
+        "x": "https://api.x.ai/v1",
+        "perplexity": "https://api.perplexity.ai"
+    }
     
     @staticmethod
     def load_key(service: str) -> str:
@@ -45,3 +55,14 @@ class KeyManager:
             raise ValueError(f"Unknown service: {service}")
         return KeyManager.DEFAULT_KEYS[service]
 
+    @staticmethod
+    def get_base_url(service: str) -> Optional[str]:
+        """
+        Get the API endpoint for a service
+        Set CYBERDECK_<SERVICE>_BASE_URL (e.g. CYBERDECK_OPENAI_BASE_URL) to point
+        a provider at a local fake server.
+        """
+        if service not in KeyManager.DEFAULT_BASE_URLS:
+            raise ValueError(f"Unknown service: {service}")
+        override = os.environ.get(f"CYBERDECK_{service.upper()}_BASE_URL")
+        return override or KeyManager.DEFAULT_BASE_URLS[service]
@@ -0,0 +1,112 @@
+# logging_setup.py
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+from typing import Optional
+
+# Inline images and other base64 runs long enough to be payloads, not words
+DATA_URL = re.compile(r"data:([\w/+.-]+);base64,[A-Za-z0-9+/=]+")
+BASE64_RUN = re.compile(r"[A-Za-z0-9+/]{200,}={0,2}")
+# API keys of the providers we talk to
+API_KEY = re.compile(r"\b(sk-ant-|sk-|xai-|pplx-|AIza)[A-Za-z0-9_\-]{8,}")
+
+# Longest argument kept when a record is queued; longer ones are clipped right away
+MAX_ARG_LENGTH = 4096
+
+
+def redact(text: str, max_length: int = 2000) -> str:
+    """
+    Make a log message safe to write: replace inline base64 payloads with
+    their size, mask API keys and truncate what is still too long
+    """
+    if "base64," in text:
+        text = DATA_URL.sub(lambda m: f"data:{m.group(1)};base64,<{len(m.group(0))} chars>", text)
+    if len(text) >= 200:
+        text = BASE64_RUN.sub(lambda m: f"<base64 {len(m.group(0))} chars>", text)
+    text = API_KEY.sub(lambda m: m.group(1) + "***", text)
+    if len(text) > max_length:
+        text = f"{text[:max_length]}... ({len(text) - max_length} more chars)"
+    return text
+
+
+class SafeFormatter(logging.Formatter):
+    """Formatter that runs every message through redact()"""
+
+    def __init__(self, fmt: Optional[str] = None, max_length: int = 2000):
+        super().__init__(fmt or "%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+        self.max_length = max_length
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = redact(record.message, self.max_length)
+        return super().formatMessage(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread.
+
+    The standard QueueHandler formats each record in the calling thread; this
+    one only clips oversized string arguments (a slice, not a scan) so the
+    request path pays for enqueueing and nothing else. Container arguments
+    are rendered later by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                f"{arg[:MAX_ARG_LENGTH]}... ({len(arg) - MAX_ARG_LENGTH} more chars)"
+                if isinstance(arg, str) and len(arg) > MAX_ARG_LENGTH else arg
+                for arg in record.args
+            )
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: Optional[str] = None, log_file: Optional[str] = None) -> None:
+    """
+    Route all logging through a queue to a background writer thread
+    Args:
+        level: Level name, defaults to CYBERDECK_LOG_LEVEL or INFO
+        log_file: Also write to this file, defaults to CYBERDECK_LOG_FILE
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.environ.get("CYBERDECK_LOG_LEVEL", "INFO")).upper()
+    log_file = log_file or os.environ.get("CYBERDECK_LOG_FILE")
+
+    formatter = SafeFormatter()
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+    # Third-party HTTP clients log every request at DEBUG
+    for noisy in ("httpx", "httpcore", "urllib3", "PIL", "openai", "anthropic"):
+        logging.getLogger(noisy).setLevel(max(logging.INFO, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
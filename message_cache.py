@@ -0,0 +1,99 @@
+# message_cache.py
+import itertools
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+# Stable IDs for conversation messages; never reused within a process
+_message_ids = itertools.count(1)
+
+
+def next_message_id() -> int:
+    return next(_message_ids)
+
+
+class FormatCache:
+    """
+    Per-provider cache of formatted messages.
+
+    Conversation messages carry a stable "id" (see
+    ConversationManager._build_message). A provider formats each message
+    once per variant and reuses the result on later turns. Only the newest
+    message has a variant of its own ("latest message, image attached"); the
+    others are formatted the same way on every turn. When a history extends
+    the one formatted last time, the formatted prefix is reused as a single
+    slice, so a turn costs the same whatever the history length.
+
+    An entry stays valid while the message's content object is unchanged;
+    replacing the content (as a model switch does for the system prompt)
+    formats it again. Messages without an id, such as one-off search
+    prompts, are formatted every time. Cached results are shared between
+    turns and must not be modified.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[int, Hashable], Tuple[Any, Any]] = {}
+        # The previous format_list call: its messages, their first content and the result
+        self._previous_messages: List[Dict] = []
+        self._previous_first_content = None
+        self._previous_formatted: List[Any] = []
+
+    def get(self, message: Dict, variant: Hashable, build: Callable[[Dict, Hashable], Any]) -> Any:
+        """
+        Return the formatted message, calling build(message, variant) on a miss
+        Args:
+            message: Message in the internal format
+            variant: Anything else the formatted result depends on
+            build: Formats one message
+        """
+        message_id = message.get("id")
+        if message_id is None:
+            return build(message, variant)
+        key = (message_id, variant)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is message["content"]:
+            return entry[1]
+        formatted = build(message, variant)
+        self._entries[key] = (message["content"], formatted)
+        return formatted
+
+    def format_list(self, messages: List[Dict], build: Callable[[Dict, Hashable], Any],
+                    latest_variant: Hashable = None) -> List[Any]:
+        """
+        Format a list of history messages
+        Args:
+            messages: Messages in the internal format, in order
+            build: Formats one message; build(message, variant)
+            latest_variant: Variant of the last message; all others use None
+        Returns:
+            List: Formatted messages (a new list each call)
+        """
+        # The history is only appended to, truncated or replaced, so checking
+        # the ends of the common prefix is enough. The previous last message
+        # is formatted again because its variant may have changed.
+        previous = self._previous_messages
+        reused = min(len(previous), len(messages)) - 1
+        if (reused <= 0 or messages[reused - 1] is not previous[reused - 1]
+                or messages[0] is not previous[0] or messages[0]["content"] is not self._previous_first_content):
+            reused = 0
+
+        formatted = self._previous_formatted[:reused]
+        last = len(messages) - 1
+        for index in range(reused, len(messages)):
+            formatted.append(self.get(messages[index], latest_variant if index == last else None, build))
+
+        self._previous_messages = list(messages)
+        self._previous_first_content = messages[0]["content"] if messages else None
+        self._previous_formatted = formatted
+        self._prune(messages)
+        return list(formatted)
+
+    def _prune(self, messages: List[Dict]) -> None:
+        """Forget messages no longer in the history (cleared, rolled back or replaced)"""
+        # Amortized: only scan once the cache has clearly outgrown the history
+        if len(self._entries) <= 2 * len(messages) + 16:
+            return
+        live = {message.get("id") for message in messages}
+        self._entries = {key: entry for key, entry in self._entries.items() if key[0] in live}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
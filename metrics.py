@@ -0,0 +1,351 @@
+# metrics.py
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from UI-scale to slow provider calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    """
+    Base for metrics whose updates are sharded per thread.
+
+    Each thread writes only to its own dict, so recording a value takes no
+    lock; the lock is held only when a thread registers its shard and when
+    the registry collects (sums) the shards.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _key(self, labels: Dict) -> Tuple:
+        if not self.label_names:
+            return ()
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _copied_shards(self) -> List[List]:
+        with self._lock:
+            shards = list(self._shards)
+        return [list(shard.items()) for shard in shards]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for items in self._copied_shards():
+            for key, value in items:
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket counts (not cumulative), then sum and count
+            state = [0] * len(self.buckets) + [0.0, 0]
+            shard[key] = state
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def collect(self) -> Dict[Tuple, List]:
+        totals: Dict[Tuple, List] = {}
+        for items in self._copied_shards():
+            for key, state in items:
+                state = list(state)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = state
+                else:
+                    for index, value in enumerate(state):
+                        total[index] += value
+        return totals
+
+    def quantile(self, q: float, **labels) -> float:
+        """Estimate a quantile (upper bucket bound) from the collected buckets"""
+        state = self.collect().get(self._key(labels))
+        if not state or not state[-1]:
+            return 0.0
+        target = q * state[-1]
+        seen = 0
+        for index, bound in enumerate(self.buckets):
+            seen += state[index]
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Gauge(_Metric):
+    """
+    Current value, either set directly or read from a callback at collection
+    time (useful for queue depths that already live elsewhere)
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple, float] = {}
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        # A single dict assignment; last writer wins
+        self._values[self._key(labels)] = value
+
+    def set_function(self, callback: Callable[[], float], **labels) -> None:
+        """Read the value from callback whenever the metrics are collected"""
+        with self._lock:
+            self._callbacks[self._key(labels)] = callback
+
+    def remove(self, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._callbacks.pop(key, None)
+        self._values.pop(key, None)
+
+    def collect(self) -> Dict[Tuple, float]:
+        values = dict(list(self._values.items()))
+        with self._lock:
+            callbacks = list(self._callbacks.items())
+        for key, callback in callbacks:
+            try:
+                values[key] = float(callback())
+            except Exception as e:
+                logger.warning("Error reading gauge %s: %s", self.name, e)
+        return values
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = []
+    for name, value in zip(names, values):
+        escaped = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Long-running aggregates for sizing hardware and comparing providers.
+
+    Served in Prometheus text format on a local HTTP endpoint and written
+    periodically to a JSON snapshot file.
+    """
+
+    PREFIX = "cyberdeck_"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+    def _get_or_create(self, cls, name: str, help_text: str, labels: Tuple[str, ...], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(self.PREFIX + name, help_text, tuple(labels), **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str = "", labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "", labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def gauge(self, name: str, help_text: str = "", labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def _all(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._all():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                for key, state in sorted(metric.collect().items()):
+                    cumulative = 0
+                    for index, bound in enumerate(metric.buckets):
+                        cumulative += state[index]
+                        labels = _format_labels(metric.label_names, key, f'le="{_format_value(bound)}"')
+                        lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(metric.label_names, key, 'le="+Inf"')
+                    lines.append(f"{metric.name}_bucket{labels} {state[-1]}")
+                    labels = _format_labels(metric.label_names, key)
+                    lines.append(f"{metric.name}_sum{labels} {_format_value(state[-2])}")
+                    lines.append(f"{metric.name}_count{labels} {state[-1]}")
+            else:
+                for key, value in sorted(metric.collect().items()):
+                    labels = _format_labels(metric.label_names, key)
+                    lines.append(f"{metric.name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        """Return every metric as plain data, keyed by metric name"""
+        result = {"timestamp": time.time(), "metrics": {}}
+        for metric in self._all():
+            series = []
+            if isinstance(metric, Histogram):
+                for key, state in metric.collect().items():
+                    series.append({
+                        "labels": dict(zip(metric.label_names, key)),
+                        "count": state[-1],
+                        "sum": state[-2],
+                        "buckets": dict(zip((str(b) for b in metric.buckets), state[:-2])),
+                    })
+            else:
+                for key, value in metric.collect().items():
+                    series.append({"labels": dict(zip(metric.label_names, key)), "value": value})
+            result["metrics"][metric.name] = {"type": metric.kind, "series": series}
+        return result
+
+    def start_http_server(self, port: int = 9464, host: str = "127.0.0.1") -> bool:
+        """
+        Serve /metrics in Prometheus format from a daemon thread
+        Returns:
+            bool: False if the port could not be bound
+        """
+        if self._server is not None:
+            return True
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.warning("Metrics endpoint disabled, cannot bind %s:%s: %s", host, port, e)
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info("Metrics served at http://%s:%s/metrics", host, port)
+        return True
+
+    def start_snapshot_writer(self, path: str = "metrics/metrics.json", interval: float = 60.0) -> None:
+        """Write snapshot() to path every interval seconds from a daemon thread"""
+        if self._snapshot_thread is not None:
+            return
+        self._snapshot_thread = threading.Thread(
+            target=self._snapshot_loop, args=(Path(path), interval), daemon=True
+        )
+        self._snapshot_thread.start()
+
+    def write_snapshot(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=1, default=str)
+        # Replace atomically so readers never see a half-written file
+        os.replace(temp_path, path)
+
+    def _snapshot_loop(self, path: Path, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.write_snapshot(path)
+            except Exception as e:
+                logger.warning("Error writing metrics snapshot: %s", e)
+
+    def start_from_env(self) -> None:
+        """
+        Start the endpoint and snapshot writer as configured by the environment
+        CYBERDECK_METRICS_PORT (default 9464, 0 disables the endpoint),
+        CYBERDECK_METRICS_SNAPSHOT (file path, empty disables the snapshot) and
+        CYBERDECK_METRICS_INTERVAL (seconds between snapshots).
+        """
+        port = int(os.environ.get("CYBERDECK_METRICS_PORT", "9464"))
+        if port:
+            self.start_http_server(port)
+        snapshot_path = os.environ.get("CYBERDECK_METRICS_SNAPSHOT", "metrics/metrics.json")
+        if snapshot_path:
+            interval = float(os.environ.get("CYBERDECK_METRICS_INTERVAL", "60"))
+            self.start_snapshot_writer(snapshot_path, interval)
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count one cache lookup; hit rate = hits / (hits + misses)"""
+    metrics.counter("cache_requests_total", "Cache lookups by result", ("cache", "result")).inc(
+        cache=cache, result="hit" if hit else "miss"
+    )
@@ -0,0 +1,192 @@
+# micro_benchmarks.py
+"""
+Micro-benchmarks of single components, without servers or devices.
+
+    python micro_benchmarks.py format    # provider message formatting with and without FormatCache
+    python micro_benchmarks.py upload    # transcription upload encoding
+    python micro_benchmarks.py search    # session store indexing and full-text search
+
+For whole turns against mock providers, see benchmark.py.
+"""
+import argparse
+import base64
+import os
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+from audio_upload import HAVE_FLAC, TARGET_RATE, encode, resample, to_int16
+from chatgpt import ChatGPTModel
+from claude import ClaudeModel
+from gemini import GeminiModel
+from grok import GrokModel
+from message_cache import FormatCache, next_message_id
+from perplexity import PerplexityModel
+from session_store import SessionStore
+
+
+def format_benchmark(sizes=(10, 100, 1000, 5000), image_every: int = 10) -> None:
+    """
+    Print the time each provider takes to format one turn as the history grows:
+    with the cache warm from the previous turn, and from scratch
+    """
+    def make_provider(cls):
+        # format_messages needs no API client; skip the constructors
+        provider = cls.__new__(cls)
+        provider.format_cache = FormatCache()
+        if cls is GeminiModel:
+            provider.system_context = ""
+            provider._converted = []
+        return provider
+
+    classes = (ChatGPTModel, ClaudeModel, GeminiModel, GrokModel, PerplexityModel)
+    providers = [make_provider(cls) for cls in classes]
+
+    image_path = "benchmark_frame.jpg"
+    image_bytes = os.urandom(60_000)
+    with open(image_path, "wb") as f:
+        f.write(image_bytes)
+    image_url = {"url": f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"}
+
+    def message(role: str, index: int) -> Dict:
+        text = f"Message {index}: what can you see on the shelf behind me?"
+        if role == "user" and index % image_every == 0:
+            content = [{"type": "text", "text": text}, {"type": "image_url", "image_url": image_url}]
+        else:
+            content = text
+        return {"id": next_message_id(), "role": role, "content": content}
+
+    history = [{"id": next_message_id(), "role": "system", "content": "You are a helpful assistant."}]
+    header = f"{'messages':>10}"
+    for provider in providers:
+        name = provider.get_model_name()
+        header += f"{name + ' turn ms':>20}{name + ' cold ms':>20}"
+    print(header)
+    try:
+        for size in sizes:
+            while len(history) < size:
+                history.append(message("user" if len(history) % 2 else "assistant", len(history)))
+            row = f"{size:>10}"
+            for cls, provider in zip(classes, providers):
+                # Previous turn, then a new camera question
+                provider.format_messages(history)
+                history.append(message("user", 0))
+                start = time.perf_counter()
+                provider.format_messages(history, image_path)
+                turn = time.perf_counter() - start
+                start = time.perf_counter()
+                make_provider(cls).format_messages(history, image_path)
+                cold = time.perf_counter() - start
+                history.pop()
+                row += f"{turn * 1000:>20.3f}{cold * 1000:>20.3f}"
+            print(row)
+    finally:
+        os.remove(image_path)
+
+
+def _legacy_mp3(audio: np.ndarray, sample_rate: int) -> int:
+    """Encode the way uploads used to be made (pydub MP3 through a temp file); returns the size"""
+    from pydub import AudioSegment
+    segment = AudioSegment(to_int16(audio).tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recording.mp3")
+        segment.export(path, format="mp3")
+        return os.path.getsize(path)
+
+
+def _legacy_mp3_missing() -> str:
+    """Why the old MP3 path cannot be timed here, or an empty string if it can"""
+    try:
+        from pydub.utils import which
+    except ImportError:
+        return "pydub is not installed"
+    if not which("ffmpeg"):
+        return "ffmpeg is not on the PATH"
+    return ""
+
+
+def upload_benchmark(durations=(2, 10, 30), sample_rate: int = 44100) -> None:
+    """
+    Print encode time and upload size of each transcription upload format,
+    next to the old pydub MP3 path as a baseline
+    """
+    rng = np.random.default_rng(0)
+    formats = ["wav", "flac"] if HAVE_FLAC else ["wav"]
+    missing = _legacy_mp3_missing()
+    if missing:
+        print(f"Skipping the old mp3 44.1k baseline: {missing}")
+    print(f"{'seconds':>8} {'format':<16} {'encode ms':>10} {'bytes':>10}")
+    for seconds in durations:
+        # Speech-like test signal: a few harmonics with noise
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        audio = (0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 1760 * t)
+                 + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+        if not missing:
+            start = time.perf_counter()
+            size = _legacy_mp3(audio, sample_rate)
+            elapsed = time.perf_counter() - start
+            print(f"{seconds:>8} {'mp3 44.1k (old)':<16} {elapsed * 1000:>10.1f} {size:>10}")
+        for audio_format in formats:
+            start = time.perf_counter()
+            data = encode(to_int16(resample(audio, sample_rate)), TARGET_RATE, audio_format)
+            elapsed = time.perf_counter() - start
+            print(f"{seconds:>8} {audio_format + ' 16k':<16} {elapsed * 1000:>10.1f} {len(data):>10}")
+
+
+def search_benchmark(sizes=(1000, 10000, 100000), db_path: str = ":memory:") -> None:
+    """Print indexing throughput and query latency as the corpus grows"""
+    samples = [
+        "Can you look at camera 1 and tell me what this plant is?",
+        "今日の東京の天気はどうですか？傘が必要ですか？",
+        "請幫我查一下約翰福音第三章十六節的意思。",
+        "The rear camera shows a bookshelf with several Bible commentaries.",
+        "このカメラで写真を撮って、何が写っているか教えてください。",
+        "我想知道附近有沒有好吃的拉麵店。",
+    ]
+    queries = ["camera", "東京", "福音", "拉麵店", "commentaries", "写真"]
+    store = SessionStore(db_path)
+    total = 0
+    print(f"{'messages':>10} {'index msg/s':>12} {'query ms (avg)':>15} {'query ms (max)':>15}")
+    for size in sizes:
+        start = time.perf_counter()
+        session_id = store.create_session()
+        for i in range(total, size):
+            if i % 50 == 0:
+                session_id = store.create_session()
+            store.append_message(session_id, "user", f"{samples[i % len(samples)]} #{i}")
+        elapsed = time.perf_counter() - start
+        rate = (size - total) / elapsed if elapsed else 0.0
+        total = size
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            store.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{size:>10} {rate:>12.0f} {sum(timings) / len(timings):>15.2f} {max(timings):>15.2f}")
+    store.close()
+
+
+BENCHMARKS = {
+    "format": format_benchmark,
+    "upload": upload_benchmark,
+    "search": search_benchmark,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of single components")
+    parser.add_argument("benchmark", nargs="*",
+                        help=f"Benchmarks to run ({', '.join(BENCHMARKS)}), all of them by default")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmark if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    for name in args.benchmark or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+# mock_servers.py
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import wave
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+class MockBehavior:
+    """Latency, streaming rate and error injection for one mock provider"""
+
+    def __init__(self,
+                 first_token_latency: float = 0.05,
+                 tokens_per_second: float = 200.0,
+                 error_rate: float = 0.0,
+                 error_status: int = 503,
+                 speech_latency: float = 0.05,
+                 speech_seconds: float = 0.2,
+                 transcription_latency: float = 0.1,
+                 reply: str = "This is a mock reply from the local benchmark server. "
+                              "It streams word by word so client-side parsing is exercised. ",
+                 reply_words: int = 60,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            first_token_latency: Seconds before the first streamed chunk
+            tokens_per_second: Streaming rate; one word is sent per token
+            error_rate: Fraction of requests answered with error_status
+            error_status: HTTP status for injected errors (429 adds Retry-After)
+            speech_latency: Seconds before synthesized speech is returned
+            speech_seconds: Length of the synthesized speech in "pcm" format
+            transcription_latency: Seconds before a transcription is returned
+            reply: Text the reply is built from (repeated to reply_words words)
+            reply_words: Length of normal replies in words
+            seed: Seed for the error injection, for repeatable runs
+        """
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.speech_latency = speech_latency
+        self.speech_seconds = speech_seconds
+        self.transcription_latency = transcription_latency
+        self.reply = reply
+        self.reply_words = reply_words
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def to_dict(self) -> Dict:
+        return {
+            "first_token_latency": self.first_token_latency,
+            "tokens_per_second": self.tokens_per_second,
+            "error_rate": self.error_rate,
+            "error_status": self.error_status,
+            "speech_latency": self.speech_latency,
+            "speech_seconds": self.speech_seconds,
+            "transcription_latency": self.transcription_latency,
+            "reply_words": self.reply_words,
+        }
+
+
+# Keywords in the last user message that make the mock answer with one of
+# the app's tool directives, so the camera and search paths can be driven
+SEARCH_TRIGGER = "#search"
+CAMERA_TRIGGER = "#look"
+
+
+def _voice_pcm(seconds: float, sample_rate: int = 24000) -> bytes:
+    """Raw 16-bit PCM with the level and syllable rhythm of speech, so it can stand in as echo"""
+    samples = []
+    for n in range(int(seconds * sample_rate)):
+        t = n / sample_rate
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+        samples.append(int(6000 * envelope * (math.sin(2 * math.pi * 140 * t) + 0.4 * math.sin(2 * math.pi * 420 * t))))
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+
+def _silent_wav(seconds: float = 0.2, sample_rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+class MockProviderServer:
+    """
+    Local stand-in for the subset of a provider API that the app uses.
+
+    One server answers every supported API shape, chosen by request path:
+      - OpenAI-compatible chat completions (OpenAI, x.ai, Perplexity), streamed
+      - OpenAI speech synthesis and Whisper transcription
+      - Anthropic messages, streamed
+      - Gemini generateContent / streamGenerateContent over REST
+    Responses are streamed with chunked transfer encoding on keep-alive
+    connections, like the real services.
+    """
+
+    def __init__(self, name: str, behavior: Optional[MockBehavior] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            name: Provider name, used in logs and statistics
+            behavior: Latency and error settings, defaults to MockBehavior()
+            host: Interface to bind
+            port: Port to bind, 0 picks a free one
+        """
+        self.name = name
+        self.behavior = behavior or MockBehavior()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._speech = _silent_wav()
+        # The "pcm" response format: raw 24 kHz 16-bit mono
+        self._speech_pcm = _voice_pcm(self.behavior.speech_seconds)
+        # Recorded replies served in order ahead of the synthetic ones (see session_replay.py)
+        self._scripts = {"chat": deque(), "speech": deque(), "transcription": deque()}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockProviderServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"requests": dict(self.requests), "errors": self.errors}
+
+    def reset_stats(self) -> None:
+        """Zero the request and error counters"""
+        with self._lock:
+            self.requests.clear()
+            self.errors = 0
+
+    def _count(self, route: str, failed: bool = False) -> None:
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            if failed:
+                self.errors += 1
+
+    def script(self, kind: str, text: str = "", duration: float = 0.0) -> None:
+        """
+        Queue a recorded reply; queued replies are served in order before synthetic ones
+        Args:
+            kind: 'chat', 'speech' or 'transcription'
+            text: Reply text (the transcript for 'transcription', unused for 'speech')
+            duration: How long the original request took, in seconds
+        """
+        with self._lock:
+            self._scripts[kind].append((text, duration))
+
+    def clear_scripts(self) -> int:
+        """Drop unused recorded replies and return how many there were"""
+        with self._lock:
+            unused = sum(len(queue) for queue in self._scripts.values())
+            for queue in self._scripts.values():
+                queue.clear()
+            return unused
+
+    def _next_scripted(self, kind: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            if self._scripts[kind]:
+                return self._scripts[kind].popleft()
+            return None
+
+    def reply_for(self, last_user_text: str) -> Tuple[str, float]:
+        """
+        Pick the reply for a request from its last user message
+        Returns:
+            Tuple[str, float]: Reply text and the delay before its first chunk
+        """
+        scripted = self._next_scripted("chat")
+        if scripted is not None:
+            text, duration = scripted
+            # Start late enough that the whole stream ends after the recorded duration
+            streaming_time = 0.0
+            if self.behavior.tokens_per_second:
+                streaming_time = (len(text.split(" ")) - 1) / self.behavior.tokens_per_second
+            return text, max(0.0, duration - streaming_time)
+
+        latency = self.behavior.first_token_latency
+        if SEARCH_TRIGGER in last_user_text and "Search results for" not in last_user_text:
+            return '{"Online search": "Raspberry Pi 5 camera modules"}', latency
+        if CAMERA_TRIGGER in last_user_text and "Please analyze this image." not in last_user_text:
+            return '{"camera": "1"}', latency
+        words = self.behavior.reply.split()
+        repeated = (words * (self.behavior.reply_words // max(len(words), 1) + 1))[:self.behavior.reply_words]
+        return " ".join(repeated), latency
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = self.path.split("?")[0]
+
+                if path.endswith("/chat/completions"):
+                    route = "chat"
+                elif path.endswith("/audio/speech"):
+                    route = "speech"
+                elif path.endswith("/audio/transcriptions"):
+                    route = "transcription"
+                elif path.endswith("/messages"):
+                    route = "anthropic"
+                elif ":streamGenerateContent" in path or ":generateContent" in path:
+                    route = "gemini"
+                else:
+                    server._count("unknown", failed=True)
+                    self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+                    return
+
+                if server.behavior.should_fail():
+                    server._count(route, failed=True)
+                    self._send_error(server.behavior.error_status)
+                    return
+                server._count(route)
+
+                if route == "speech":
+                    scripted = server._next_scripted("speech")
+                    time.sleep(scripted[1] if scripted else server.behavior.speech_latency)
+                    if json.loads(body or b"{}").get("response_format") == "pcm":
+                        self._send_bytes(200, server._speech_pcm, "audio/pcm")
+                    else:
+                        self._send_bytes(200, server._speech, "audio/wav")
+                elif route == "transcription":
+                    scripted = server._next_scripted("transcription")
+                    text, delay = scripted or ("Tell me something about the Raspberry Pi.",
+                                               server.behavior.transcription_latency)
+                    time.sleep(delay)
+                    self._send_json(200, {"text": text})
+                else:
+                    request = json.loads(body or b"{}")
+                    getattr(self, f"_handle_{route}")(request, path)
+
+            # Response helpers
+
+            def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self._send_bytes(status, data, "application/json", headers)
+
+            def _send_bytes(self, status: int, data: bytes, content_type: str,
+                            headers: Optional[Dict] = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_error(self, status: int):
+                headers = {"Retry-After": "1"} if status == 429 else None
+                self._send_json(status, {
+                    "error": {"message": "Injected error", "type": "mock_error", "code": status}
+                }, headers)
+
+            def _start_stream(self, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+
+            def _write_chunk(self, data: str):
+                encoded = data.encode("utf-8")
+                self.wfile.write(f"{len(encoded):X}\r\n".encode("ascii") + encoded + b"\r\n")
+                self.wfile.flush()
+
+            def _end_stream(self):
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _stream_words(self, text: str, first_delay: float):
+                """Yield the reply word by word at the configured rate"""
+                time.sleep(first_delay)
+                delay = 1.0 / server.behavior.tokens_per_second if server.behavior.tokens_per_second else 0
+                words = text.split(" ")
+                for index, word in enumerate(words):
+                    if index:
+                        time.sleep(delay)
+                    yield word if index == len(words) - 1 else word + " "
+
+            # API shapes
+
+            def _handle_chat(self, request: Dict, path: str):
+                text, first_delay = server.reply_for(_last_openai_text(request.get("messages", [])))
+                model = request.get("model") or "mock"
+                prompt_tokens = _estimate_tokens(json.dumps(request.get("messages", [])))
+
+                def chunk(delta, finish_reason=None, usage=None):
+                    payload = {
+                        "id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": model,
+                        "choices": [] if usage else
+                        [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    if usage:
+                        payload["usage"] = usage
+                    return f"data: {json.dumps(payload)}\n\n"
+
+                self._start_stream("text/event-stream")
+                self._write_chunk(chunk({"role": "assistant", "content": ""}))
+                for word in self._stream_words(text, first_delay):
+                    self._write_chunk(chunk({"content": word}))
+                self._write_chunk(chunk({}, "stop"))
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    completion_tokens = _estimate_tokens(text)
+                    self._write_chunk(chunk(None, usage={
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    }))
+                self._write_chunk("data: [DONE]\n\n")
+                self._end_stream()
+
+            def _handle_anthropic(self, request: Dict, path: str):
+                text, first_delay = server.reply_for(_last_openai_text(request.get("messages", [])))
+                input_tokens = _estimate_tokens(json.dumps(request.get("messages", [])))
+
+                def event(name, payload):
+                    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+                self._start_stream("text/event-stream")
+                self._write_chunk(event("message_start", {"type": "message_start", "message": {
+                    "id": "msg_mock", "type": "message", "role": "assistant",
+                    "model": request.get("model", "mock"), "content": [],
+                    "stop_reason": None, "stop_sequence": None,
+                    "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+                }}))
+                self._write_chunk(event("content_block_start", {
+                    "type": "content_block_start", "index": 0,
+                    "content_block": {"type": "text", "text": ""},
+                }))
+                for word in self._stream_words(text, first_delay):
+                    self._write_chunk(event("content_block_delta", {
+                        "type": "content_block_delta", "index": 0,
+                        "delta": {"type": "text_delta", "text": word},
+                    }))
+                self._write_chunk(event("content_block_stop", {"type": "content_block_stop", "index": 0}))
+                self._write_chunk(event("message_delta", {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": _estimate_tokens(text)},
+                }))
+                self._write_chunk(event("message_stop", {"type": "message_stop"}))
+                self._end_stream()
+
+            def _handle_gemini(self, request: Dict, path: str):
+                contents = request.get("contents", [])
+                last_text = ""
+                if contents:
+                    last_text = " ".join(part.get("text", "") for part in contents[-1].get("parts", []))
+                text, first_delay = server.reply_for(last_text)
+                prompt_tokens = _estimate_tokens(json.dumps(contents))
+
+                def response(part_text, final=False):
+                    content = {"role": "model"}
+                    if part_text is not None:
+                        content["parts"] = [{"text": part_text}]
+                    candidate = {"content": content, "index": 0}
+                    payload = {"candidates": [candidate]}
+                    if final:
+                        candidate["finishReason"] = 1  # STOP, enums are requested as integers
+                        completion_tokens = _estimate_tokens(text)
+                        payload["usageMetadata"] = {
+                            "promptTokenCount": prompt_tokens,
+                            "candidatesTokenCount": completion_tokens,
+                            "totalTokenCount": prompt_tokens + completion_tokens,
+                        }
+                    return payload
+
+                if ":generateContent" in path:
+                    time.sleep(first_delay)
+                    self._send_json(200, response(text, final=True))
+                    return
+
+                # The REST transport streams a JSON array of responses. Like the real
+                # service, the finish reason and usage arrive in a final chunk without text.
+                self._start_stream("application/json")
+                for index, word in enumerate(self._stream_words(text, first_delay)):
+                    prefix = "[" if index == 0 else ",\r\n"
+                    self._write_chunk(prefix + json.dumps(response(word)))
+                self._write_chunk(",\r\n" + json.dumps(response(None, final=True)) + "]")
+                self._end_stream()
+
+        return Handler
+
+
+def _last_openai_text(messages: List[Dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return ""
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockProviders:
+    """
+    Starts one mock server per service and points the app at them through
+    the CYBERDECK_<SERVICE>_BASE_URL overrides read by KeyManager
+    """
+
+    # Path prefix each SDK expects on top of the base URL
+    BASE_PATHS = {
+        "openai": "/v1",
+        "anthropic": "",
+        "google": "",
+        "x": "/v1",
+        "perplexity": "",
+    }
+
+    def __init__(self, behaviors: Optional[Dict[str, MockBehavior]] = None):
+        behaviors = behaviors or {}
+        self.servers = {
+            service: MockProviderServer(service, behaviors.get(service))
+            for service in self.BASE_PATHS
+        }
+
+    def start(self) -> Dict[str, str]:
+        """
+        Start every server and return the environment variables to set
+        Returns:
+            Dict[str, str]: Variable name -> base URL
+        """
+        env = {}
+        for service, server in self.servers.items():
+            server.start()
+            env[f"CYBERDECK_{service.upper()}_BASE_URL"] = server.url + self.BASE_PATHS[service]
+        return env
+
+    def stop(self) -> None:
+        for server in self.servers.values():
+            server.stop()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {service: server.stats() for service, server in self.servers.items()}
+
+
+if __name__ == "__main__":
+    providers = MockProviders()
+    for name, value in providers.start().items():
+        print(f"export {name}={value}")
+    print("Mock providers running, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        providers.stop()
@@ -0,0 +1,43 @@
+# openai_compat.py
+from typing import List, Optional
+
+from openai import OpenAI
+
+from cancellation import current_token
+from http_transport import register_origin, shared_http_client
+from rate_limiter import Permit
+
+
+def openai_client(api_key: str, base_url: Optional[str]) -> OpenAI:
+    """
+    Create an OpenAI-compatible client on the shared HTTP transport
+    All clients in the process (chat, speech, transcription, x.ai,
+    Perplexity) share one connection pool, which prewarm() keeps warm.
+    """
+    client = OpenAI(api_key=api_key, base_url=base_url, http_client=shared_http_client())
+    register_origin(client.base_url)
+    return client
+
+
+def stream_chat_completion(client, permit: Permit, **kwargs) -> str:
+    """
+    Run a chat completion as a stream and return the full text
+    Streaming lets the current turn be cancelled mid-generation: cancelling
+    closes the HTTP response and releases the connection right away.
+    Works for every OpenAI-compatible endpoint (OpenAI, x.ai, Perplexity).
+    Args:
+        client: OpenAI client for the provider
+        permit: Rate limiter permit, updated with the reported token usage
+        kwargs: Arguments for client.chat.completions.create
+    """
+    token = current_token()
+    parts: List[str] = []
+    stream = client.chat.completions.create(stream=True, **kwargs)
+    with token.closing(stream):
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            usage = getattr(chunk, "usage", None)
+            if usage:
+                permit.record_usage(usage.prompt_tokens, usage.completion_tokens)
+    return "".join(parts)
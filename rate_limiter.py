@@ -0,0 +1,297 @@
+# rate_limiter.py
+import threading
+import time
+from typing import Dict, List, Optional
+
+from cancellation import current_token
+from metrics import metrics
+
+_QUEUE_WAIT = metrics.histogram("rate_limiter_queue_wait_seconds",
+                                "Time spent waiting for a provider budget", ("service",))
+_SHED = metrics.counter("rate_limiter_shed_total", "Requests rejected by the client-side limiter",
+                        ("service",))
+_NETWORK_TIME = metrics.histogram("provider_network_seconds",
+                                  "Time from permit grant to release", ("service",))
+_TOKENS = metrics.counter("tokens_total", "Tokens reported by providers", ("service", "direction"))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when work is shed because a provider's budget would be exceeded"""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a fixed rate"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until amount tokens are available (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        """Take tokens; the level may go negative when actual usage exceeds the estimate"""
+        self.level -= amount
+
+
+class Permit:
+    """Grant returned by ProviderRateLimiter.limit()"""
+
+    def __init__(self, limiter: "ProviderRateLimiter", estimated_tokens: int, queue_wait: float):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.queue_wait = queue_wait
+        self.actual_tokens: Optional[int] = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.started = time.monotonic()
+
+    def record_usage(self, input_tokens: int, output_tokens: int,
+                     cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> None:
+        """
+        Store the token usage the provider reported for this request
+        Args:
+            input_tokens: Uncached prompt tokens
+            output_tokens: Generated tokens
+            cache_read_tokens: Prompt tokens served from the provider's prompt cache
+            cache_write_tokens: Prompt tokens written to the prompt cache
+        """
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+        self.cache_read_tokens = cache_read_tokens or 0
+        self.cache_write_tokens = cache_write_tokens or 0
+        # Cache reads do not count against provider input limits
+        self.actual_tokens = self.input_tokens + self.cache_write_tokens + self.output_tokens
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.limiter._release(self, time.monotonic() - self.started)
+
+
+class ProviderRateLimiter:
+    """
+    Client-side budget for one provider endpoint.
+
+    Combines a request bucket (requests per minute), a token bucket (tokens
+    per minute) and a cap on concurrent requests. Callers wait in line until
+    all three allow the request, or are rejected with RateLimitExceeded when
+    the wait would be longer than max_queue_wait or the line is full.
+    """
+
+    def __init__(self,
+                 name: str,
+                 requests_per_minute: float,
+                 tokens_per_minute: Optional[float] = None,
+                 max_concurrent: int = 4,
+                 max_queued: int = 8,
+                 max_queue_wait: float = 30.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0) if tokens_per_minute else None
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queue_wait = max_queue_wait
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        metrics.gauge("rate_limiter_queued", "Requests waiting for a budget", ("service",)).set_function(
+            lambda: self._queued, service=name
+        )
+        metrics.gauge("rate_limiter_in_flight", "Requests currently running", ("service",)).set_function(
+            lambda: self._in_flight, service=name
+        )
+
+        # Statistics, queue wait is kept apart from network time
+        self.total_requests = 0
+        self.total_shed = 0
+        self.total_queue_wait = 0.0
+        self.max_observed_queue_wait = 0.0
+        self.total_network_time = 0.0
+        self.total_tokens = 0
+
+    def _time_until_ready(self, estimated_tokens: int) -> float:
+        now = time.monotonic()
+        wait = self.requests.time_until(1, now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until(estimated_tokens, now))
+        return wait
+
+    def limit(self, estimated_tokens: int = 0) -> Permit:
+        """
+        Wait until the request fits the provider's budget
+        Args:
+            estimated_tokens: Expected prompt plus completion tokens
+        Returns:
+            Permit: Context manager; set permit.actual_tokens from the response usage
+        Raises:
+            RateLimitExceeded: If the request would have to wait too long
+        """
+        start = time.monotonic()
+        deadline = start + self.max_queue_wait
+        with self._condition:
+            if self._queued >= self.max_queued:
+                self.total_shed += 1
+                _SHED.inc(service=self.name)
+                raise RateLimitExceeded(f"{self.name}: too many queued requests")
+            self._queued += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._in_flight < self.max_concurrent:
+                        wait = self._time_until_ready(estimated_tokens)
+                        if wait == 0.0:
+                            break
+                        if now + wait > deadline:
+                            self.total_shed += 1
+                            _SHED.inc(service=self.name)
+                            raise RateLimitExceeded(
+                                f"{self.name}: budget exhausted, would wait {wait:.1f}s"
+                            )
+                    else:
+                        wait = deadline - now
+                        if wait <= 0:
+                            self.total_shed += 1
+                            _SHED.inc(service=self.name)
+                            raise RateLimitExceeded(f"{self.name}: too many concurrent requests")
+                    # Wake up periodically so a cancelled turn stops waiting
+                    self._condition.wait(min(wait, 0.25))
+                    current_token().raise_if_cancelled()
+            finally:
+                self._queued -= 1
+
+            self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(estimated_tokens)
+            self._in_flight += 1
+
+            queue_wait = time.monotonic() - start
+            self.total_requests += 1
+            self.total_queue_wait += queue_wait
+            self.max_observed_queue_wait = max(self.max_observed_queue_wait, queue_wait)
+        _QUEUE_WAIT.observe(queue_wait, service=self.name)
+        return Permit(self, estimated_tokens, queue_wait)
+
+    def _release(self, permit: Permit, network_time: float) -> None:
+        _NETWORK_TIME.observe(network_time, service=self.name)
+        if permit.input_tokens or permit.output_tokens:
+            _TOKENS.inc(permit.input_tokens, service=self.name, direction="in")
+            _TOKENS.inc(permit.output_tokens, service=self.name, direction="out")
+        if permit.cache_read_tokens:
+            _TOKENS.inc(permit.cache_read_tokens, service=self.name, direction="cache_read")
+        if permit.cache_write_tokens:
+            _TOKENS.inc(permit.cache_write_tokens, service=self.name, direction="cache_write")
+        with self._condition:
+            self._in_flight -= 1
+            self.total_network_time += network_time
+            if permit.actual_tokens is not None:
+                self.total_tokens += permit.actual_tokens
+                if self.tokens is not None:
+                    # Correct the reservation with what the provider actually counted
+                    self.tokens.consume(permit.actual_tokens - permit.estimated_tokens)
+            self._condition.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self._condition:
+            return {
+                "requests": self.total_requests,
+                "shed": self.total_shed,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "queue_wait_total": self.total_queue_wait,
+                "queue_wait_max": self.max_observed_queue_wait,
+                "network_time_total": self.total_network_time,
+                "tokens": self.total_tokens,
+            }
+
+
+class RateLimiter:
+    """Registry of per-provider limiters"""
+
+    # Budgets per endpoint; adjust to the account's actual tier
+    DEFAULT_LIMITS = {
+        "openai": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+        "openai-tts": {"requests_per_minute": 50},
+        "openai-whisper": {"requests_per_minute": 50},
+        "anthropic": {"requests_per_minute": 50, "tokens_per_minute": 40000},
+        "google": {"requests_per_minute": 15, "tokens_per_minute": 1000000},
+        "x": {"requests_per_minute": 60, "tokens_per_minute": 100000},
+        "perplexity": {"requests_per_minute": 50},
+    }
+
+    _limiters: Dict[str, ProviderRateLimiter] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def for_service(service: str) -> ProviderRateLimiter:
+        """Return the shared limiter for a service, creating it on first use"""
+        with RateLimiter._lock:
+            if service not in RateLimiter._limiters:
+                if service not in RateLimiter.DEFAULT_LIMITS:
+                    raise ValueError(f"Unknown service: {service}")
+                RateLimiter._limiters[service] = ProviderRateLimiter(
+                    service, **RateLimiter.DEFAULT_LIMITS[service]
+                )
+            return RateLimiter._limiters[service]
+
+    @staticmethod
+    def configure(service: str, **limits) -> None:
+        """Replace the limits for a service (e.g. requests_per_minute=100)"""
+        with RateLimiter._lock:
+            settings = dict(RateLimiter.DEFAULT_LIMITS.get(service, {}))
+            settings.update(limits)
+            RateLimiter.DEFAULT_LIMITS[service] = settings
+            RateLimiter._limiters.pop(service, None)
+
+    @staticmethod
+    def reset() -> None:
+        """Drop every limiter; the next for_service() call starts with a full budget"""
+        with RateLimiter._lock:
+            RateLimiter._limiters.clear()
+
+    @staticmethod
+    def get_stats() -> Dict[str, Dict]:
+        with RateLimiter._lock:
+            limiters = list(RateLimiter._limiters.values())
+        return {limiter.name: limiter.snapshot() for limiter in limiters}
+
+
+# Rough token cost of one 512x512 image across providers
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    """
+    Cheap token estimate for budgeting (about 4 characters per token)
+    Args:
+        messages: Conversation messages in the internal format
+        max_tokens: Completion budget requested from the provider
+    """
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                else:
+                    images += 1
+    return chars // 4 + images * IMAGE_TOKEN_ESTIMATE + max_tokens
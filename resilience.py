@@ -0,0 +1,406 @@
+# resilience.py
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from ai_interface import AIModelInterface
+from cancellation import TurnCancelled, current_token
+from metrics import metrics
+from rate_limiter import RateLimitExceeded
+from session_recorder import recorder
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_SECONDS = metrics.histogram("provider_request_seconds",
+                                     "Provider call latency per attempt", ("provider", "outcome"))
+_SHED_CALLS = metrics.counter("provider_calls_shed_total",
+                              "Provider calls shed by the client-side rate limiter", ("provider",))
+_IMAGE_BYTES = metrics.counter("image_upload_bytes_total",
+                               "Base64 image bytes sent to providers", ("provider",))
+
+
+def _image_bytes(messages) -> int:
+    """Size of the inline images carried by a request"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    total += len(part["image_url"]["url"])
+    return total
+
+# HTTP status codes worth retrying: timeouts, conflicts, rate limits and
+# server-side failures (529 is Anthropic's "overloaded")
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Exception class names raised by the provider SDKs (openai, anthropic,
+# google-api-core, httpx) for transient failures. Matched by name so this
+# module does not need to import every SDK.
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+    "OverloadedError",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ConnectError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "RemoteProtocolError",
+    "ConnectionError",
+    "TimeoutError",
+}
+
+
+def _error_chain(error: BaseException) -> List[BaseException]:
+    """Return the error followed by its causes (providers re-raise wrapped errors)"""
+    chain = []
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        chain.append(error)
+        error = error.__cause__ or error.__context__
+    return chain
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Decide whether an error from a provider call is transient
+    Args:
+        error: Exception raised by generate_response
+    Returns:
+        bool: True if the call may succeed when retried
+    """
+    for item in _error_chain(error):
+        status_code = getattr(item, "status_code", None)
+        if isinstance(status_code, int):
+            return status_code in RETRYABLE_STATUS_CODES
+        if type(item).__name__ in RETRYABLE_ERROR_NAMES:
+            return True
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Return the server's Retry-After hint in seconds, if any"""
+    for item in _error_chain(error):
+        response = getattr(item, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            continue
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class RetryPolicy:
+    """Bounded retries with full-jitter exponential backoff"""
+
+    def __init__(self,
+                 max_attempts: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 8.0):
+        """
+        Args:
+            max_attempts: Total attempts including the first call
+            base_delay: Backoff ceiling for the first retry, in seconds
+            max_delay: Upper bound for any single backoff, in seconds
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """
+        Delay before the given retry attempt (1-based)
+        Honors a Retry-After hint from the server, capped at max_delay.
+        """
+        hint = _retry_after(error) if error is not None else None
+        if hint is not None:
+            return min(max(hint, 0.0), self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a provider's circuit is open and no fallback is available"""
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker driven by error rate and latency.
+
+    The breaker looks at the most recent calls inside a sliding window. It opens
+    when enough of them failed or were slower than slow_call_threshold, rejects
+    calls while open, and lets a single trial call through after open_duration.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    _registry: Dict[str, "CircuitBreaker"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self,
+                 name: str,
+                 window_size: int = 20,
+                 window_seconds: float = 120.0,
+                 min_calls: int = 5,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_threshold: float = 30.0,
+                 slow_call_rate_threshold: float = 0.8,
+                 open_duration: float = 30.0):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_duration = open_duration
+
+        self._calls = deque(maxlen=window_size)  # (timestamp, ok, latency)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+        # Counters exposed through snapshot()
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_retries = 0
+        self.total_rejected = 0
+        self.total_fallbacks = 0
+        self.times_opened = 0
+
+    @classmethod
+    def for_provider(cls, name: str) -> "CircuitBreaker":
+        """Return the shared breaker for a provider, creating it on first use"""
+        with cls._registry_lock:
+            if name not in cls._registry:
+                cls._registry[name] = cls(name)
+            return cls._registry[name]
+
+    @classmethod
+    def all_breakers(cls) -> List["CircuitBreaker"]:
+        with cls._registry_lock:
+            return list(cls._registry.values())
+
+    @classmethod
+    def reset_all(cls) -> None:
+        """Forget every shared breaker; the next for_provider() call starts closed"""
+        with cls._registry_lock:
+            cls._registry.clear()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if a call may be attempted now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.total_rejected += 1
+            return False
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self.total_calls += 1
+            if self._state == self.HALF_OPEN:
+                if latency < self.slow_call_threshold:
+                    self._close()
+                else:
+                    self._open()
+                return
+            self._calls.append((time.monotonic(), True, latency))
+            self._evaluate()
+
+    def record_failure(self, latency: float) -> None:
+        with self._lock:
+            self.total_calls += 1
+            self.total_failures += 1
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._calls.append((time.monotonic(), False, latency))
+            self._evaluate()
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.total_retries += 1
+
+    def release_trial(self) -> None:
+        """Give back a half-open trial slot for a call that never reached the provider"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.total_fallbacks += 1
+
+    def _evaluate(self) -> None:
+        cutoff = time.monotonic() - self.window_seconds
+        recent = [call for call in self._calls if call[0] >= cutoff]
+        if len(recent) < self.min_calls:
+            return
+        failures = sum(1 for _, ok, _ in recent if not ok)
+        slow = sum(1 for _, _, latency in recent if latency >= self.slow_call_threshold)
+        if (failures / len(recent) >= self.failure_rate_threshold or
+                slow / len(recent) >= self.slow_call_rate_threshold):
+            self._open()
+
+    def _open(self) -> None:
+        logger.warning("Circuit for %s opened", self.name)
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+        self.times_opened += 1
+
+    def _close(self) -> None:
+        logger.info("Circuit for %s closed", self.name)
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+        self._calls.clear()
+
+    def snapshot(self) -> Dict:
+        """Return breaker state and counters as a plain dict"""
+        with self._lock:
+            recent = list(self._calls)
+            latencies = sorted(latency for _, _, latency in recent)
+            return {
+                "state": self._current_state(),
+                "calls": self.total_calls,
+                "failures": self.total_failures,
+                "retries": self.total_retries,
+                "rejected": self.total_rejected,
+                "fallbacks": self.total_fallbacks,
+                "times_opened": self.times_opened,
+                "window_calls": len(recent),
+                "window_failures": sum(1 for _, ok, _ in recent if not ok),
+                "window_median_latency": latencies[len(latencies) // 2] if latencies else 0.0,
+            }
+
+
+class ResilientModel(AIModelInterface):
+    """
+    Wraps an AI model with retries, a circuit breaker and an optional fallback.
+
+    Behaves like the wrapped model, so ConversationManager can use it anywhere
+    it used a provider directly.
+    """
+
+    def __init__(self,
+                 model: AIModelInterface,
+                 fallback_factory: Optional[Callable[[], AIModelInterface]] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Args:
+            model: Provider to wrap
+            fallback_factory: Builds the secondary provider on first use
+            retry_policy: Retry settings, defaults to RetryPolicy()
+            breaker: Circuit breaker, defaults to the shared one for this provider
+        """
+        self.model = model
+        self.fallback_factory = fallback_factory
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker.for_provider(model.get_model_name())
+        self._fallback = None
+
+    def get_model_name(self) -> str:
+        return self.model.get_model_name()
+
+    def format_messages(self, conversation_history, image_path=None):
+        return self.model.format_messages(conversation_history, image_path)
+
+    def _get_fallback(self) -> Optional["ResilientModel"]:
+        if self._fallback is None and self.fallback_factory is not None:
+            self._fallback = ResilientModel(self.fallback_factory(), retry_policy=self.retry_policy)
+        return self._fallback
+
+    def _call_with_retries(self, messages, model, image_path) -> str:
+        """Call the wrapped model, retrying transient errors"""
+        attempt = 0
+        provider = self.get_model_name()
+        image_bytes = _image_bytes(messages)
+        while True:
+            attempt += 1
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(f"Circuit open for {self.get_model_name()}")
+            if image_bytes:
+                _IMAGE_BYTES.inc(image_bytes, provider=provider)
+            start = time.monotonic()
+            try:
+                with tracer.span("provider_request", provider=self.get_model_name(), attempt=attempt):
+                    response = self.model.generate_response(messages, model, image_path)
+            except TurnCancelled:
+                # Not the provider's fault; leave the breaker alone
+                self.breaker.release_trial()
+                _REQUEST_SECONDS.observe(time.monotonic() - start, provider=provider, outcome="cancelled")
+                raise
+            except RateLimitExceeded:
+                # Shed by our own limiter before any request was sent: the provider
+                # did not fail, and retrying would only add to the local load
+                self.breaker.release_trial()
+                _SHED_CALLS.inc(provider=provider)
+                raise
+            except Exception as e:
+                self.breaker.record_failure(time.monotonic() - start)
+                _REQUEST_SECONDS.observe(time.monotonic() - start, provider=provider, outcome="error")
+                if (not is_retryable(e) or attempt >= self.retry_policy.max_attempts or
+                        self.breaker.state == CircuitBreaker.OPEN):
+                    raise
+                delay = self.retry_policy.backoff(attempt, e)
+                logger.warning("%s attempt %s failed, retrying in %.2fs: %s",
+                               self.get_model_name(), attempt, delay, e)
+                self.breaker.record_retry()
+                if current_token().wait(delay):
+                    raise TurnCancelled("Turn cancelled") from e
+                continue
+            latency = time.monotonic() - start
+            self.breaker.record_success(latency)
+            _REQUEST_SECONDS.observe(latency, provider=provider, outcome="ok")
+            recorder.record_provider_call(self.model.service_name, provider, latency, response)
+            return response
+
+    def generate_response(self, messages, model, image_path=None) -> str:
+        """Generate a response, falling back to the secondary provider if needed"""
+        try:
+            return self._call_with_retries(messages, model, image_path)
+        except Exception as e:
+            if not isinstance(e, (CircuitOpenError, RateLimitExceeded)) and not is_retryable(e):
+                raise
+            fallback = self._get_fallback()
+            if fallback is None:
+                raise
+            logger.warning("%s unavailable (%s), falling back to %s",
+                           self.get_model_name(), e, fallback.get_model_name())
+            self.breaker.record_fallback()
+            # The model argument is provider specific, let the fallback pick its own
+            return fallback.generate_response(messages, None, image_path)
+
+    @staticmethod
+    def get_metrics() -> Dict[str, Dict]:
+        """Return breaker state and retry counters for every provider"""
+        return {breaker.name: breaker.snapshot() for breaker in CircuitBreaker.all_breakers()}
@@ -0,0 +1,145 @@
+# search_index.py
+import logging
+import re
+import sqlite3
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Scripts written without spaces between words (kana, CJK ideographs, hangul)
+CJK_RUN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def segment(text: str) -> str:
+    """
+    Make CJK text searchable by a word tokenizer
+    Every run of CJK characters becomes overlapping bigrams followed by its last
+    character, so '東京都' is indexed as '東京 京都 都'. Any substring of the
+    run can then be found with a phrase or prefix query. Other text is kept as is.
+    """
+    def split_run(match: re.Match) -> str:
+        run = match.group(0)
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        return " " + " ".join(bigrams + [run[-1]]) + " "
+    return CJK_RUN.sub(split_run, text)
+
+
+def build_query(query: str) -> str:
+    """
+    Translate free text into an FTS5 MATCH expression (all terms must match)
+    Returns an empty string if the query has nothing searchable.
+    """
+    terms = []
+    for match in WORD.finditer(query):
+        word = match.group(0)
+        if CJK_RUN.fullmatch(word):
+            if len(word) == 1:
+                # Matches the word as a bigram prefix or as a run-final character
+                terms.append(f'"{word}"*')
+            else:
+                bigrams = " ".join(word[i:i + 2] for i in range(len(word) - 1))
+                terms.append(f'"{bigrams}"')
+        elif CJK_RUN.search(word):
+            # Mixed word such as 'camera1で': search each part separately
+            for part in re.split(f'({CJK_RUN.pattern})', word):
+                if part:
+                    terms.append(build_query(part))
+        else:
+            terms.append(f'"{word}"*')
+    return " AND ".join(term for term in terms if term)
+
+
+class SearchIndex:
+    """
+    SQLite FTS5 index over stored messages.
+
+    Lives in the session database and is updated in the same transaction as
+    each appended message, so it never needs a separate indexing pass.
+    Internal messages (prompts only the model sees) are not indexed.
+    """
+
+    # Stored in PRAGMA user_version; bump it when the indexed content changes
+    # so existing databases are re-indexed once on open
+    INDEX_VERSION = 2
+
+    SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(
+            body,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """
+
+    def create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.executescript(self.SCHEMA)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.INDEX_VERSION:
+            self.rebuild(conn)
+
+    def rebuild(self, conn: sqlite3.Connection) -> None:
+        """Re-index every stored message (used for databases from an older index version)"""
+        logger.info("Rebuilding message search index")
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM message_index")
+            rows = conn.execute("SELECT id, text FROM messages WHERE internal = 0").fetchall()
+            conn.executemany(
+                "INSERT INTO message_index (rowid, body) VALUES (?, ?)",
+                ((row[0], segment(row[1])) for row in rows)
+            )
+            conn.execute(f"PRAGMA user_version = {self.INDEX_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def index_message(self, conn: sqlite3.Connection, message_id: int, text: str,
+                      internal: bool = False) -> None:
+        if internal:
+            return
+        conn.execute(
+            "INSERT INTO message_index (rowid, body) VALUES (?, ?)", (message_id, segment(text))
+        )
+
+    def remove_messages(self, conn: sqlite3.Connection, message_ids: List[int]) -> None:
+        conn.executemany("DELETE FROM message_index WHERE rowid = ?", ((i,) for i in message_ids))
+
+    def search(self, conn: sqlite3.Connection, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Find messages matching a query, newest first
+        Returns:
+            List[Dict]: session_id, seq, role, model, text, snippet, created_at
+        """
+        expression = build_query(query)
+        if not expression:
+            return []
+        rows = conn.execute(
+            "SELECT m.session_id, m.seq, m.role, m.model, m.text, m.created_at "
+            "FROM message_index JOIN messages m ON m.id = message_index.rowid "
+            "WHERE message_index MATCH ? ORDER BY message_index.rowid DESC LIMIT ?",
+            (expression, limit)
+        ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["snippet"] = self.snippet(result["text"], query)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def snippet(text: str, query: str, width: int = 40) -> str:
+        """Return the part of text around the first query term"""
+        lowered = text.lower()
+        position = -1
+        for term in WORD.findall(query.lower()):
+            position = lowered.find(term)
+            if position >= 0:
+                break
+        if position < 0:
+            position = 0
+        start = max(0, position - width)
+        end = min(len(text), position + width)
+        prefix = "..." if start > 0 else ""
+        suffix = "..." if end < len(text) else ""
+        return prefix + text[start:end].replace("\n", " ") + suffix
+
@@ -0,0 +1,206 @@
+# session_recorder.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRecorder:
+    """
+    Records the inputs of every turn so the session can be replayed later.
+
+    A recording is a directory holding turns.jsonl (one JSON object per turn)
+    and frames/ (captured camera images, stored once by SHA-256). Each turn
+    records the user input and where it came from, the model, captured
+    frames, every provider call with its latency and response, speech
+    synthesis timings, the transcription timing for voice input and the time
+    since the recording started. session_replay.py feeds a recording back
+    through ConversationManager against the mock providers.
+
+    Speech is synthesized after the turn has returned, so a turn that queued
+    speech is written once that speech is rendered or dropped; turns are
+    always written in order.
+
+    Enable with CYBERDECK_RECORD=1 (recordings/<timestamp>) or a directory.
+    Recordings contain what the user said and what the cameras saw.
+    """
+
+    def __init__(self, enabled: bool = False, directory: Optional[str] = None):
+        self.enabled = enabled
+        self.directory = Path(directory or f"recordings/{time.strftime('%Y%m%d-%H%M%S')}")
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+        self._turn: Optional[Dict] = None
+        self._pending_voice: Optional[Dict] = None
+        # Turn that queued the speech being synthesized; replies interrupt earlier speech
+        self._speech_turn: Optional[Dict] = None
+        # Ended turns not yet written, oldest first
+        self._unwritten: deque = deque()
+        self._turn_count = 0
+        if enabled:
+            (self.directory / "frames").mkdir(parents=True, exist_ok=True)
+            logger.info("Recording session to %s", self.directory)
+
+    @classmethod
+    def from_env(cls) -> "SessionRecorder":
+        setting = os.environ.get("CYBERDECK_RECORD", "")
+        if not setting:
+            return cls(enabled=False)
+        if setting in ("1", "true"):
+            return cls(enabled=True)
+        return cls(enabled=True, directory=setting)
+
+    def record_transcription(self, text: str, audio_seconds: float, latency: float) -> None:
+        """Remember a voice input; it is attached to the turn that sends this text"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending_voice = {
+                "text": text,
+                "audio_seconds": round(audio_seconds, 3),
+                "latency": round(latency, 4),
+            }
+
+    def begin_turn(self, user_input: str, model: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            voice = self._pending_voice
+            self._pending_voice = None
+            if voice is not None and voice["text"].strip() != user_input:
+                # The transcript was edited or discarded before it was sent
+                voice = None
+            self._turn = {
+                "turn": self._turn_count,
+                "offset": round(time.monotonic() - self._origin, 4),
+                "source": "voice" if voice else "text",
+                "input": user_input,
+                "model": model,
+                "transcription": voice,
+                "frames": [],
+                "provider_calls": [],
+                "tts": [],
+                "_start": time.monotonic(),
+                "_speech": 0,
+            }
+
+    def record_frame(self, camera_num: int, image_path: str, source_size: Tuple[int, int]) -> None:
+        """
+        Store a captured camera frame
+        Args:
+            camera_num: Camera the frame came from
+            image_path: Processed image as sent to the provider
+            source_size: (width, height) of the raw capture
+        """
+        if not self.enabled:
+            return
+        try:
+            with open(image_path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            frame_path = self.directory / "frames" / f"{digest}.jpg"
+            if not frame_path.exists():
+                frame_path.write_bytes(data)
+        except OSError as e:
+            logger.warning("Error recording frame: %s", e)
+            return
+        with self._lock:
+            if self._turn is not None:
+                self._turn["frames"].append({
+                    "camera": camera_num,
+                    "hash": digest,
+                    "width": source_size[0],
+                    "height": source_size[1],
+                })
+
+    def record_provider_call(self, service: str, provider: str, latency: float, response: str) -> None:
+        """Record one successful provider request of the current turn"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._turn is not None:
+                self._turn["provider_calls"].append({
+                    "service": service,
+                    "provider": provider,
+                    "latency": round(latency, 4),
+                    "response": response,
+                })
+
+    def track_speech(self, utterance) -> None:
+        """
+        Keep the current turn open until the speech it queued is rendered
+        Args:
+            utterance: audio_engine.Utterance queued by the turn
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            turn = self._turn
+            if turn is None:
+                return
+            turn["_speech"] += 1
+            self._speech_turn = turn
+        utterance.on_rendered = lambda: self._speech_rendered(turn)
+
+    def _speech_rendered(self, turn: Dict) -> None:
+        with self._lock:
+            turn["_speech"] -= 1
+            self._write_ended()
+
+    def record_tts(self, chars: int, latency: float) -> None:
+        """Record one synthesized sentence of the speech being rendered"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._speech_turn is not None:
+                self._speech_turn["tts"].append({"chars": chars, "latency": round(latency, 4)})
+
+    def end_turn(self, response: str, outcome: str) -> None:
+        """Finish the current turn; it is appended to turns.jsonl once its speech is rendered"""
+        if not self.enabled:
+            return
+        with self._lock:
+            turn = self._turn
+            self._turn = None
+            if turn is None:
+                return
+            turn["latency"] = round(time.monotonic() - turn.pop("_start"), 4)
+            turn["response"] = response
+            turn["outcome"] = outcome
+            self._turn_count += 1
+            self._unwritten.append(turn)
+            self._write_ended()
+
+    def _write_ended(self) -> None:
+        """Append ended turns whose speech is done to turns.jsonl, in order (lock held)"""
+        while self._unwritten and self._unwritten[0]["_speech"] <= 0:
+            turn = self._unwritten.popleft()
+            if turn is self._speech_turn:
+                self._speech_turn = None
+            record = {key: value for key, value in turn.items() if not key.startswith("_")}
+            try:
+                with open(self.directory / "turns.jsonl", "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning("Error writing recorded turn: %s", e)
+
+
+def load_recording(directory: str) -> List[Dict]:
+    """Read the turns of a recording in order"""
+    turns = []
+    with open(Path(directory) / "turns.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                turns.append(json.loads(line))
+    return turns
+
+
+# Process-wide recorder configured from the environment
+recorder = SessionRecorder.from_env()
@@ -0,0 +1,261 @@
+# session_replay.py
+"""
+Replay a recorded session (see session_recorder.py) against mock providers.
+
+Every recorded turn is fed back through ConversationManager in order: the
+same input text (through Whisper for voice turns), the same camera frames
+and the same provider responses, each served after its recorded latency.
+Latency and memory of the current code can then be compared with the
+original run, or with an earlier replay of the same recording:
+
+    python session_replay.py recordings/20241120-101500 --speed 1
+    python session_replay.py recordings/20241120-101500 --speed 0 --compare replay.json
+
+--speed 1 keeps the original timings and think time, --speed 10 runs ten
+times faster, --speed 0 removes every recorded delay.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmark import TurnBenchmark, compare, git_version, make_recording, start_mock_environment, summarize
+from logging_setup import setup_logging
+from mock_servers import MockBehavior, MockProviders
+from session_recorder import load_recording
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process, if /proc is available"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class ReplayCamera:
+    """Stands in for Picamera2 and returns the recorded frames in order"""
+
+    def __init__(self):
+        self.frames = deque()
+        self.last_frame = None
+
+    def queue_frame(self, jpeg_path: Path, width: int, height: int) -> None:
+        """Decode a recorded frame ahead of time, at the original capture size"""
+        import numpy as np
+        from PIL import Image
+        with Image.open(jpeg_path) as image:
+            frame = image.convert("RGBA").resize((width, height))
+        self.frames.append(np.asarray(frame))
+
+    def capture_array(self, stream: str = "main"):
+        if self.frames:
+            self.last_frame = self.frames.popleft()
+        if self.last_frame is None:
+            import numpy as np
+            self.last_frame = np.zeros((1232, 1640, 4), dtype=np.uint8)
+        return self.last_frame.copy()
+
+
+def turn_groups(turn: Dict) -> List[str]:
+    """Groups a recorded turn is reported under"""
+    groups = ["all", turn["source"]]
+    if turn["frames"]:
+        groups.append("camera")
+    if len(turn["provider_calls"]) > 1:
+        groups.append("tool")
+    return groups
+
+
+class SessionReplay(TurnBenchmark):
+    """Feeds a recording through ConversationManager against the mock providers"""
+
+    def __init__(self, work_dir: Path, recording_dir: Path, mocks: MockProviders,
+                 speed: float, verbose: bool = False):
+        super().__init__(work_dir, verbose)
+        self.recording_dir = recording_dir
+        self.mocks = mocks
+        self.speed = speed
+        self.cameras = {1: ReplayCamera(), 2: ReplayCamera()}
+        self.manager.set_cameras(self.cameras[1], self.cameras[2])
+
+    def _scaled(self, seconds: float) -> float:
+        return seconds / self.speed if self.speed > 0 else 0.0
+
+    def _script_turn(self, turn: Dict) -> None:
+        """Queue the recorded responses, timings and frames of one turn"""
+        for call in turn["provider_calls"]:
+            self.mocks.servers[call["service"]].script("chat", call["response"], self._scaled(call["latency"]))
+        for tts in turn["tts"]:
+            self.mocks.servers["openai"].script("speech", "", self._scaled(tts["latency"]))
+        voice = turn.get("transcription")
+        if voice:
+            self.mocks.servers["openai"].script("transcription", voice["text"], self._scaled(voice["latency"]))
+            # Upload as much audio as the user originally recorded
+            self.recording = make_recording(voice["audio_seconds"])
+        for frame in turn["frames"]:
+            self.cameras[frame["camera"]].queue_frame(
+                self.recording_dir / "frames" / f"{frame['hash']}.jpg", frame["width"], frame["height"]
+            )
+
+    def replay(self, turns: List[Dict]) -> Dict:
+        latencies: Dict[str, List[float]] = {}
+        recorded: Dict[str, List[float]] = {}
+        per_turn = []
+        mismatched = 0
+        unused_replies = 0
+        previous: Optional[Dict] = None
+        rss_start = current_rss_mb()
+        started = time.perf_counter()
+
+        for turn in turns:
+            if turn["outcome"] == "cancelled":
+                # Cancelled turns were rolled back and left no trace in the history
+                continue
+
+            # Recorded think time between the end of one turn and the start of the next
+            if previous is not None and self.speed > 0:
+                gap = turn["offset"] - previous["offset"] - previous["latency"]
+                if turn.get("transcription"):
+                    gap -= turn["transcription"]["latency"]
+                time.sleep(max(0.0, gap) / self.speed)
+            previous = turn
+
+            with self._quiet():
+                if turn["model"] != self.manager.current_model.get_model_name():
+                    self.manager.set_ai_model(turn["model"])
+            self._script_turn(turn)
+
+            turn_start = time.perf_counter()
+            with self._quiet():
+                prompt = self._transcribe().strip() if turn.get("transcription") else turn["input"]
+                response = self.manager.get_response(prompt)
+                self.manager.tts_manager.wait_synthesized()
+                self.manager.tts_manager.stop_playback()
+            latency = time.perf_counter() - turn_start
+
+            if response != turn["response"]:
+                mismatched += 1
+            for server in self.mocks.servers.values():
+                unused_replies += server.clear_scripts()
+            for camera in self.cameras.values():
+                camera.frames.clear()
+
+            recorded_latency = turn["latency"] + (turn["transcription"] or {}).get("latency", 0.0)
+            for group in turn_groups(turn):
+                latencies.setdefault(group, []).append(latency)
+                recorded.setdefault(group, []).append(recorded_latency)
+            per_turn.append({
+                "turn": turn["turn"],
+                "groups": turn_groups(turn),
+                "recorded_ms": recorded_latency * 1000,
+                "replayed_ms": latency * 1000,
+                "rss_mb": current_rss_mb(),
+            })
+
+        wall_time = time.perf_counter() - started
+        return {
+            "results": {"replay": {
+                group: summarize(values, 0, wall_time) for group, values in latencies.items()
+            }},
+            "recorded": {group: summarize(values, 0, wall_time) for group, values in recorded.items()},
+            "mismatched_responses": mismatched,
+            "unused_scripted_replies": unused_replies,
+            "memory": {"rss_start_mb": rss_start, "rss_end_mb": current_rss_mb(), "peak_rss_mb": peak_rss_mb()},
+            "per_turn": per_turn,
+            "elapsed_s": wall_time,
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded session against mock providers")
+    parser.add_argument("recording", help="Recording directory (contains turns.jsonl)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = original timing, 10 = ten times faster, 0 = no delays")
+    parser.add_argument("--output", default="replay_results.json")
+    parser.add_argument("--compare", help="Earlier replay results of the same recording")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p50/p95 slowdown reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's debug output")
+    args = parser.parse_args(argv)
+    setup_logging("DEBUG" if args.verbose else "WARNING")
+
+    recording_dir = Path(args.recording).resolve()
+    turns = load_recording(str(recording_dir))
+    print(f"Replaying {len(turns)} turns from {recording_dir} at speed {args.speed:g}")
+
+    # Streaming runs at the same relative speed as the recorded latencies
+    rate = 200.0 * args.speed if args.speed > 0 else 0.0
+    mocks = start_mock_environment({
+        service: MockBehavior(first_token_latency=0.0, speech_latency=0.0,
+                              transcription_latency=0.0, tokens_per_second=rate)
+        for service in MockProviders.BASE_PATHS
+    })
+
+    output_path = Path(args.output).resolve()
+    baseline_path = Path(args.compare).resolve() if args.compare else None
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="cyberdeck-replay-") as work_dir:
+        os.chdir(work_dir)
+        try:
+            replay = SessionReplay(Path(work_dir), recording_dir, mocks, args.speed, args.verbose)
+            outcome = replay.replay(turns)
+            replay.manager.session_store.close()
+        finally:
+            os.chdir(original_dir)
+            mocks.stop()
+
+    report = dict(outcome, **{
+        "version": git_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "recording": str(recording_dir),
+        "settings": {"speed": args.speed, "turns": len(turns)},
+    })
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for group, summary in report["results"]["replay"].items():
+        original = report["recorded"][group]
+        print(f"{group:<7} {summary['turns']:4d} turns  replay p50 {summary['p50_ms']:8.1f} ms "
+              f"p95 {summary['p95_ms']:8.1f} ms  |  recorded p50 {original['p50_ms']:8.1f} ms "
+              f"p95 {original['p95_ms']:8.1f} ms")
+    memory = report["memory"]
+    print(f"Memory: peak RSS {memory['peak_rss_mb']:.1f} MB")
+    if report["mismatched_responses"] or report["unused_scripted_replies"]:
+        print(f"Warning: replay diverged from the recording ({report['mismatched_responses']} different "
+              f"responses, {report['unused_scripted_replies']} unused provider replies)")
+    print(f"Results written to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("Warning: baseline was replayed with different settings")
+        regressions = compare(report, baseline, args.threshold)
+        previous_peak = baseline.get("memory", {}).get("peak_rss_mb")
+        if previous_peak:
+            print(f"Peak RSS {memory['peak_rss_mb']:.1f} MB (was {previous_peak:.1f} MB)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
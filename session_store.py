@@ -0,0 +1,223 @@
+# session_store.py
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from search_index import SearchIndex
+
+
+class SessionStore:
+    """
+    Append-only conversation store backed by SQLite.
+
+    Each message is written as one row as soon as it is added, so the cost per
+    message stays constant no matter how long the session gets. Images are
+    stored once as binary blobs keyed by their SHA-256 and referenced from
+    messages by hash.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            session_id INTEGER NOT NULL REFERENCES sessions(id),
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            model TEXT,
+            text TEXT NOT NULL,
+            image_hash TEXT REFERENCES blobs(hash),
+            created_at REAL NOT NULL,
+            internal INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (session_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            data BLOB NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = "sessions.db"):
+        """
+        Open (or create) the session database
+        Args:
+            db_path: Path to the SQLite file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL keeps appends cheap and lets readers run alongside the writer
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "internal" not in columns:
+            # Databases from before messages could be marked internal
+            self._conn.execute("ALTER TABLE messages ADD COLUMN internal INTEGER NOT NULL DEFAULT 0")
+        self.search_index = SearchIndex()
+        self.search_index.create_schema(self._conn)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def create_session(self) -> int:
+        """Start a new session and return its id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO sessions (created_at, updated_at) VALUES (?, ?)", (now, now)
+            )
+            return cursor.lastrowid
+
+    def put_blob(self, data: bytes, mime_type: str = "image/jpeg") -> str:
+        """Store binary data once and return its content hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, mime_type, data) VALUES (?, ?, ?)",
+                (digest, mime_type, data)
+            )
+        return digest
+
+    def get_blob(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return bytes(row["data"]) if row else None
+
+    def append_message(self,
+                       session_id: int,
+                       role: str,
+                       text: str,
+                       image_hash: Optional[str] = None,
+                       model: Optional[str] = None,
+                       internal: bool = False) -> int:
+        """
+        Append one message to a session
+        Args:
+            session_id: Session to append to
+            role: 'user' or 'assistant'
+            text: Message text
+            image_hash: Hash returned by put_blob for an attached image
+            model: Name of the AI model that produced an assistant message
+            internal: Part of the context but never shown as a chat message, such as
+                a prompt carrying search results
+        Returns:
+            int: Sequence number of the message within the session
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                row = self._conn.execute(
+                    "SELECT message_count FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    raise ValueError(f"Unknown session: {session_id}")
+                seq = row["message_count"]
+                cursor = self._conn.execute(
+                    "INSERT INTO messages (session_id, seq, role, model, text, image_hash, created_at, internal) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, seq, role, model, text, image_hash, now, int(internal))
+                )
+                self.search_index.index_message(self._conn, cursor.lastrowid, text, internal)
+                self._conn.execute(
+                    "UPDATE sessions SET message_count = ?, updated_at = ? WHERE id = ?",
+                    (seq + 1, now, session_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return seq
+
+    def delete_messages(self, session_id: int, from_seq: int) -> None:
+        """
+        Remove the messages of a session from from_seq on
+        Only used to roll back a cancelled turn, so the stored session matches
+        the in-memory history again.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                ids = [row["id"] for row in self._conn.execute(
+                    "SELECT id FROM messages WHERE session_id = ? AND seq >= ?", (session_id, from_seq)
+                )]
+                self.search_index.remove_messages(self._conn, ids)
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND seq >= ?", (session_id, from_seq)
+                )
+                self._conn.execute(
+                    "UPDATE sessions SET message_count = ? WHERE id = ? AND message_count > ?",
+                    (from_seq, session_id, from_seq)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def latest_session_id(self) -> Optional[int]:
+        """Return the most recently updated session that has messages"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM sessions WHERE message_count > 0 ORDER BY updated_at DESC LIMIT 1"
+            ).fetchone()
+        return row["id"] if row else None
+
+    def list_sessions(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, updated_at, message_count FROM sessions "
+                "WHERE message_count > 0 ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_messages(self,
+                      session_id: int,
+                      limit: Optional[int] = None,
+                      before_seq: Optional[int] = None) -> List[Dict]:
+        """
+        Load messages of a session in order, newest window first
+        Only the requested window is read, so resuming a long session costs
+        the same as resuming a short one. Image data is not loaded; use
+        get_blob with the message's image_hash when it is needed.
+        Args:
+            session_id: Session to read
+            limit: Maximum number of (most recent) messages to return
+            before_seq: Only return messages older than this sequence number
+        Returns:
+            List[Dict]: Rows with seq, role, model, text, image_hash, created_at, internal
+        """
+        query = ("SELECT seq, role, model, text, image_hash, created_at, internal FROM messages "
+                 "WHERE session_id = ?")
+        params: list = [session_id]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Full-text search across all sessions
+        Args:
+            query: Free text in any of the supported languages
+            limit: Maximum number of results
+        Returns:
+            List[Dict]: Matching messages with a snippet, newest first
+        """
+        with self._lock:
+            return self.search_index.search(self._conn, query, limit)
@@ -0,0 +1,159 @@
+# streaming_transcription.py
+import logging
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from audio_capture import AudioCapture
+from audio_upload import prepare_upload, transcribe
+from metrics import metrics
+from tracing import tracer
+from vad import VoiceActivityDetector
+
+logger = logging.getLogger(__name__)
+
+_SEGMENTS = metrics.counter("transcription_segments_total", "Audio segments sent for transcription while recording")
+_SEGMENT_SECONDS = metrics.histogram("transcription_segment_seconds", "Time to transcribe one segment",
+                                     buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0))
+
+# Characters written without spaces between words
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def join_segments(texts: List[str]) -> str:
+    """Stitch segment transcripts together, without spaces between Chinese or Japanese text"""
+    joined = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if joined and not (_CJK.match(joined[-1]) and _CJK.match(text[0])):
+            joined += " "
+        joined += text
+    return joined
+
+
+class StreamingTranscriber:
+    """
+    Transcribes a recording in segments while it is still being recorded.
+
+    Polled from the Tk loop, it looks at the audio captured since the last
+    cut and, once there is at least min_segment_seconds of it, splits at
+    the last pause the voice activity detector finds. The segment is
+    trimmed, encoded and transcribed on a small thread pool while
+    recording continues. Speech without a pause is cut after
+    max_segment_seconds. When the recording stops, only the audio after
+    the last cut is left to transcribe, and the segment transcripts are
+    joined in recording order.
+    """
+
+    def __init__(self,
+                 capture: AudioCapture,
+                 vad: VoiceActivityDetector,
+                 client,
+                 min_segment_seconds: float = 4.0,
+                 max_segment_seconds: float = 20.0,
+                 workers: int = 3):
+        """
+        Args:
+            capture: Audio capture the recording runs on
+            vad: Finds pauses and trims silence
+            client: OpenAI client used for Whisper
+            min_segment_seconds: Shortest segment sent on its own; short
+                segments lose the context Whisper needs
+            max_segment_seconds: Longest stretch without a cut
+            workers: Segments transcribed at the same time
+        """
+        self.capture = capture
+        self.vad = vad
+        self.client = client
+        self.min_segment_seconds = min_segment_seconds
+        self.max_segment_seconds = max_segment_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcribe")
+        # Capture position of the first frame not yet submitted; None when idle
+        self._cut: Optional[int] = None
+        self._noise_floor: Optional[float] = None
+        self._futures: List[Future] = []
+
+    def begin(self) -> None:
+        """Follow the recording just started on the capture (Tk thread)"""
+        self._cut = self.capture.start_frame
+        # Segments are mostly speech, so the floor starts from the audio before the recording
+        self._noise_floor = self.vad.estimate_noise_floor(self.capture.idle(), self.capture.sample_rate)
+        self._futures = []
+
+    def poll(self) -> None:
+        """Submit the audio up to the latest pause, if there is enough of it (Tk thread)"""
+        if self._cut is None or not self.capture.recording:
+            return
+        rate = self.capture.sample_rate
+        end = self.capture.position
+        if end - self._cut < self.min_segment_seconds * rate:
+            return
+        audio = self.capture.span(self._cut, end)
+        self._noise_floor = self.vad.estimate_noise_floor(audio, rate, self._noise_floor)
+        pause = self.vad.find_pause(audio, rate, noise_floor=self._noise_floor)
+        if pause is None or pause < self.min_segment_seconds * rate / 2:
+            if len(audio) < self.max_segment_seconds * rate:
+                return
+            pause = len(audio)
+        self._submit(audio[:pause])
+        self._cut = end - len(audio) + pause
+
+    def stop(self) -> Tuple[np.ndarray, List[Future]]:
+        """
+        End the recording and submit what is left of it (Tk thread)
+        Returns:
+            Tuple[np.ndarray, List[Future]]: The whole recording, and one future per
+                segment in order; pass them to collect() on a worker thread
+        """
+        audio = self.capture.end()
+        if self._cut is not None:
+            # Offset of the cut within the returned audio
+            offset = self._cut - (self.capture.end_frame - len(audio))
+            self._submit(audio[max(0, offset):])
+        futures, self._futures = self._futures, []
+        self._cut = None
+        return audio, futures
+
+    def cancel(self) -> None:
+        """Drop the recording and any segment not yet started"""
+        self.capture.cancel()
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self._cut = None
+
+    @staticmethod
+    def collect(futures: List[Future]) -> str:
+        """Wait for the segment transcripts and join them (worker thread)"""
+        return join_segments([future.result() for future in futures])
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, segment: np.ndarray) -> None:
+        if len(segment):
+            self._futures.append(self._executor.submit(
+                self._transcribe, segment, len(self._futures), self._noise_floor))
+
+    def _transcribe(self, segment: np.ndarray, index: int, noise_floor: Optional[float]) -> str:
+        rate = self.capture.sample_rate
+        speech = self.vad.trim(segment, rate, noise_floor=noise_floor)
+        if not len(speech):
+            energy, _ = self.vad.features(segment, rate)
+            if len(energy) and energy.max() > self.vad.min_level_db:
+                # Losing part of the recording silently would send a partial transcript
+                raise RuntimeError(f"no speech found in segment {index}, which is not silent")
+            return ""
+        start = time.perf_counter()
+        with tracer.span("transcription_segment", index=index):
+            text = transcribe(self.client, prepare_upload(speech, rate))
+        _SEGMENTS.inc()
+        _SEGMENT_SECONDS.observe(time.perf_counter() - start)
+        logger.debug("Segment %s (%.1f s of speech) transcribed in %.0f ms",
+                     index, len(speech) / rate, (time.perf_counter() - start) * 1000)
+        return text
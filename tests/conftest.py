@@ -0,0 +1,51 @@
+# conftest.py
+import sys
+from pathlib import Path
+
+import pytest
+
+# The application modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from key_manager import KeyManager  # noqa: E402
+from mock_servers import MockBehavior, MockProviders  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from resilience import CircuitBreaker  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mock_providers():
+    """One mock server per service for the whole test run"""
+    mocks = MockProviders({service: MockBehavior(first_token_latency=0.0, tokens_per_second=10000.0)
+                           for service in MockProviders.BASE_PATHS})
+    env = mocks.start()
+    yield mocks, env
+    mocks.stop()
+
+
+@pytest.fixture
+def providers(mock_providers, tmp_path, monkeypatch):
+    """
+    Point the providers at the mock servers, with key files in a scratch directory,
+    no client-side rate limits and fresh circuit breakers
+    Yields:
+        MockProviders: Set servers[service].behavior to inject errors
+    """
+    mocks, env = mock_providers
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+    for key_file in KeyManager.DEFAULT_KEYS.values():
+        (tmp_path / key_file).write_text("mock-key\n")
+    monkeypatch.setattr(RateLimiter, "DEFAULT_LIMITS", dict(RateLimiter.DEFAULT_LIMITS))
+    RateLimiter.reset()
+    for service in list(RateLimiter.DEFAULT_LIMITS):
+        RateLimiter.configure(service, requests_per_minute=1000000, tokens_per_minute=None)
+    CircuitBreaker.reset_all()
+    for server in mocks.servers.values():
+        server.behavior = MockBehavior(first_token_latency=0.0, tokens_per_second=10000.0)
+        server.reset_stats()
+    yield mocks
+    # Nothing built with the test limits or breakers outlives the test
+    RateLimiter.reset()
+    CircuitBreaker.reset_all()
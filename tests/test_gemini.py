@@ -0,0 +1,39 @@
+# test_gemini.py
+import threading
+
+import pytest
+from google.api_core import rest_streaming
+
+from cancellation import CancelToken, TurnCancelled, use_token
+from gemini import GeminiModel
+from mock_servers import MockBehavior
+
+HISTORY = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello"},
+]
+
+
+def test_stream_ending_without_text(providers):
+    # The mock ends every stream with a usage-only chunk that has no text parts
+    reply = GeminiModel().generate_response(HISTORY, None)
+
+    assert reply.startswith("This is a mock reply")
+
+
+def test_cancel_closes_the_stream(providers, monkeypatch):
+    cancelled_streams = []
+    original_cancel = rest_streaming.ResponseIterator.cancel
+
+    def cancel(stream):
+        cancelled_streams.append(stream)
+        original_cancel(stream)
+
+    monkeypatch.setattr(rest_streaming.ResponseIterator, "cancel", cancel)
+    providers.servers["google"].behavior = MockBehavior(first_token_latency=0.0, tokens_per_second=100.0)
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+
+    with use_token(token), pytest.raises(TurnCancelled):
+        GeminiModel().generate_response(HISTORY, None)
+    assert len(cancelled_streams) == 1
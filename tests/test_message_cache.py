@@ -0,0 +1,118 @@
+# test_message_cache.py
+from message_cache import FormatCache, next_message_id
+
+
+def message(role, content):
+    return {"id": next_message_id(), "role": role, "content": content}
+
+
+class CountingBuild:
+    """Formats a message as (role, content, variant) and counts the calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, message, variant):
+        self.calls.append(message.get("id"))
+        return (message["role"], message["content"], variant)
+
+
+def history(turns):
+    messages = [message("system", "You are a helpful assistant.")]
+    for index in range(turns):
+        messages.append(message("user", f"Question {index}"))
+        messages.append(message("assistant", f"Answer {index}"))
+    return messages
+
+
+def test_next_turn_formats_only_new_messages():
+    cache, build = FormatCache(), CountingBuild()
+    messages = history(3)
+    cache.format_list(messages, build)
+
+    build.calls.clear()
+    messages.append(message("user", "Question 3"))
+    formatted = cache.format_list(messages, build, "image")
+    # The previous last message is formatted again in case its variant changed; it is cached
+    assert build.calls == [messages[-1]["id"]]
+    assert formatted[-1] == ("user", "Question 3", "image")
+    assert formatted[:-1] == [(m["role"], m["content"], None) for m in messages[:-1]]
+
+
+def test_latest_variant_only_applies_to_the_last_message():
+    cache, build = FormatCache(), CountingBuild()
+    messages = history(1)
+    messages.append(message("user", "What is this?"))
+    assert cache.format_list(messages, build, "image")[-1][2] == "image"
+
+    messages.append(message("assistant", "A plant."))
+    formatted = cache.format_list(messages, build, None)
+    assert [item[2] for item in formatted] == [None] * len(messages)
+
+
+def test_rollback_then_new_messages():
+    cache, build = FormatCache(), CountingBuild()
+    messages = history(2)
+    cache.format_list(messages, build)
+    # A cancelled turn added two messages that are rolled back
+    length = len(messages)
+    messages += [message("user", "Cancelled question"), message("assistant", "Cancelled answer")]
+    cache.format_list(messages, build)
+    del messages[length:]
+
+    messages += [message("user", "New question"), message("assistant", "New answer")]
+    formatted = cache.format_list(messages, build)
+    assert formatted == [(m["role"], m["content"], None) for m in messages]
+    assert "Cancelled question" not in [item[1] for item in formatted]
+
+
+def test_truncated_history_is_not_padded_from_the_previous_turn():
+    cache, build = FormatCache(), CountingBuild()
+    messages = history(3)
+    cache.format_list(messages, build)
+
+    formatted = cache.format_list(messages[:3], build)
+    assert formatted == [(m["role"], m["content"], None) for m in messages[:3]]
+
+
+def test_replaced_system_prompt_is_formatted_again():
+    cache, build = FormatCache(), CountingBuild()
+    messages = history(2)
+    cache.format_list(messages, build)
+
+    # A model switch swaps the system prompt's content in place
+    messages[0]["content"] = "You are Claude."
+    build.calls.clear()
+    formatted = cache.format_list(messages, build)
+    assert formatted[0] == ("system", "You are Claude.", None)
+    assert messages[0]["id"] in build.calls
+    # The other messages are still served from the cache
+    assert build.calls == [messages[0]["id"]]
+
+
+def test_swapped_history_is_formatted_from_scratch():
+    cache, build = FormatCache(), CountingBuild()
+    cache.format_list(history(3), build)
+
+    # Clearing or resuming a session replaces every message
+    other = history(3)
+    formatted = cache.format_list(other, build)
+    assert formatted == [(m["role"], m["content"], None) for m in other]
+
+
+def test_messages_without_id_are_not_cached():
+    cache, build = FormatCache(), CountingBuild()
+    prompt = {"role": "user", "content": "Search results"}
+    cache.get(prompt, None, build)
+    cache.get(prompt, None, build)
+    assert build.calls == [None, None]
+    assert len(cache) == 0
+
+
+def test_cache_forgets_dropped_messages():
+    cache, build = FormatCache(), CountingBuild()
+    for _ in range(5):
+        cache.format_list(history(10), build)
+    messages = history(1)
+    cache.format_list(messages, build)
+    assert len(cache) <= 2 * len(messages) + 16
@@ -0,0 +1,171 @@
+# test_resilience.py
+import time
+
+import pytest
+
+from grok import GrokModel
+from mock_servers import MockBehavior
+from perplexity import PerplexityModel
+from rate_limiter import RateLimitExceeded, RateLimiter
+from resilience import CircuitBreaker, CircuitOpenError, ResilientModel, RetryPolicy
+
+HISTORY = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello"},
+]
+
+
+def provider(cls):
+    """A provider on the mock servers; the SDK's own retries would hide ResilientModel's"""
+    model = cls()
+    model.client = model.client.with_options(max_retries=0)
+    return model
+
+
+def chat_requests(mocks, service):
+    return mocks.servers[service].stats()["requests"].get("chat", 0)
+
+
+def failing(status, error_rate=1.0):
+    return MockBehavior(first_token_latency=0.0, tokens_per_second=10000.0,
+                        error_rate=error_rate, error_status=status)
+
+
+class HealingRetryPolicy(RetryPolicy):
+    """Retries immediately, and the failing server recovers before the retry"""
+
+    def __init__(self, mocks, service, max_attempts=3):
+        super().__init__(max_attempts=max_attempts)
+        self.mocks = mocks
+        self.service = service
+
+    def backoff(self, attempt, error=None):
+        self.mocks.servers[self.service].behavior.error_rate = 0.0
+        return 0.0
+
+
+def test_retries_transient_error(providers):
+    providers.servers["x"].behavior = failing(503)
+    model = ResilientModel(provider(GrokModel), retry_policy=HealingRetryPolicy(providers, "x"),
+                           breaker=CircuitBreaker("Grok"))
+
+    assert model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 2
+    assert model.breaker.snapshot()["retries"] == 1
+
+
+def test_gives_up_after_max_attempts(providers):
+    providers.servers["x"].behavior = failing(503)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=3, base_delay=0.0),
+                           breaker=CircuitBreaker("Grok", min_calls=10))
+
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 3
+
+
+def test_client_error_is_not_retried(providers):
+    providers.servers["x"].behavior = failing(400)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=3, base_delay=0.0),
+                           fallback_factory=lambda: provider(PerplexityModel), breaker=CircuitBreaker("Grok"))
+
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 1
+    assert chat_requests(providers, "perplexity") == 0
+
+
+def test_falls_back_when_retries_run_out(providers):
+    providers.servers["x"].behavior = failing(503)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=2, base_delay=0.0),
+                           fallback_factory=lambda: provider(PerplexityModel),
+                           breaker=CircuitBreaker("Grok", min_calls=10))
+
+    assert model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 2
+    assert chat_requests(providers, "perplexity") == 1
+    assert model.breaker.snapshot()["fallbacks"] == 1
+
+
+def test_open_circuit_skips_the_provider(providers):
+    providers.servers["x"].behavior = failing(503)
+    breaker = CircuitBreaker("Grok", min_calls=2, failure_rate_threshold=0.5, open_duration=60.0)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=1),
+                           fallback_factory=lambda: provider(PerplexityModel), breaker=breaker)
+
+    for _ in range(2):
+        model.generate_response(HISTORY, None)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert chat_requests(providers, "x") == 2
+
+    # Open: straight to the fallback without touching the failing provider
+    assert model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 2
+    assert chat_requests(providers, "perplexity") == 3
+    assert breaker.snapshot()["rejected"] == 1
+
+
+def test_open_circuit_without_fallback_raises(providers):
+    providers.servers["x"].behavior = failing(503)
+    breaker = CircuitBreaker("Grok", min_calls=1, open_duration=60.0)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=1), breaker=breaker)
+
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    with pytest.raises(CircuitOpenError):
+        model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 1
+
+
+def test_half_open_trial_closes_the_circuit(providers):
+    providers.servers["x"].behavior = failing(503)
+    breaker = CircuitBreaker("Grok", min_calls=1, open_duration=0.05)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=1), breaker=breaker)
+
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    providers.servers["x"].behavior.error_rate = 0.0
+    time.sleep(0.1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert model.generate_response(HISTORY, None)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_the_circuit(providers):
+    providers.servers["x"].behavior = failing(503)
+    breaker = CircuitBreaker("Grok", min_calls=1, open_duration=0.05)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=1), breaker=breaker)
+
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    time.sleep(0.1)
+    with pytest.raises(Exception):
+        model.generate_response(HISTORY, None)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["times_opened"] == 2
+
+
+def test_shed_call_skips_retries_and_breaker(providers):
+    RateLimiter.configure("x", max_queued=0)
+    breaker = CircuitBreaker("Grok", min_calls=1)
+    model = ResilientModel(provider(GrokModel), retry_policy=RetryPolicy(max_attempts=3, base_delay=0.0),
+                           breaker=breaker)
+
+    with pytest.raises(RateLimitExceeded):
+        model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 0
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()["calls"] == 0
+    assert breaker.snapshot()["retries"] == 0
+
+
+def test_shed_call_falls_back(providers):
+    RateLimiter.configure("x", max_queued=0)
+    model = ResilientModel(provider(GrokModel), fallback_factory=lambda: provider(PerplexityModel),
+                           breaker=CircuitBreaker("Grok"))
+
+    assert model.generate_response(HISTORY, None)
+    assert chat_requests(providers, "x") == 0
+    assert chat_requests(providers, "perplexity") == 1
@@ -0,0 +1,41 @@
+# test_search_index.py
+import sqlite3
+
+from search_index import SearchIndex
+from session_store import SessionStore
+
+
+def test_internal_messages_are_not_searchable(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    session = store.create_session()
+    store.append_message(session, "user", "Where is the nearest station?")
+    store.append_message(session, "user", 'Search results for "nearest station": ...', internal=True)
+
+    results = store.search("station")
+    assert [result["text"] for result in results] == ["Where is the nearest station?"]
+
+
+def test_index_is_rebuilt_only_for_a_new_version(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(db_path)
+    session = store.create_session()
+    store.append_message(session, "user", "hello camera")
+    store.append_message(session, "user", "internal camera prompt", internal=True)
+    store.close()
+
+    rebuilds = []
+    original_rebuild = SearchIndex.rebuild
+    monkeypatch.setattr(SearchIndex, "rebuild", lambda self, conn: rebuilds.append(original_rebuild(self, conn)))
+    SessionStore(db_path).close()
+    assert rebuilds == []
+
+    # A database indexed by an older version, with the internal message indexed too
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO message_index (rowid, body) SELECT id, text FROM messages WHERE internal = 1")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    store = SessionStore(db_path)
+    assert len(rebuilds) == 1
+    assert [result["text"] for result in store.search("camera")] == ["hello camera"]
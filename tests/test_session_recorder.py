@@ -0,0 +1,37 @@
+# test_session_recorder.py
+from types import SimpleNamespace
+
+from session_recorder import SessionRecorder, load_recording
+
+
+def test_turn_is_written_once_its_speech_is_rendered(tmp_path):
+    recorder = SessionRecorder(enabled=True, directory=str(tmp_path))
+    utterance = SimpleNamespace(on_rendered=None)
+
+    recorder.begin_turn("Hello", "ChatGPT")
+    recorder.track_speech(utterance)
+    recorder.end_turn("Hi there.", "ok")
+    assert not (tmp_path / "turns.jsonl").exists()
+
+    recorder.record_tts(9, 0.25)
+    utterance.on_rendered()
+    [turn] = load_recording(str(tmp_path))
+    assert turn["response"] == "Hi there."
+    assert turn["tts"] == [{"chars": 9, "latency": 0.25}]
+    assert not any(key.startswith("_") for key in turn)
+
+
+def test_turns_are_written_in_order(tmp_path):
+    recorder = SessionRecorder(enabled=True, directory=str(tmp_path))
+    utterance = SimpleNamespace(on_rendered=None)
+
+    recorder.begin_turn("First", "ChatGPT")
+    recorder.track_speech(utterance)
+    recorder.end_turn("One.", "ok")
+    # No speech, but it waits behind the first turn
+    recorder.begin_turn("Second", "ChatGPT")
+    recorder.end_turn("", "error")
+    assert not (tmp_path / "turns.jsonl").exists()
+
+    utterance.on_rendered()
+    assert [turn["input"] for turn in load_recording(str(tmp_path))] == ["First", "Second"]
@@ -0,0 +1,60 @@
+# test_turn_pipeline.py
+import queue
+import threading
+import time
+
+import turn_pipeline
+from turn_pipeline import TurnPipeline
+
+
+class FakeTk:
+    """Stands in for the Tk root; the tests never drain the UI queue"""
+
+    def after(self, ms, callback):
+        pass
+
+
+class GapQueue(queue.Queue):
+    """Runs on_get after a blocking get() returns, before the worker marks the job active"""
+
+    on_get = None
+
+    def get(self, block=True, timeout=None):
+        item = super().get(block, timeout)
+        if block and self.on_get is not None:
+            self.on_get()
+        return item
+
+
+def wait_idle(pipeline, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while pipeline.busy and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_cancel_between_dequeue_and_start(monkeypatch):
+    monkeypatch.setattr(turn_pipeline.queue, "Queue", GapQueue)
+    pipeline = TurnPipeline(FakeTk())
+    GapQueue.on_get = pipeline.cancel_all
+    ran = threading.Event()
+    try:
+        assert pipeline.submit(ran.set)
+        time.sleep(0.1)
+        wait_idle(pipeline)
+    finally:
+        GapQueue.on_get = None
+        pipeline.shutdown()
+
+    assert not ran.is_set()
+    assert len(pipeline.cancel_latencies) == 1
+
+
+def test_job_submitted_after_cancel_runs():
+    pipeline = TurnPipeline(FakeTk())
+    pipeline.cancel_all()
+    ran = threading.Event()
+    try:
+        assert pipeline.submit(ran.set)
+        assert ran.wait(2.0)
+    finally:
+        pipeline.shutdown()
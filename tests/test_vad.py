@@ -0,0 +1,67 @@
+# test_vad.py
+import numpy as np
+import pytest
+
+from vad import VoiceActivityDetector
+
+RATE = 16000
+
+
+def noise(seconds, level=0.001, seed=0):
+    return (level * np.random.default_rng(seed).standard_normal(int(seconds * RATE))).astype(np.float32)
+
+
+def speech(seconds, dip_db=8.0):
+    """Voiced tone whose syllable envelope never drops more than dip_db below its peak"""
+    t = np.arange(int(seconds * RATE)) / RATE
+    low = 10 ** (-dip_db / 20)
+    envelope = low + (1 - low) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    return (0.3 * envelope * np.sin(2 * np.pi * 180 * t)).astype(np.float32)
+
+
+def seconds(audio):
+    return len(audio) / RATE
+
+
+@pytest.fixture
+def vad():
+    return VoiceActivityDetector()
+
+
+def test_trims_silence_around_speech(vad):
+    audio = np.concatenate([noise(1.0), speech(1.0), noise(1.0, seed=1)])
+    trimmed = vad.trim(audio, RATE)
+    assert 1.0 <= seconds(trimmed) <= 1.6
+
+
+def test_keeps_recording_that_is_almost_all_speech(vad):
+    # Less than 10% of the clip is silence, so its own low percentile is inside the speech
+    audio = np.concatenate([noise(0.3), speech(4.0), noise(0.05, seed=1)])
+    assert seconds(vad.trim(audio, RATE)) >= 4.0
+
+
+def test_noise_floor_from_idle_audio(vad):
+    floor = vad.estimate_noise_floor(noise(2.0, seed=2), RATE)
+    audio = np.concatenate([noise(0.3), speech(4.0), noise(0.05, seed=1)])
+    trimmed = vad.trim(audio, RATE, noise_floor=floor)
+    assert 4.0 <= seconds(trimmed) <= 4.35
+
+
+def test_all_speech_is_kept(vad):
+    audio = speech(3.0)
+    assert seconds(vad.trim(audio, RATE)) == seconds(audio)
+
+
+def test_noise_only_is_dropped(vad):
+    assert len(vad.trim(noise(2.0), RATE)) == 0
+
+
+def test_empty_audio(vad):
+    assert len(vad.trim(np.zeros(0, dtype=np.float32), RATE)) == 0
+
+
+def test_find_pause_between_words(vad):
+    audio = np.concatenate([noise(0.5), speech(1.0), noise(0.6, seed=1), speech(1.0), noise(0.1, seed=2)])
+    pause = vad.find_pause(audio, RATE)
+    assert pause is not None
+    assert 1.5 * RATE <= pause <= 2.1 * RATE
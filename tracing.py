@@ -0,0 +1,184 @@
+# tracing.py
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class _NoopSpan:
+    """Returned when tracing is off; entering and leaving it does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, **self.args)
+        return False
+
+    def set(self, **args) -> None:
+        """Attach extra attributes to the span before it ends"""
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Span-based latency tracing for conversation turns.
+
+    Spans are written as Chrome trace events (viewable in Perfetto or
+    chrome://tracing) to a size-rotated file by a background thread, so the
+    request path never blocks on disk. When tracing is off, span() returns a
+    shared no-op object and costs one attribute check.
+
+    Enable with CYBERDECK_TRACE=1 (or a file path); CYBERDECK_TRACE_HUD=1
+    also shows the latest timings on screen.
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 path: str = "traces/trace.json",
+                 max_bytes: int = 5 * 1024 * 1024,
+                 backup_count: int = 3,
+                 hud: bool = False):
+        self.enabled = enabled
+        self.hud = hud and enabled
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.latest: Dict[str, float] = {}  # span name -> last duration in ms
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = queue.SimpleQueue()
+        self._file = None
+        if enabled:
+            threading.Thread(target=self._write_loop, daemon=True).start()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        setting = os.environ.get("CYBERDECK_TRACE", "")
+        hud = os.environ.get("CYBERDECK_TRACE_HUD", "") == "1"
+        if not setting and not hud:
+            return cls(enabled=False)
+        if setting and setting not in ("1", "true"):
+            return cls(enabled=True, path=setting, hud=hud)
+        return cls(enabled=True, hud=hud)
+
+    def span(self, name: str, **args):
+        """
+        Time a block of code
+        Usage:
+            with tracer.span("capture", camera=1):
+                ...
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name: str, start: float, duration: float, **args) -> None:
+        """
+        Record a span measured elsewhere (e.g. one that starts and ends on different threads)
+        Args:
+            name: Span name
+            start: time.perf_counter() value at the start
+            duration: Length in seconds
+        """
+        if not self.enabled:
+            return
+        self.latest[name] = duration * 1000
+        self._events.put({
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    def instant(self, name: str, **args) -> None:
+        """Record a point in time, such as the moment playback starts"""
+        if not self.enabled:
+            return
+        self._events.put({
+            "name": name,
+            "ph": "i",
+            "s": "t",
+            "ts": (time.perf_counter() - self._origin) * 1e6,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    def hud_text(self) -> str:
+        """Latest timings as one line for the on-screen HUD"""
+        return " | ".join(f"{name} {ms:.0f}ms" for name, ms in list(self.latest.items()))
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        # JSON array format; the closing bracket is optional for trace viewers
+        self._file.write("[\n")
+        self._file.flush()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{index}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backup_count > 0:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self._open()
+
+    def _write_loop(self) -> None:
+        try:
+            self._open()
+        except OSError as e:
+            logger.warning("Tracing disabled, cannot open %s: %s", self.path, e)
+            self.enabled = False
+            return
+        while True:
+            event = self._events.get()
+            try:
+                self._file.write(json.dumps(event, ensure_ascii=False, default=str) + ",\n")
+                # Flush once the burst of events is written
+                if self._events.empty():
+                    self._file.flush()
+                    if self._file.tell() > self.max_bytes:
+                        self._rotate()
+            except OSError as e:
+                logger.warning("Error writing trace event: %s", e)
+
+
+# Process-wide tracer configured from the environment
+tracer = Tracer.from_env()
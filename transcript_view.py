@@ -0,0 +1,280 @@
+# transcript_view.py
+import itertools
+import logging
+import os
+import tkinter as tk
+from collections import deque
+from tkinter import font, scrolledtext
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_PAGED = metrics.counter("transcript_pages_loaded_total", "Pages of older messages loaded into the transcript")
+
+# (session id, seq) of a message in the session store
+MessageKey = Tuple[int, int]
+# load_page(session_id, limit, before_seq) -> rows with seq, role, model, text and internal, oldest first,
+# as SessionStore.load_messages returns them
+PageLoader = Callable[[int, int, Optional[int]], List[Dict]]
+
+
+class _Message:
+    def __init__(self, mark: str, key: Optional[MessageKey]):
+        # Text mark at the start of the message
+        self.mark = mark
+        # Where the message is stored, None for messages that are only shown
+        self.key = key
+
+
+class TranscriptView:
+    """
+    Chat transcript that renders a bounded window of messages.
+
+    At most max_messages messages are kept in the text widget; older ones
+    are dropped from the top as new ones arrive. Scrolling to the top pages
+    earlier messages of the session back in from the session store,
+    page_size at a time, dropping the newest ones instead; the next new
+    message or scrolling back to the bottom shows the latest page again.
+    Messages that were never stored (system notes, the welcome text) are
+    not paged back in, and neither are stored messages marked internal,
+    which only the model saw.
+
+    Speaker labels and message text use two named fonts shared by all
+    tags, so a font size change is a single font reconfiguration whatever
+    the length of the transcript.
+    """
+
+    def __init__(self,
+                 text: scrolledtext.ScrolledText,
+                 base_font: font.Font,
+                 colors: Dict[str, str],
+                 load_page: Optional[PageLoader] = None,
+                 max_messages: Optional[int] = None,
+                 page_size: int = 50):
+        """
+        Args:
+            text: Widget the transcript is shown in
+            base_font: Font of the message text; the labels use a bold copy
+            colors: Speaker -> text color; unknown speakers use the 'human' color
+            load_page: Reads stored messages for paging, None to disable paging
+            max_messages: Messages kept in the widget, defaults to
+                CYBERDECK_TRANSCRIPT_MESSAGES (200)
+            page_size: Messages loaded per page
+        """
+        if max_messages is None:
+            max_messages = int(os.environ.get("CYBERDECK_TRANSCRIPT_MESSAGES", "200"))
+        self.text = text
+        self.font = base_font
+        self.bold_font = font.Font(family=base_font.actual('family'), size=base_font.actual('size'), weight='bold')
+        self.colors = colors
+        self.load_page = load_page
+        self.max_messages = max(page_size, max_messages)
+        self.page_size = page_size
+        self._messages: Deque[_Message] = deque()
+        self._marks = itertools.count()
+        # The next older page ends before this stored message, unless a rendered one is older
+        self._older_than: Optional[MessageKey] = None
+        self._older_exhausted = False
+        # Newest message of the session shown last, to return to after paging
+        self._latest: Optional[MessageKey] = None
+        self._newer_hidden = False
+        self._paging_scheduled = False
+        self._setup_tags()
+        self.text.configure(yscrollcommand=self._on_scroll)
+
+    def _setup_tags(self) -> None:
+        """Tags refer to the named fonts, so they never need reconfiguring"""
+        for speaker, color in self.colors.items():
+            self.text.tag_configure(speaker, foreground=color, font=self.bold_font)
+            self.text.tag_configure(f"{speaker}_text", foreground=color, font=self.font)
+
+    def set_font_size(self, size: int) -> None:
+        self.font.configure(size=size)
+        self.bold_font.configure(size=size)
+
+    @property
+    def rendered(self) -> int:
+        """Messages currently in the widget"""
+        return len(self._messages)
+
+    def _new_mark(self, index: str) -> str:
+        mark = f"message{next(self._marks)}"
+        self.text.mark_set(mark, index)
+        self.text.mark_gravity(mark, tk.LEFT)
+        return mark
+
+    def _insert(self, index: str, speaker: str, message: str) -> None:
+        tag = speaker if speaker in self.colors else 'human'
+        speaker_text = "You: " if speaker == "human" else f"{speaker}: "
+        self.text.insert(index, f"\n{speaker_text}", tag, f"{message}\n", f"{tag}_text")
+
+    # New messages
+
+    def append(self, speaker: str, message: str, key: Optional[MessageKey] = None) -> _Message:
+        """
+        Show a message at the bottom and scroll to it
+        Args:
+            speaker: 'human', a model name or 'system'
+            message: Text of the message
+            key: Where the message is stored, if it is; see set_key()
+        Returns:
+            A handle for set_key()
+        """
+        if self._newer_hidden:
+            self._show_latest(skip_from=key)
+        entry = _Message(self._new_mark("end-1c"), key)
+        self._insert("end-1c", speaker, message)
+        self._messages.append(entry)
+        if key is not None:
+            self._latest = key
+        self._drop_oldest()
+        self.text.see(tk.END)
+        return entry
+
+    def append_text(self, text: str) -> None:
+        """Show plain text that is not a message, such as the welcome text"""
+        if self._newer_hidden:
+            self._show_latest()
+        entry = _Message(self._new_mark("end-1c"), None)
+        self.text.insert("end-1c", text)
+        self._messages.append(entry)
+        self._drop_oldest()
+        self.text.see(tk.END)
+
+    def set_key(self, entry: _Message, key: MessageKey) -> None:
+        """Record where a message shown before it was stored ended up in the store"""
+        entry.key = key
+        if self._latest is None or key > self._latest:
+            self._latest = key
+
+    def _drop_oldest(self) -> None:
+        while len(self._messages) > self.max_messages:
+            oldest = self._messages.popleft()
+            self.text.delete(oldest.mark, self._messages[0].mark)
+            self.text.mark_unset(oldest.mark)
+            if oldest.key is not None:
+                # The next older page starts with the dropped message
+                self._older_than = (oldest.key[0], oldest.key[1] + 1)
+                self._older_exhausted = False
+
+    # Paging
+
+    def _on_scroll(self, first: str, last: str) -> None:
+        self.text.vbar.set(first, last)
+        if self._paging_scheduled or self.load_page is None:
+            return
+        at_top = float(first) <= 0.0 and float(last) < 1.0
+        at_bottom = float(last) >= 1.0 and float(first) > 0.0
+        if (at_top and self._older_key() is not None) or (at_bottom and self._newer_hidden):
+            # Not while Tk is redrawing; the page is loaded right after
+            self._paging_scheduled = True
+            self.text.after_idle(self._page, at_top)
+
+    def _page(self, older: bool) -> None:
+        self._paging_scheduled = False
+        try:
+            if older:
+                self.load_older()
+            else:
+                self._show_latest()
+                self.text.see(tk.END)
+        except Exception as e:
+            logger.warning("Error loading the transcript: %s", e)
+
+    def _older_key(self) -> Optional[MessageKey]:
+        """The stored message the next older page ends before"""
+        if self._older_exhausted:
+            return None
+        rendered = next((entry.key for entry in self._messages if entry.key is not None), None)
+        # Internal messages loaded with a page are not rendered but still bound it
+        candidates = [key for key in (rendered, self._older_than) if key is not None]
+        return min(candidates) if candidates else None
+
+    def load_older(self, session_id: Optional[int] = None) -> int:
+        """
+        Page earlier stored messages in above the oldest rendered one
+        Args:
+            session_id: Session to start from when no stored message is rendered yet,
+                e.g. a restored session
+        Returns:
+            int: Number of messages loaded
+        """
+        if self.load_page is None:
+            return 0
+        key = self._older_key()
+        if key is not None:
+            session_id, before_seq = key
+        elif session_id is None or self._older_exhausted:
+            return 0
+        else:
+            before_seq = None
+        rows = self.load_page(session_id, self.page_size, before_seq)
+        if len(rows) < self.page_size:
+            # Paging stays within one session
+            self._older_exhausted = True
+        if not rows:
+            return 0
+        _PAGED.inc()
+
+        previous_first = self._messages[0].mark if self._messages else None
+        for row in reversed(self._visible(rows)):
+            first = self._messages[0].mark if self._messages else None
+            if first is not None:
+                # Keep the first message's mark after the text inserted in front of it
+                self.text.mark_gravity(first, tk.RIGHT)
+            self._insert("1.0", self._speaker(row), row["text"])
+            if first is not None:
+                self.text.mark_gravity(first, tk.LEFT)
+            self._messages.appendleft(_Message(self._new_mark("1.0"), (session_id, row["seq"])))
+        if previous_first is not None:
+            # Stay where the reader was
+            self.text.yview(previous_first)
+        self._older_than = (session_id, rows[0]["seq"])
+        if self._latest is None:
+            self._latest = (session_id, rows[-1]["seq"])
+        self._drop_newest()
+        return len(rows)
+
+    def _drop_newest(self) -> None:
+        while len(self._messages) > self.max_messages:
+            newest = self._messages.pop()
+            self.text.delete(newest.mark, "end-1c")
+            self.text.mark_unset(newest.mark)
+            self._newer_hidden = True
+
+    def _show_latest(self, skip_from: Optional[MessageKey] = None) -> None:
+        """
+        Replace the paged-in history with the newest stored page
+        Args:
+            skip_from: Leave out this message and later ones, which are about to be appended
+        """
+        self._newer_hidden = False
+        for entry in self._messages:
+            self.text.mark_unset(entry.mark)
+        self._messages.clear()
+        self.text.delete("1.0", "end-1c")
+        self._older_than = None
+        self._older_exhausted = False
+        if self._latest is None or self.load_page is None:
+            return
+        session_id = self._latest[0]
+        rows = self.load_page(session_id, self.page_size, None)
+        if skip_from is not None and skip_from[0] == session_id:
+            rows = [row for row in rows if row["seq"] < skip_from[1]]
+        if rows:
+            self._older_than = (session_id, rows[0]["seq"])
+        for row in self._visible(rows):
+            self._messages.append(_Message(self._new_mark("end-1c"), (session_id, row["seq"])))
+            self._insert("end-1c", self._speaker(row), row["text"])
+
+    @staticmethod
+    def _visible(rows: List[Dict]) -> List[Dict]:
+        return [row for row in rows if not row.get("internal")]
+
+    @staticmethod
+    def _speaker(row: Dict) -> str:
+        if row["role"] == "user":
+            return "human"
+        return row.get("model") or "Assistant"
@@ -0,0 +1,201 @@
+# tts_cache.py
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import metrics, record_cache
+
+logger = logging.getLogger(__name__)
+
+_SAVED_BYTES = metrics.counter("tts_cache_saved_bytes_total", "Speech audio served from the cache instead of downloaded")
+
+# Sentence ends: Latin punctuation followed by a space, CJK punctuation, or a line break
+_CJK_SENTENCE_END = "。！？；"
+_SENTENCE_END = re.compile(rf"(?<=[.!?;:])\s+|(?<=[{_CJK_SENTENCE_END}])|\n+")
+# Sentences shorter than this are spoken together with the next one
+MIN_SENTENCE_CHARS = 24
+
+
+def normalize_text(text: str) -> str:
+    """Text as far as the synthesized speech is concerned: NFC, single spaces, no outer whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _join(first: str, second: str) -> str:
+    if not first:
+        return second
+    return first + second if first[-1] in _CJK_SENTENCE_END else f"{first} {second}"
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split a reply into the pieces that are synthesized and cached one by one
+    Very short sentences are joined to the next one, so "OK." does not cost a request of its own.
+    """
+    sentences = []
+    pending = ""
+    for part in _SENTENCE_END.split(text):
+        part = normalize_text(part)
+        if not part:
+            continue
+        pending = _join(pending, part)
+        if len(pending) >= MIN_SENTENCE_CHARS:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences and len(pending) < MIN_SENTENCE_CHARS // 2:
+            sentences[-1] = _join(sentences[-1], pending)
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+class SpeechCache:
+    """
+    Content-addressed cache of synthesized speech on disk.
+
+    Each entry is one audio file named after a hash of the model, the
+    voice, the audio format and the normalized text. The directory is limited to max_bytes; the
+    least recently used entries are deleted first. Recency is kept in the
+    files' modification times, so it survives restarts.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None,
+                 audio_format: str = "pcm"):
+        """
+        Args:
+            directory: Cache directory, defaults to CYBERDECK_TTS_CACHE_DIR (tts_cache/)
+            max_bytes: Size limit, defaults to CYBERDECK_TTS_CACHE_MB (200 MB); 0 disables the cache
+            audio_format: Format of the stored audio, also the file extension
+        """
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("CYBERDECK_TTS_CACHE_MB", "200")) * 1024 * 1024)
+        self.directory = Path(directory or os.environ.get("CYBERDECK_TTS_CACHE_DIR", "tts_cache"))
+        self.max_bytes = max_bytes
+        self.audio_format = audio_format
+        self._lock = threading.Lock()
+        # Key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+        if self.enabled:
+            self._load()
+        metrics.gauge("tts_cache_bytes", "Size of the speech cache on disk").set_function(lambda: self._total)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load(self) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = []
+            for path in self.directory.iterdir():
+                if path.suffix == ".tmp":
+                    # Left over from an interrupted put()
+                    path.unlink(missing_ok=True)
+                else:
+                    # Entries in other formats are counted too, so they age out under the same limit
+                    files.append((path.stat(), path))
+        except OSError as e:
+            logger.warning("Speech cache unavailable: %s", e)
+            self.max_bytes = 0
+            return
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            self._entries[path.name] = stat.st_size
+            self._total += stat.st_size
+        logger.debug("Speech cache: %s entries, %.1f MB", len(self._entries), self._total / 1024 / 1024)
+        self._evict()
+
+    def key(self, text: str, voice: str, model: str) -> str:
+        """File name of an entry"""
+        digest = hashlib.sha256(f"{model}\0{voice}\0{self.audio_format}\0{normalize_text(text)}".encode("utf-8"))
+        return f"{digest.hexdigest()}.{self.audio_format}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, text: str, voice: str, model: str) -> Optional[bytes]:
+        """
+        Returns:
+            Optional[bytes]: The cached audio, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        key = self.key(text, voice, model)
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        data = None
+        if known:
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                now = time.time()
+                os.utime(path, (now, now))
+            except OSError:
+                # Deleted behind our back
+                self._forget(key)
+        record_cache("tts", data is not None)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.saved_bytes += len(data)
+            _SAVED_BYTES.inc(len(data))
+        return data
+
+    def stats(self) -> Dict[str, float]:
+        """Lookups and savings since startup"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_bytes": self.saved_bytes
+        }
+
+    def put(self, text: str, voice: str, model: str, data: bytes) -> None:
+        """Store synthesized speech; failures only cost the next lookup a miss"""
+        if not self.enabled or not data:
+            return
+        key = self.key(text, voice, model)
+        path = self._path(key)
+        temporary = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        try:
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning("Could not store speech in the cache: %s", e)
+            temporary.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+        self._evict()
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+
+    def _evict(self) -> None:
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or not self._entries:
+                    return
+                key, size = self._entries.popitem(last=False)
+                self._total -= size
+            try:
+                self._path(key).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning("Could not evict %s from the speech cache: %s", key, e)
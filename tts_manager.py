@@ -1,11 +1,37 @@
 # tts_manager.py
-from pathlib import Path
-from openai import OpenAI
-import pygame
-import threading
+import logging
 import os
-from typing import Callable
+from openai_compat import openai_client
+from typing import Callable, Optional
 import time
+from rate_limiter import RateLimiter
+from key_manager import KeyManager
+from audio_engine import PRIORITY_NORMAL, AudioEngine, Utterance
+from tracing import tracer
+from metrics import metrics
+from session_recorder import recorder
+from tts_cache import SpeechCache, split_sentences
+
+logger = logging.getLogger(__name__)
+
+_TTS_CHARACTERS = metrics.counter("tts_characters_total", "Characters sent for speech synthesis", ("voice",))
+_TTS_SECONDS = metrics.histogram("tts_synthesis_seconds", "Time to download synthesized speech", ("voice",))
+
+TTS_MODEL = "tts-1"
+# The API's "pcm" format: 24 kHz, 16-bit signed little-endian, mono
+PCM_RATE = 24000
+PCM_SAMPLE_BYTES = 2
+# Largest piece written to the device at once, and so the worst-case stop delay: 50 ms
+WRITE_BYTES = PCM_RATE * PCM_SAMPLE_BYTES // 20
+
+
+def _output_device():
+    """CYBERDECK_AUDIO_OUTPUT: sounddevice device index or name, "none" to discard speech"""
+    device = os.environ.get("CYBERDECK_AUDIO_OUTPUT", "")
+    if not device:
+        return None
+    return int(device) if device.isdigit() else device
+
 
 class TTSManager:
     def __init__(self, api_key_path: str = "openai_key.txt"):
@@ -14,12 +40,14 @@ class TTSManager:
         Args:
             api_key_path (str): Path to the file containing the OpenAI API key
         """
-        self.client = OpenAI(api_key=self._load_api_key(api_key_path))
-        pygame.mixer.init()
-        self.is_playing = False
-        self.current_thread = None
-        self.current_audio_path = None
-        self._lock = threading.Lock()
+        self.client = openai_client(self._load_api_key(api_key_path), KeyManager.get_base_url("openai"))
+        # Synthesized sentences as raw PCM, reused across replies and restarts
+        self.cache = SpeechCache(audio_format="pcm")
+        # Owns the output device; synthesis and playback run on its threads
+        self.engine = AudioEngine(self._render, PCM_RATE, device=_output_device(), write_bytes=WRITE_BYTES)
+        self.last_utterance: Optional[Utterance] = None
+        metrics.gauge("tts_playing", "1 while speech is playing").set_function(lambda: self.is_playing)
+        metrics.gauge("tts_queue_depth", "Sentences waiting to be spoken").set_function(lambda: self.engine.depth)
    
         # Define voice mapping for different AI models
         self.voice_mapping = {
@@ -45,128 +73,97 @@ class TTSManager:
         except FileNotFoundError:
             raise Exception(f"API key file not found at {filepath}")
     
+    @property
+    def is_playing(self) -> bool:
+        return self.engine.playing
+
     def text_to_speech(self, 
                       text: str, 
                       #language: str = "en",
                       status_callback: Callable[[str], None] = None,
-                      model_name: str = "ChatGPT") -> None:
+                      model_name: str = "ChatGPT",
+                      priority: int = PRIORITY_NORMAL,
+                      interrupt: bool = True) -> Utterance:
         """
-        Convert text to speech using model-specific voice.
+        Queue text for speaking with the model-specific voice; returns at once.
+        Sentences found in the speech cache play immediately; the others are
+        synthesized on the audio engine's thread while earlier ones play.
         Args:
             text (str): Text to convert to speech
             language (str): Language code ('en', 'ja', 'zh')
             status_callback: Callback function to update status
             model_name (str): Name of the AI model for voice selection
+            priority: Position among queued utterances; lower is spoken first
+            interrupt: Stop whatever is speaking or queued first, as a new reply does
+        Returns:
+            Utterance: The queued utterance
         """
-        if status_callback:
-            status_callback("Generating speech...")
-        
-        # Stop any existing playback
-        self.stop_playback()
-        
-        # Create a unique filename
-        output_path = Path("/tmp") / f"tts_{os.getpid()}_{int(time.time()*1000)}.mp3"
-        
-        try:
-            # Select voice based on model and language
-            voice = self.voice_mapping.get(model_name, self.voice_mapping['default'])
-            
-            # Generate speech
+        # Select voice based on model and language
+        voice = self.voice_mapping.get(model_name, self.voice_mapping['default'])
+        utterance = self.last_utterance = Utterance(split_sentences(text), voice, priority, status_callback)
+        recorder.track_speech(utterance)
+        self.engine.speak(utterance, interrupt)
+        return utterance
+
+    def _render(self, text: str, voice: str, emit: Callable[[bytes], None],
+                cancelled: Callable[[], bool]) -> None:
+        """Produce one sentence's PCM, from the cache or the speech service (audio engine thread)"""
+        audio = self.cache.get(text, voice, TTS_MODEL)
+        if audio is not None:
+            emit(audio)
+            return
+        audio = self._synthesize(text, voice, emit, cancelled)
+        if audio is not None:
+            self.cache.put(text, voice, TTS_MODEL, audio)
+
+    def _synthesize(self, text: str, voice: str, emit: Callable[[bytes], None],
+                    cancelled: Callable[[], bool]) -> Optional[bytes]:
+        """
+        Stream speech for one sentence, passing each chunk on as it arrives
+        Returns:
+            Optional[bytes]: All of the PCM, or None if cancelled before the end
+        """
+        _TTS_CHARACTERS.inc(len(text), voice=voice)
+        synthesis_start = time.monotonic()
+        chunks = []
+        # Chunks can split a sample; an odd byte waits for the next chunk
+        carry = b""
+        with tracer.span("tts_synthesis", chars=len(text), voice=voice), \
+                RateLimiter.for_service("openai-tts").limit():
             with self.client.audio.speech.with_streaming_response.create(
-                model="tts-1",
+                model=TTS_MODEL,
                 voice=voice,
-                input=text
+                input=text,
+                response_format="pcm"
             ) as response:
-                response.stream_to_file(str(output_path))
-            
-            if status_callback:
-                status_callback("Playing audio...")
-            
-            with self._lock:
-                self.current_audio_path = output_path
-                self.current_thread = threading.Thread(
-                    target=self._play_audio,
-                    args=(output_path, status_callback)
-                )
-                self.current_thread.daemon = True
-                self.current_thread.start()
-            
-        except Exception as e:
-            print(f"Error in text to speech conversion: {e}")
-            if status_callback:
-                status_callback(f"Error: {str(e)}")
-            if output_path.exists():
-                try:
-                    os.remove(output_path)
-                except Exception as e:
-                    print(f"Error removing temporary file: {e}")
-
+                for chunk in response.iter_bytes():
+                    if cancelled():
+                        # Leaving the block closes the download
+                        return None
+                    chunk = carry + chunk
+                    usable = len(chunk) - len(chunk) % PCM_SAMPLE_BYTES
+                    carry = chunk[usable:]
+                    if usable:
+                        chunks.append(chunk[:usable])
+                        emit(chunk[:usable])
+        synthesis_time = time.monotonic() - synthesis_start
+        _TTS_SECONDS.observe(synthesis_time, voice=voice)
+        recorder.record_tts(len(text), synthesis_time)
+        return b"".join(chunks)
 
-    
-    def _play_audio(self, audio_path: Path, 
-                    status_callback: Callable[[str], None] = None) -> None:
+    def stop_playback(self):
         """
-        Play the audio file and clean up afterwards.
-        Args:
-            audio_path (Path): Path to the audio file to play
-            status_callback: Callback function to update status
+        Stop speaking at once and drop everything queued (Esc).
         """
-        try:
-            with self._lock:
-                if not self.is_playing:
-                    pygame.mixer.music.load(str(audio_path))
-                    self.is_playing = True
-                    pygame.mixer.music.play()
-            
-            # Wait for playback to finish or stop command
-            while self.is_playing and pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-            
-        except Exception as e:
-            print(f"Error playing audio: {e}")
-            if status_callback:
-                status_callback(f"Error playing audio: {str(e)}")
-        
-        finally:
-            # Cleanup
-            with self._lock:
-                self.is_playing = False
-                try:
-                    pygame.mixer.music.stop()
-                    pygame.mixer.music.unload()
-                except Exception as e:
-                    print(f"Error stopping audio: {e}")
-                
-                if audio_path.exists():
-                    try:
-                        os.remove(audio_path)
-                    except Exception as e:
-                        print(f"Error removing audio file: {e}")
-                
-                if status_callback:
-                    status_callback("")
-                
-                self.current_audio_path = None
-    
-    def stop_playback(self):
+        self.engine.flush()
+
+    def wait_synthesized(self, timeout: Optional[float] = None) -> bool:
         """
-        Safely stop the current audio playback.
+        Wait until all queued speech is synthesized
+        Returns:
+            bool: False on timeout
         """
-        with self._lock:
-            if self.is_playing:
-                self.is_playing = False
-                try:
-                    pygame.mixer.music.stop()
-                    pygame.mixer.music.unload()
-                except Exception as e:
-                    print(f"Error stopping playback: {e}")
-                
-                # Clean up current audio file
-                if self.current_audio_path and self.current_audio_path.exists():
-                    try:
-                        os.remove(self.current_audio_path)
-                    except Exception as e:
-                        print(f"Error removing current audio file: {e}")
-                
-                self.current_audio_path = None
+        return self.engine.wait_rendered(timeout)
 
+    def close(self) -> None:
+        self.engine.shutdown()
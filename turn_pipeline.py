@@ -0,0 +1,220 @@
+# turn_pipeline.py
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from cancellation import CancelToken, use_token
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_FRAME_DELAY = metrics.histogram("ui_frame_delay_seconds", "How late the Tk thread ran its drain tick",
+                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+_JOBS = metrics.counter("pipeline_jobs_total", "Worker jobs by outcome", ("job", "outcome"))
+
+
+class TurnPipeline:
+    """
+    Runs conversation turns on a worker thread and hands results back to Tk.
+
+    At most one job runs at a time, with a bounded queue of pending jobs behind
+    it. Worker threads never touch widgets: everything they want shown is
+    posted to a thread-safe queue that the Tk main loop drains with after().
+    The drain loop doubles as a frame-latency probe for the UI thread.
+
+    Every job runs with its own CancelToken installed as the worker's current
+    token, so cancel_all() reaches provider calls, tool calls and speech
+    synthesis started by the job.
+    """
+
+    def __init__(self, master, max_pending: int = 2, poll_interval_ms: int = 20):
+        """
+        Args:
+            master: Tk root window
+            max_pending: Jobs allowed to wait behind the active one
+            poll_interval_ms: How often the Tk thread drains the UI queue
+        """
+        self.master = master
+        self.poll_interval_ms = poll_interval_ms
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._ui_queue = queue.Queue()
+        self._running = True
+        self._main_thread = threading.current_thread()
+        self.active_job: Optional[str] = None
+        self._active_token: Optional[CancelToken] = None
+        # Bumped by cancel_all(); a job taken from the queue under an older
+        # generation was cancelled before it became active
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        # Time from cancel() until the cancelled job actually returned
+        self.cancel_latencies = deque(maxlen=100)
+
+        # UI frame latency: how late each drain tick ran versus its schedule
+        self._frame_delays = deque(maxlen=500)
+        self._last_tick = time.monotonic()
+
+        metrics.gauge("pipeline_pending", "Jobs waiting behind the active one").set_function(
+            self._jobs.qsize
+        )
+        metrics.gauge("ui_queue_depth", "Callbacks waiting for the Tk thread").set_function(
+            self._ui_queue.qsize
+        )
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        self.master.after(self.poll_interval_ms, self._drain)
+
+    def submit(self,
+               work: Callable[[], Any],
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None,
+               name: str = "turn",
+               cancellable: bool = True) -> bool:
+        """
+        Queue a job for the worker thread
+        Args:
+            work: Runs on the worker thread
+            on_done: Called on the Tk thread with work's return value
+            on_error: Called on the Tk thread if work raises
+            name: Label used for debugging and status reporting
+            cancellable: False for jobs that must run even after cancel_all()
+        Returns:
+            bool: False if the pending queue is full and the job was rejected
+        """
+        try:
+            with self._lock:
+                self._jobs.put_nowait((name, work, on_done, on_error, cancellable, self._generation))
+            return True
+        except queue.Full:
+            logger.warning("Pipeline busy, rejected job: %s", name)
+            _JOBS.inc(job=name, outcome="rejected")
+            return False
+
+    def post(self, callback: Callable, *args) -> None:
+        """Run callback(*args) on the Tk thread; safe to call from any thread"""
+        self._ui_queue.put((callback, args))
+
+    def in_main_thread(self) -> bool:
+        return threading.current_thread() is self._main_thread
+
+    @property
+    def pending(self) -> int:
+        return self._jobs.qsize()
+
+    @property
+    def busy(self) -> bool:
+        return self.active_job is not None or not self._jobs.empty()
+
+    def _run(self) -> None:
+        while self._running:
+            try:
+                name, work, on_done, on_error, cancellable, generation = self._jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            token = CancelToken()
+            with self._lock:
+                self.active_job = name
+                self._active_token = token
+                if cancellable and generation != self._generation:
+                    # cancel_all() ran between get() and here, when the job
+                    # was neither queued nor active
+                    token.cancel()
+            try:
+                with use_token(token):
+                    token.raise_if_cancelled()
+                    result = work()
+            except Exception as e:
+                logger.warning("Pipeline job %s failed: %s", name, e)
+                _JOBS.inc(job=name, outcome="cancelled" if token.cancelled else "error")
+                if on_error:
+                    self.post(on_error, e)
+            else:
+                _JOBS.inc(job=name, outcome="ok")
+                if on_done:
+                    self.post(on_done, result)
+            finally:
+                self.active_job = None
+                self._active_token = None
+                if token.cancelled_at is not None:
+                    latency = time.monotonic() - token.cancelled_at
+                    self.cancel_latencies.append(latency)
+                    logger.debug("Job %s stopped %.0f ms after cancel", name, latency * 1000)
+
+    def cancel_all(self) -> int:
+        """
+        Cancel the active job and drop every pending cancellable one
+        Returns:
+            int: Number of jobs cancelled or dropped
+        """
+        dropped = 0
+        kept = []
+        with self._lock:
+            self._generation += 1
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job[4]:
+                    dropped += 1
+                else:
+                    kept.append(job)
+            for job in kept:
+                self._jobs.put_nowait(job)
+            token = self._active_token
+        if token is not None and not token.cancelled:
+            token.cancel()
+            dropped += 1
+        return dropped
+
+    def _drain(self) -> None:
+        now = time.monotonic()
+        expected = self.poll_interval_ms / 1000.0
+        delay = max(0.0, now - self._last_tick - expected)
+        self._frame_delays.append(delay)
+        _FRAME_DELAY.observe(delay)
+        self._last_tick = now
+
+        while True:
+            try:
+                callback, args = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.warning("Error in UI callback: %s", e)
+
+        if self._running:
+            self.master.after(self.poll_interval_ms, self._drain)
+
+    def get_ui_latency_stats(self) -> Dict[str, float]:
+        """Return how late the Tk thread serviced its drain ticks, in milliseconds"""
+        delays = sorted(self._frame_delays)
+        if not delays:
+            return {"samples": 0, "mean_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(delays),
+            "mean_ms": sum(delays) / len(delays) * 1000,
+            "p95_ms": delays[min(len(delays) - 1, int(len(delays) * 0.95))] * 1000,
+            "max_ms": delays[-1] * 1000,
+        }
+
+    def get_cancel_latency_stats(self) -> Dict[str, float]:
+        """Return how long cancelled jobs kept running after cancel(), in milliseconds"""
+        latencies = sorted(self.cancel_latencies)
+        if not latencies:
+            return {"samples": 0, "mean_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(latencies),
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+
+    def shutdown(self) -> None:
+        self._running = False
+        self.cancel_all()
@@ -0,0 +1,234 @@
+# vad.py
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_SILENCE_TRIMMED = metrics.counter("audio_silence_trimmed_seconds_total",
+                                   "Recorded silence cut before transcription")
+
+# trim() never puts the noise floor closer than this to the loudest frame
+FLOOR_BELOW_PEAK_DB = 20.0
+# Recordings this far above min_level_db are sent untrimmed rather than dropped
+LOUD_RECORDING_DB = 10.0
+
+
+class VoiceActivityDetector:
+    """
+    Frame energy plus zero-crossing voice activity detection, vectorized with NumPy.
+
+    Each 20 ms frame gets its energy (dB relative to full scale) and its
+    zero-crossing rate. The noise floor is a low percentile of the frame
+    energies, so the thresholds follow the room rather than a fixed level.
+    Speech regions use hysteresis: a run of frames above the lower stop_db
+    threshold counts as speech only if it contains a frame above start_db,
+    and it is extended by a short hangover so word endings and short
+    pauses are kept. Quiet, noisy fricatives ("s", "sh") stay in a run
+    through their high zero-crossing rate.
+    """
+
+    def __init__(self,
+                 frame_ms: int = 20,
+                 start_db: float = 12.0,
+                 stop_db: float = 6.0,
+                 min_level_db: float = -50.0,
+                 fricative_zcr: float = 0.3,
+                 hangover_ms: int = 200):
+        """
+        Args:
+            frame_ms: Analysis frame length
+            start_db: Margin over the noise floor that starts speech
+            stop_db: Margin over the noise floor that keeps speech going
+            min_level_db: Frames quieter than this are never speech (dBFS)
+            fricative_zcr: Zero-crossing rate (per sample) of unvoiced speech
+            hangover_ms: Speech is extended by this much after it drops below stop_db
+        """
+        self.frame_ms = frame_ms
+        self.start_db = start_db
+        self.stop_db = stop_db
+        self.min_level_db = min_level_db
+        self.fricative_zcr = fricative_zcr
+        self.hangover_frames = max(0, hangover_ms // frame_ms)
+
+    def frame_length(self, sample_rate: int) -> int:
+        return max(1, sample_rate * self.frame_ms // 1000)
+
+    def features(self, audio: np.ndarray, sample_rate: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (energy in dBFS, zero-crossing rate) per frame
+        """
+        length = self.frame_length(sample_rate)
+        count = len(audio) // length
+        frames = audio[:count * length].reshape(count, length)
+        energy = 10 * np.log10(np.mean(np.square(frames, dtype=np.float32), axis=1) + 1e-10)
+        crossings = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1)
+        return energy, crossings / length
+
+    def estimate_noise_floor(self, audio: np.ndarray, sample_rate: int,
+                             previous: Optional[float] = None) -> Optional[float]:
+        """
+        Noise floor in dBFS: the 10th percentile of frame energies
+        Args:
+            previous: Earlier estimate; the lower of the two is returned
+        """
+        energy, _ = self.features(audio, sample_rate)
+        if not len(energy):
+            return previous
+        floor = float(np.percentile(energy, 10))
+        return floor if previous is None else min(previous, floor)
+
+    def speech_frames(self, audio: np.ndarray, sample_rate: int,
+                      noise_floor: Optional[float] = None) -> np.ndarray:
+        """
+        Per-frame speech flags
+        Args:
+            noise_floor: Known floor in dBFS, estimated from audio when None
+        """
+        energy, zcr = self.features(audio, sample_rate)
+        if not len(energy):
+            return np.zeros(0, dtype=bool)
+        if noise_floor is None:
+            noise_floor = float(np.percentile(energy, 10))
+        return self._speech(energy, zcr, noise_floor)
+
+    def _speech(self, energy: np.ndarray, zcr: np.ndarray, noise_floor: float) -> np.ndarray:
+        start_level = max(noise_floor + self.start_db, self.min_level_db)
+        stop_level = max(noise_floor + self.stop_db, self.min_level_db)
+
+        above_stop = (energy > stop_level) | ((energy > noise_floor + self.stop_db / 2)
+                                              & (zcr > self.fricative_zcr) & (energy > self.min_level_db))
+        above_start = energy > start_level
+
+        # Hysteresis: keep the runs of above_stop that contain an above_start frame
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], above_stop.astype(np.int8), [0]))))
+        run_starts, run_ends = edges[0::2], edges[1::2]
+        speech = np.zeros(len(energy), dtype=bool)
+        if len(run_starts):
+            # Sums reach up to the next run start, but start frames are always inside a run
+            triggered = np.add.reduceat(above_start.astype(np.int32), run_starts) > 0
+            steps = np.zeros(len(energy) + 1, dtype=np.int32)
+            np.add.at(steps, run_starts[triggered], 1)
+            np.add.at(steps, run_ends[triggered], -1)
+            speech = np.cumsum(steps[:-1]) > 0
+
+        if self.hangover_frames and speech.any():
+            # Extend every speech frame forward by the hangover
+            kernel = np.ones(self.hangover_frames + 1, dtype=np.int32)
+            speech = np.convolve(speech.astype(np.int32), kernel)[:len(speech)] > 0
+        return speech
+
+    def trim(self, audio: np.ndarray, sample_rate: int, padding_seconds: float = 0.15,
+             noise_floor: Optional[float] = None) -> np.ndarray:
+        """
+        Cut leading and trailing silence
+        Args:
+            noise_floor: Floor in dBFS measured outside the recording, e.g. from the
+                audio before it started; estimated from audio when None
+        Returns:
+            np.ndarray: The speech with padding_seconds on each side, empty if no speech was found
+        """
+        energy, zcr = self.features(audio, sample_rate)
+        if not len(energy):
+            return audio[:0]
+        peak = float(energy.max())
+        if noise_floor is None:
+            noise_floor = float(np.percentile(energy, 10))
+        # A recording that is almost all speech has its low percentile inside the speech
+        noise_floor = min(noise_floor, peak - FLOOR_BELOW_PEAK_DB)
+        indices = np.flatnonzero(self._speech(energy, zcr, noise_floor))
+        if not len(indices):
+            if peak > self.min_level_db + LOUD_RECORDING_DB:
+                logger.warning("No speech found in a %.1f s recording peaking at %.0f dBFS, keeping all of it",
+                               len(audio) / sample_rate, peak)
+                return audio
+            _SILENCE_TRIMMED.inc(len(audio) / sample_rate)
+            return audio[:0]
+        length = self.frame_length(sample_rate)
+        padding = int(padding_seconds * sample_rate)
+        start = max(0, indices[0] * length - padding)
+        end = min(len(audio), (indices[-1] + 1) * length + padding)
+        _SILENCE_TRIMMED.inc((len(audio) - (end - start)) / sample_rate)
+        return audio[start:end]
+
+    def find_pause(self, audio: np.ndarray, sample_rate: int, min_pause_seconds: float = 0.25,
+                   noise_floor: Optional[float] = None) -> Optional[int]:
+        """
+        Find the last pause between words, where audio can be split without cutting speech
+        Args:
+            min_pause_seconds: Shortest pause, on top of the hangover
+            noise_floor: Known floor in dBFS, estimated from audio when None
+        Returns:
+            Optional[int]: Sample index in the middle of the last pause that follows speech, or None
+        """
+        quiet = ~self.speech_frames(audio, sample_rate, noise_floor)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], quiet.astype(np.int8), [0]))))
+        starts, ends = edges[0::2], edges[1::2]
+        # A quiet run at the very start has no speech before it
+        pauses = np.flatnonzero((ends - starts >= min_pause_seconds * 1000 / self.frame_ms) & (starts > 0))
+        if not len(pauses):
+            return None
+        last = pauses[-1]
+        return int((starts[last] + ends[last]) // 2 * self.frame_length(sample_rate))
+
+
+class EndpointDetector:
+    """
+    Decides when a hands-free recording is over.
+
+    Fed the most recent audio every poll, it waits for speech to start,
+    then reports the end of the utterance once the last silence_seconds
+    contain no speech. It also gives up if nobody speaks within
+    no_speech_timeout seconds.
+    """
+
+    def __init__(self,
+                 vad: VoiceActivityDetector,
+                 silence_seconds: Optional[float] = None,
+                 no_speech_timeout: float = 8.0):
+        """
+        Args:
+            silence_seconds: Trailing silence that ends the utterance, defaults to
+                CYBERDECK_VAD_SILENCE_MS (1000 ms)
+            no_speech_timeout: Seconds to wait for the user to start speaking
+        """
+        if silence_seconds is None:
+            silence_seconds = int(os.environ.get("CYBERDECK_VAD_SILENCE_MS", "1000")) / 1000
+        self.vad = vad
+        self.silence_seconds = silence_seconds
+        self.no_speech_timeout = no_speech_timeout
+        self.heard_speech = False
+        self.noise_floor: Optional[float] = None
+
+    def reset(self) -> None:
+        self.heard_speech = False
+        self.noise_floor = None
+
+    def window_seconds(self) -> float:
+        """How much recent audio update() needs"""
+        return self.silence_seconds + 0.5
+
+    def update(self, recent: np.ndarray, sample_rate: int, elapsed: float) -> bool:
+        """
+        Args:
+            recent: The last window_seconds() of the recording
+            elapsed: Seconds since the recording started
+        Returns:
+            bool: True when the recording should stop
+        """
+        # The quietest stretch heard so far is the room's noise floor
+        self.noise_floor = self.vad.estimate_noise_floor(recent, sample_rate, self.noise_floor)
+        if self.noise_floor is None:
+            return False
+        speech = self.vad.speech_frames(recent, sample_rate, self.noise_floor)
+        if not self.heard_speech:
+            self.heard_speech = bool(speech.any())
+            return not self.heard_speech and elapsed > self.no_speech_timeout
+
+        tail_frames = int(self.silence_seconds * 1000 // self.vad.frame_ms)
+        return len(speech) >= tail_frames and not speech[-tail_frames:].any()